@@ -3,7 +3,9 @@
 Assemble package index from Cloudflare R2 bucket.
 
 This script:
-1. Lists all .mhl.mip.json files in the R2 bucket
+1. Reads the .mhl.mip.json keys from the index journal in the R2 bucket
+   (or lists the bucket, and rebuilds the journal, if there is none yet
+   or with --full-listing)
 2. Downloads each .mip.json file
 3. Assembles them into a consolidated index.json
 4. Generates a human-readable packages.html
@@ -25,20 +27,36 @@ except ImportError:
     print("Error: boto3 is required. Install with: pip install boto3")
     sys.exit(1)
 
+from index_journal import IndexJournal
+
+# Per-build fields left out of index.json entries. Clients that need them
+# (e.g. the file manifest for delta updates) fetch the build's .mip.json
+# from its mip_json_url.
+INDEX_OMITTED_FIELDS = ('files', 'symbol_table')
+
+
 class IndexAssembler:
     """Handles assembling package index from R2 bucket."""
     
-    def __init__(self, dry_run=False):
+    def __init__(self, dry_run=False, full_listing=False):
         """
         Initialize the index assembler.
         
         Args:
             dry_run: If True, simulate operations without actual downloading
+            full_listing: If True, list the bucket and rebuild the index journal
+                from the listing, even if there is one
         """
         self.dry_run = dry_run
+        self.full_listing = full_listing
         self.base_url = "https://mip-packages.neurosift.app/core/packages"
         self.bucket_name = "mip-packages"
         self.bucket_prefix = "core/packages"
+        self.public_url = "https://mip-packages.neurosift.app"
+        # Journal entries of the listed .mip.json files, and the keys of
+        # those that turned out to be deleted
+        self.journal_entries = {}
+        self.missing_keys = []
         
         # Initialize R2 client
         if not dry_run:
@@ -63,17 +81,18 @@ class IndexAssembler:
             endpoint_url=endpoint_url,
             region_name='auto'  # R2 uses 'auto' for region
         )
+        self.journal = IndexJournal(self.s3_client, self.bucket_name)
     
-    def _list_mip_json_files(self):
+    def _list_bucket(self):
         """
-        List all .mhl.mip.json files in the bucket.
+        List the .mhl.mip.json files in the bucket.
         
         Returns:
-            List of S3 keys for .mip.json files
+            Dict of S3 key -> {'etag', 'updated'} of each .mip.json file
         """
         print(f"Listing packages in s3://{self.bucket_name}/{self.bucket_prefix}/")
         
-        mip_json_keys = []
+        entries = {}
         
         try:
             paginator = self.s3_client.get_paginator('list_objects_v2')
@@ -89,13 +108,48 @@ class IndexAssembler:
                 for obj in page['Contents']:
                     key = obj['Key']
                     if key.endswith('.mhl.mip.json'):
-                        mip_json_keys.append(key)
+                        entries[key] = {
+                            'etag': obj['ETag'],
+                            'updated': obj['LastModified'].isoformat()
+                        }
             
-            print(f"  Found {len(mip_json_keys)} .mip.json file(s)")
-            return mip_json_keys
+            print(f"  Found {len(entries)} .mip.json file(s)")
             
         except ClientError as e:
             raise Exception(f"Failed to list bucket contents: {e}")
+        
+        return entries
+    
+    def _list_mip_json_files(self):
+        """
+        Get the keys of all .mhl.mip.json files in the bucket.
+        
+        They are read from the index journal. Without a complete journal,
+        or with --full-listing, the bucket is listed and the journal is
+        rebuilt from the listing.
+        
+        Returns:
+            List of S3 keys for .mip.json files
+        """
+        if not self.full_listing:
+            try:
+                entries, _ = self.journal.load()
+            except (ClientError, ValueError) as e:
+                raise Exception(f"Failed to read index journal: {e}")
+            if entries is not None:
+                print(f"Reading packages from s3://{self.bucket_name}/{self.journal.key}")
+                print(f"  Found {len(entries)} .mip.json file(s)")
+                self.journal_entries = entries
+                return list(entries)
+            print(f"No complete index journal at s3://{self.bucket_name}/{self.journal.key}")
+        
+        try:
+            entries = self.journal.rebuild(self._list_bucket)
+        except (ClientError, ValueError) as e:
+            raise Exception(f"Failed to rebuild index journal: {e}")
+        print(f"  Rebuilt index journal s3://{self.bucket_name}/{self.journal.key}")
+        self.journal_entries = entries
+        return list(entries)
     
     def _download_mip_json(self, key):
         """
@@ -116,8 +170,13 @@ class IndexAssembler:
             content = response['Body'].read().decode('utf-8')
             metadata = json.loads(content)
             
-            # Ensure mhl_url is present (for backwards compatibility)
-            if 'mhl_url' not in metadata:
+            # Content-addressed archives: the URL follows from the key
+            if 'mhl_key' in metadata:
+                metadata['mhl_url'] = f"{self.public_url}/{metadata['mhl_key']}"
+            
+            # Ensure mhl_url is present (for backwards compatibility);
+            # layers-only builds have no .mhl
+            if 'mhl_url' not in metadata and not metadata.get('layers_only'):
                 # Extract the .mhl filename from the key
                 # Key format: core/packages/name-version-matlab-abi-platform.mhl.mip.json
                 filename = os.path.basename(key)
@@ -131,15 +190,92 @@ class IndexAssembler:
                 mhl_filename = filename[:-9]  # Remove '.mip.json'
                 metadata['mip_json_url'] = f"{self.base_url}/{mhl_filename}.mip.json"
             
+            # Resolve URLs of alternative encodings (e.g. .mhl.zst) and
+            # of layers (extracted in order: base, then overlay)
+            for entry in metadata.get('variants', []) + metadata.get('layers', []):
+                if 'key' in entry:
+                    entry['url'] = f"{self.public_url}/{entry['key']}"
+                elif 'url' not in entry and 'filename' in entry:
+                    entry['url'] = f"{self.base_url}/{entry['filename']}"
+            
             return metadata
             
         except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                print(f"  Warning: {key} no longer exists")
+                self.missing_keys.append(key)
+                return None
             print(f"  Warning: Failed to download {key}: {e}")
             return None
         except json.JSONDecodeError as e:
             print(f"  Warning: Failed to parse JSON from {key}: {e}")
             return None
     
+    def _index_entry(self, metadata):
+        """Get a package's index.json entry: its metadata without INDEX_OMITTED_FIELDS."""
+        return {
+            field: value for field, value in metadata.items()
+            if field not in INDEX_OMITTED_FIELDS
+        }
+    
+    def _remove_missing_from_journal(self):
+        """Drop the journal entries of .mip.json files that no longer exist."""
+        stale = {
+            key: self.journal_entries[key]['etag']
+            for key in self.missing_keys if key in self.journal_entries
+        }
+        try:
+            removed = self.journal.remove(stale)
+        except ClientError as e:
+            print(f"  Warning: Failed to update index journal: {e}")
+            return
+        print(f"  Removed {removed} deleted package(s) from the index journal")
+    
+    def _build_symbol_index(self, package_metadata):
+        """
+        Build a consolidated symbol table across all packages.
+        
+        Args:
+            package_metadata: List of package metadata dicts
+        
+        Returns:
+            Tuple of (symbols, collisions). symbols maps each symbol name to
+            the list of builds providing it, each with package, build,
+            kind and path. collisions maps each symbol provided by more than
+            one package to the sorted list of those package names.
+        """
+        symbols = {}
+        
+        for pkg in package_metadata:
+            mip_json_url = pkg.get('mip_json_url', '')
+            build = os.path.basename(mip_json_url)[:-len('.mip.json')]
+            
+            entries = pkg.get('symbol_table')
+            if entries is None:
+                # Older builds only publish a flat list of names
+                entries = [
+                    {'name': name, 'kind': None, 'path': None}
+                    for name in pkg.get('exposed_symbols', [])
+                ]
+            
+            for entry in entries:
+                symbols.setdefault(entry['name'], []).append({
+                    'package': pkg.get('name'),
+                    'build': build,
+                    'kind': entry.get('kind'),
+                    'path': entry.get('path')
+                })
+        
+        collisions = {}
+        for name, providers in symbols.items():
+            packages = sorted(set(p['package'] for p in providers))
+            if len(packages) > 1:
+                collisions[name] = packages
+        
+        sorted_symbols = {name: symbols[name] for name in sorted(symbols)}
+        sorted_collisions = {name: collisions[name] for name in sorted(collisions)}
+        return sorted_symbols, sorted_collisions
+    
     def _generate_index_html(self, package_metadata, last_updated):
         """
         Generate a human-readable HTML index from package metadata.
@@ -338,11 +474,29 @@ class IndexAssembler:
                     package_metadata.append(metadata)
             
             print(f"\nSuccessfully downloaded {len(package_metadata)} package metadata file(s)")
+            
+            if self.missing_keys:
+                self._remove_missing_from_journal()
+        
+        # Build the cross-package symbol table
+        symbols, symbol_collisions = self._build_symbol_index(package_metadata)
+        print(f"\nIndexed {len(symbols)} symbol(s)")
+        if symbol_collisions:
+            print(f"  Warning: {len(symbol_collisions)} symbol(s) provided by more than one package")
+        
+        # The symbol tables are merged into symbols above; the entries
+        # only keep what is needed to choose and download a build
+        package_metadata = [self._index_entry(metadata) for metadata in package_metadata]
         
         # Create index data
         index_data = {
             'packages': package_metadata,
             'total_packages': len(package_metadata),
+            'symbols': symbols,
+            'symbol_collisions': symbol_collisions,
+            # Layered packages: extract each package's layers in this order
+            # into one directory to get the contents of its .mhl
+            'layer_order': ['base', 'overlay'],
             'last_updated': datetime.utcnow().isoformat() + 'Z'
         }
         
@@ -391,11 +545,16 @@ def main():
         action='store_true',
         help='Simulate operations without downloading'
     )
+    parser.add_argument(
+        '--full-listing',
+        action='store_true',
+        help='List the bucket and rebuild the index journal from the listing'
+    )
     
     args = parser.parse_args()
     
     # Create assembler
-    assembler = IndexAssembler(dry_run=args.dry_run)
+    assembler = IndexAssembler(dry_run=args.dry_run, full_listing=args.full_listing)
     
     # Assemble index
     print("Starting index assembly process...")
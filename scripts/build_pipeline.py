@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+"""
+Run the prepare -> compile -> bundle -> upload pipeline per package.
+
+Instead of running each script to completion for every package before
+starting the next one, this driver streams packages through the stages:
+1. Packages are fed to the prepare stage in dependency order
+2. Each prepared .dir moves on to compile (if it has a compile_script)
+   as soon as it is ready
+3. Each compiled .dir is bundled into a .mhl file
+4. Each .mhl file is uploaded to R2
+
+Stages are connected by bounded queues and each stage has its own pool
+of workers, so one package can be uploading while another is still
+cloning. The total time is roughly that of the slowest package's path
+through the stages rather than the sum of every stage's total.
+
+Each package's output from each stage is captured and printed as one
+block when that step finishes.
+
+A build's manifest record (see prepare_packages.py) is only written once
+its .mhl has made it through the last stage, so a build whose compile,
+bundle or upload failed is not skipped on the next run.
+
+As with the standalone scripts, a package whose dependency failed is
+skipped. Because packages overtake each other in the stages, the last
+stage holds a package back until all of its dependencies have finished,
+so a dependent is never published while a dependency can still fail.
+"""
+
+import os
+import sys
+import queue
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, List, Optional
+
+from prepare_packages import PackagePreparer, _prepare_package_worker
+from bundle_packages import PackageBundler, _bundle_package_worker
+from compile_packages import PackageCompiler
+from build_utils import run_captured
+from package_graph import (
+    PackageGraph, DependencyCycleError, load_package_specs, default_packages_dir
+)
+from source_cache import default_cache_dir
+from compile_cache import default_compile_cache_dir
+
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+_uploader = None
+
+
+def _upload_worker(dry_run: bool, mhl_path: str):
+    """Upload one .mhl in a worker process; returns (success, output)."""
+    def upload():
+        global _uploader
+        if _uploader is None:
+            # Imported here so that pipelines without an upload stage do
+            # not require boto3
+            from upload_packages import PackageUploader
+            _uploader = PackageUploader(
+                dry_run=dry_run, input_dir=os.path.dirname(mhl_path)
+            )
+        return _uploader.upload_package(mhl_path)
+
+    return run_captured(upload)
+
+
+class BuildPipeline:
+    """Streams packages through prepare, compile, bundle and upload stages."""
+
+    def __init__(self, dry_run=False, force=False, compile=True, upload=True,
+                 prepare_jobs=4, compile_jobs=2, bundle_jobs=None, upload_jobs=4,
+                 queue_size=4, matlab='matlab', cache_dir=None,
+                 compile_cache_dir=None):
+        """
+        Initialize the pipeline.
+
+        Args:
+            dry_run: If True, simulate operations without building or uploading
+            force: Rebuild packages even if they are up to date
+            compile: Run the compile stage
+            upload: Run the upload stage
+            prepare_jobs: Number of packages prepared concurrently
+            compile_jobs: Number of MATLAB compile processes run concurrently
+            bundle_jobs: Number of packages bundled concurrently (default: CPU count)
+            upload_jobs: Number of packages uploaded concurrently
+            queue_size: Maximum number of items waiting between two stages
+            matlab: MATLAB executable used by the compile stage
+            cache_dir: Source cache directory (None disables the cache)
+            compile_cache_dir: Compile cache directory (None disables the cache)
+        """
+        self.dry_run = dry_run
+        self.compile = compile
+        self.upload = upload
+        self.prepare_jobs = max(1, prepare_jobs)
+        self.compile_jobs = max(1, compile_jobs)
+        self.bundle_jobs = max(1, bundle_jobs or os.cpu_count() or 1)
+        self.upload_jobs = max(1, upload_jobs)
+        self.queue_size = max(1, queue_size)
+
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.bundled_dir = os.path.join(project_root, 'build', 'bundled')
+
+        self.preparer = PackagePreparer(
+            dry_run=dry_run, force=force, cache_dir=cache_dir, defer_manifest=True
+        )
+        self.bundler = PackageBundler(dry_run=dry_run, output_dir=self.bundled_dir)
+        self.compiler = PackageCompiler(
+            dry_run=dry_run, input_dir=self.preparer.output_dir, matlab=matlab,
+            cache_dir=compile_cache_dir
+        )
+        self.specs = load_package_specs(default_packages_dir())
+        self.graph = PackageGraph.from_specs(self.specs)
+
+        self._print_lock = threading.Lock()
+        self._failures_lock = threading.Lock()
+        self.failures = []
+
+        # Per-run package state, guarded by _state_lock: the package and the
+        # prepared .dir of each .dir/.mhl item, the number of its items still
+        # in flight, finished and failed packages, and last-stage items
+        # waiting for dependencies
+        self._state_lock = threading.Lock()
+        self._run_names = set()
+        self._item_packages = {}
+        self._item_dirs = {}
+        self._pending = {}
+        self._finished = set()
+        self._failed_packages = set()
+        self._held = {}
+
+    def _log(self, stage: str, name: str, output: str):
+        """Print one stage's captured output for one package as a block."""
+        with self._print_lock:
+            print(f"\n[{stage}] {name}", flush=True)
+            if output:
+                print(output.strip('\n'), flush=True)
+
+    def _fail(self, stage: str, item: Any):
+        """Record a failed stage for an item; its package counts as failed."""
+        with self._failures_lock:
+            self.failures.append((stage, os.path.basename(item)))
+        self._end_item(item, failed=True)
+
+    # Package bookkeeping. A package is finished once each of its prepared
+    # .dir directories has made it through the last stage or failed.
+
+    def _package_of(self, item: Any) -> str:
+        with self._state_lock:
+            return self._item_packages.get(item, item)
+
+    def _dependencies(self, name: str) -> List[str]:
+        """Dependencies of a package that are part of this run."""
+        return [d for d in self.graph.dependencies.get(name, []) if d in self._run_names]
+
+    def _add_items(self, name: str, items: List[str]):
+        """Record the prepared .dir directories of a package."""
+        with self._state_lock:
+            if name in self._finished:
+                # Its prepare failed
+                return
+            for item in items:
+                self._item_packages[item] = name
+            self._pending[name] = len(items)
+            released = [] if items else self._finish_package(name)
+        self._release(released)
+
+    def _rename_item(self, item: Any, new_items: List[Any]):
+        """Record that an item continues as new_items (e.g. a .dir as its .mhl)."""
+        with self._state_lock:
+            for new_item in new_items:
+                self._item_packages[new_item] = self._item_packages.get(item, item)
+                self._item_dirs[new_item] = self._item_dirs.get(item, item)
+
+    def _end_item(self, item: Any, failed: bool = False):
+        """Record that an item left the pipeline (last stage done, or failed)."""
+        with self._state_lock:
+            name = self._item_packages.get(item, item)
+            if failed:
+                self._failed_packages.add(name)
+            self._pending[name] = self._pending.get(name, 1) - 1
+            released = self._finish_package(name) if self._pending[name] <= 0 else []
+        self._release(released)
+
+    def _finish_package(self, name: str) -> List[Any]:
+        """Mark a package finished; returns the held items it was the last dependency of."""
+        self._finished.add(name)
+        released = []
+        for dependent in self.graph.dependents.get(name, []):
+            if dependent in self._held and all(
+                    d in self._finished for d in self._dependencies(dependent)):
+                released.extend(self._held.pop(dependent))
+        return released
+
+    def _release(self, items: List[Any]):
+        """Run the last stage for items that were waiting for their dependencies."""
+        for item in items:
+            self._process(*self._final_stage, item)
+
+    # Stage implementations. Each takes one item and returns the list of
+    # items to pass to the next stage.
+
+    def _prepare(self, executor, package_name: str) -> List[str]:
+        future = executor.submit(
+            _prepare_package_worker, self.preparer, self.specs[package_name]['dir']
+        )
+        try:
+            success, output, prepared_dirs = future.result()
+        except Exception as e:
+            success, output, prepared_dirs = False, f"  Worker failed: {e}", []
+        self._log('prepare', package_name, output)
+        if not success:
+            self._fail('prepare', package_name)
+            return []
+        return prepared_dirs
+
+    def _compile(self, dir_path: str) -> List[str]:
+        dir_name = os.path.basename(dir_path)
+        _, compile_script = self.compiler.compile_script_for(dir_path)
+        if compile_script is None:
+            return [dir_path]
+
+        success, output = self.compiler.compile_package(dir_path, compile_script)
+        self._log('compile', dir_name, output)
+        if not success:
+            self._fail('compile', dir_path)
+            return []
+        return [dir_path]
+
+    def _bundle(self, executor, dir_path: str) -> List[str]:
+        dir_name = os.path.basename(dir_path)
+        try:
+            success, output = executor.submit(
+                _bundle_package_worker, self.bundler, dir_path
+            ).result()
+        except Exception as e:
+            success, output = False, f"  Worker failed: {e}"
+        self._log('bundle', dir_name, output)
+        if not success:
+            self._fail('bundle', dir_path)
+            return []
+        return [os.path.join(self.bundled_dir, f"{dir_name[:-4]}.mhl")]
+
+    def _upload(self, executor, mhl_path: str) -> List[str]:
+        mhl_filename = os.path.basename(mhl_path)
+        try:
+            success, output = executor.submit(_upload_worker, self.dry_run, mhl_path).result()
+        except Exception as e:
+            success, output = False, f"  Worker failed: {e}"
+        self._log('upload', mhl_filename, output)
+        if not success:
+            self._fail('upload', mhl_path)
+            return []
+        return [mhl_path]
+
+    def _process(self, stage: str, process: Callable[[Any], List[Any]], item: Any) -> List[Any]:
+        """
+        Run one stage for one item.
+
+        Items of packages with a failed dependency are skipped, and the
+        last stage holds items back until their dependencies have finished.
+        An exception fails the item instead of the stage.
+        """
+        name = self._package_of(item)
+        with self._state_lock:
+            failed_deps = [d for d in self._dependencies(name) if d in self._failed_packages]
+            if not failed_deps and stage == self._final_stage[0] and not all(
+                    d in self._finished for d in self._dependencies(name)):
+                self._held.setdefault(name, []).append(item)
+                return []
+        if failed_deps:
+            self._log(stage, os.path.basename(item), f"  Skipped: dependency {', '.join(failed_deps)} failed")
+            self._fail('skipped', item)
+            return []
+
+        try:
+            results = process(item)
+        except Exception:
+            import traceback
+            self._log(stage, os.path.basename(item), traceback.format_exc())
+            self._fail(stage, item)
+            return []
+        if stage == 'prepare':
+            self._add_items(name, results)
+        elif stage == self._final_stage[0]:
+            if results:
+                if not self.dry_run:
+                    with self._state_lock:
+                        dir_path = self._item_dirs.get(item, item)
+                    self.preparer.record_prepared_dir(dir_path)
+                self._end_item(item)
+        else:
+            self._rename_item(item, results)
+        return results
+
+    def _run_stage(self, stage: str, process: Callable[[Any], List[Any]],
+                   in_queue: queue.Queue, out_queue: Optional[queue.Queue]):
+        """Worker thread: take items from in_queue until _DONE, pass results on."""
+        while True:
+            item = in_queue.get()
+            if item is _DONE:
+                return
+            for result in self._process(stage, process, item):
+                if out_queue is not None:
+                    # Blocks while the next stage is saturated (backpressure)
+                    out_queue.put(result)
+
+    def run(self, package_names: List[str]) -> bool:
+        """
+        Run the pipeline for the given packages.
+
+        Args:
+            package_names: Packages to build, in dependency order
+
+        Returns:
+            True if every package made it through every stage
+        """
+        if not self.preparer.force:
+            self.preparer._load_remote_index()
+
+        self._run_names = set(package_names)
+        self._item_packages, self._item_dirs, self._pending, self._held = {}, {}, {}, {}
+        self._finished, self._failed_packages = set(), set()
+
+        prepare_executor = ProcessPoolExecutor(max_workers=self.prepare_jobs)
+        bundle_executor = ProcessPoolExecutor(max_workers=self.bundle_jobs)
+        upload_executor = ProcessPoolExecutor(max_workers=self.upload_jobs) if self.upload else None
+
+        stages = [('prepare', lambda name: self._prepare(prepare_executor, name), self.prepare_jobs)]
+        if self.compile:
+            stages.append(('compile', self._compile, self.compile_jobs))
+        stages.append(('bundle', lambda d: self._bundle(bundle_executor, d), self.bundle_jobs))
+        if self.upload:
+            stages.append(('upload', lambda m: self._upload(upload_executor, m), self.upload_jobs))
+
+        self._final_stage = stages[-1][:2]
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in stages]
+        stage_threads = []
+        for i, (stage, process, jobs) in enumerate(stages):
+            out_queue = queues[i + 1] if i + 1 < len(stages) else None
+            threads = [
+                threading.Thread(
+                    target=self._run_stage, args=(stage, process, queues[i], out_queue), daemon=True
+                )
+                for _ in range(jobs)
+            ]
+            for t in threads:
+                t.start()
+            stage_threads.append(threads)
+
+        try:
+            for name in package_names:
+                queues[0].put(name)
+
+            # Shut the stages down in order: once every worker of a stage
+            # has exited, nothing more can reach the next stage
+            for i, threads in enumerate(stage_threads):
+                for _ in threads:
+                    queues[i].put(_DONE)
+                for t in threads:
+                    t.join()
+        finally:
+            prepare_executor.shutdown()
+            bundle_executor.shutdown()
+            if upload_executor is not None:
+                upload_executor.shutdown()
+
+        # Nothing should be left waiting: every dependency has finished by now
+        for items in list(self._held.values()):
+            for item in items:
+                self._fail('skipped', item)
+
+        if self.failures:
+            print(f"\nError: {len(self.failures)} step(s) failed:")
+            for stage, name in self.failures:
+                print(f"  {stage}: {name}")
+            return False
+
+        return True
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(
+        description='Prepare, compile, bundle and upload packages as a streaming pipeline'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Simulate operations without building or uploading'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Rebuild packages even if they are up to date'
+    )
+    parser.add_argument(
+        '--package',
+        type=str,
+        help='Build only the specified package by name'
+    )
+    parser.add_argument(
+        '--with-deps',
+        action='store_true',
+        help='With --package, also build the packages it depends on'
+    )
+    parser.add_argument(
+        '--with-dependents',
+        action='store_true',
+        help='With --package, also build the packages that depend on it'
+    )
+    parser.add_argument(
+        '--no-compile',
+        action='store_true',
+        help='Skip the compile stage'
+    )
+    parser.add_argument(
+        '--no-upload',
+        action='store_true',
+        help='Skip the upload stage'
+    )
+    parser.add_argument(
+        '--prepare-jobs',
+        type=int,
+        default=4,
+        help='Number of packages prepared concurrently (default: 4)'
+    )
+    parser.add_argument(
+        '--compile-jobs',
+        type=int,
+        default=2,
+        help='Number of MATLAB compile processes run concurrently (default: 2)'
+    )
+    parser.add_argument(
+        '--bundle-jobs',
+        type=int,
+        default=None,
+        help='Number of packages bundled concurrently (default: CPU count)'
+    )
+    parser.add_argument(
+        '--upload-jobs',
+        type=int,
+        default=4,
+        help='Number of packages uploaded concurrently (default: 4)'
+    )
+    parser.add_argument(
+        '--queue-size',
+        type=int,
+        default=4,
+        help='Maximum number of packages waiting between two stages (default: 4)'
+    )
+    parser.add_argument(
+        '--matlab',
+        type=str,
+        default=os.environ.get('MATLAB', 'matlab'),
+        help='MATLAB executable (default: $MATLAB or matlab)'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=default_cache_dir(),
+        help='Directory for cached sources (default: $MIP_CACHE_DIR or ~/.cache/mip-core/sources)'
+    )
+    parser.add_argument(
+        '--compile-cache-dir',
+        type=str,
+        default=default_compile_cache_dir(),
+        help='Directory for cached compilation outputs (default: $MIP_COMPILE_CACHE_DIR or ~/.cache/mip-core/compiled)'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Disable the source and compile caches'
+    )
+
+    args = parser.parse_args()
+
+    specs = load_package_specs(default_packages_dir())
+    graph = PackageGraph.from_specs(specs)
+
+    try:
+        names = None
+        if args.package:
+            names = graph.select([args.package], args.with_deps, args.with_dependents)
+        package_names = graph.topological_order(names)
+    except KeyError as e:
+        print(f"\n✗ Error: Unknown package {e}")
+        return 1
+    except DependencyCycleError as e:
+        print(f"\n✗ Error: {e}")
+        return 1
+
+    pipeline = BuildPipeline(
+        dry_run=args.dry_run,
+        force=args.force,
+        compile=not args.no_compile,
+        upload=not args.no_upload,
+        prepare_jobs=args.prepare_jobs,
+        compile_jobs=args.compile_jobs,
+        bundle_jobs=args.bundle_jobs,
+        upload_jobs=args.upload_jobs,
+        queue_size=args.queue_size,
+        matlab=args.matlab,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        compile_cache_dir=None if args.no_cache else args.compile_cache_dir
+    )
+
+    print("Starting build pipeline...")
+    if args.dry_run:
+        print("[DRY RUN MODE - No actual building or uploading will occur]")
+    print(f"Packages: {', '.join(package_names)}")
+    print(f"BUILD_TYPE: {os.environ.get('BUILD_TYPE', 'standard')}")
+
+    success = pipeline.run(package_names)
+
+    if success:
+        print("\n✓ Pipeline completed successfully")
+        return 0
+    else:
+        print("\n✗ Pipeline failed")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
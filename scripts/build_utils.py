@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the build scripts.
+
+- run_captured: call a function in a worker while capturing its output,
+  so that each package's log can be printed as one block
+- file_sha256: hash a file without reading it into memory at once
+- format_size: human-readable byte counts for log output
+"""
+
+import io
+import hashlib
+import contextlib
+import traceback
+from typing import Any, Callable, Tuple
+
+# Size of the blocks read from disk while hashing a file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def run_captured(fn: Callable, *args) -> Tuple[Any, str]:
+    """
+    Call fn, capturing everything it prints.
+
+    An exception raised by fn is printed into the captured output.
+
+    Returns:
+        Tuple of (result, captured output); result is None if fn raised
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            result = fn(*args)
+        except Exception:
+            traceback.print_exc()
+            result = None
+    return result, output.getvalue()
+
+
+def file_sha256(path: str) -> str:
+    """Compute the sha256 of a file."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def format_size(num_bytes) -> str:
+    """Format a byte count for log output."""
+    if num_bytes < 1024:
+        return f"{num_bytes} B"
+    for unit in ['KB', 'MB', 'GB']:
+        num_bytes /= 1024
+        if num_bytes < 1024 or unit == 'GB':
+            return f"{num_bytes:.1f} {unit}"
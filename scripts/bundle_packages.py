@@ -7,22 +7,291 @@ This script:
 2. For each .dir:
    - Reads mip.json metadata
    - Zips the directory into a .mhl file
+   - Optionally creates a zstd-compressed .mhl.zst variant
+   - Optionally creates a delta archive against the previously published build
+   - Optionally creates a layered bundle: a platform-independent base
+     archive plus a per-platform overlay, optionally instead of publishing
+     the full .mhl
    - Creates standalone .mip.json file
    - Outputs to a staging directory
 
+Files that are already compressed (.mat, .png, .jpg, .pdf, .gz, ...) are
+stored in the archive without compression; everything else is deflated.
+
+Bundles are byte-reproducible: entries are sorted, timestamps and
+permissions are normalized, and volatile fields (timestamp, durations)
+are left out of the mip.json inside the archive. The standalone
+.mip.json records the sha256 and size of the .mhl file.
+
+Only files needed at runtime are shipped: version control and CI files,
+tests, docs and papers are left out by default, and each package can
+set its own include/exclude globs in the `bundle` section of its
+prepare.yaml. Files in directories on the package's MATLAB path (and
+their private, @class and +package subdirectories) are always shipped.
+
+Both mip.json files list every file of the package with its size and
+sha256 (`files`). A delta archive holds only the files that were added
+or changed since the previous build, plus a delta.json that lists the
+deleted files.
+
 The resulting .mhl and .mip.json files can then be uploaded separately.
 """
 
 import os
+import io
 import sys
 import json
+import time
+import zlib
+import shutil
+import hashlib
 import zipfile
 import argparse
+import fnmatch
+import posixpath
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import requests
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from build_utils import run_captured, file_sha256, format_size
+from package_graph import (
+    PackageGraph, DependencyCycleError, load_package_specs, default_packages_dir
+)
+
+# Size of the blocks read from disk while compressing a member
+COMPRESS_CHUNK_SIZE = 1024 * 1024
+
+# Members larger than this are never compressed in memory on a worker
+# thread; they are streamed into the archive by the writing thread
+MAX_IN_MEMORY_MEMBER_SIZE = 64 * 1024 * 1024
+
+# Deflate level used for compressible files (zlib's default)
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# Already-compressed file types, stored in the archive without compression
+STORED_EXTENSIONS = (
+    '.mat', '.png', '.jpg', '.jpeg', '.gif', '.pdf',
+    '.gz', '.tgz', '.bz2', '.xz', '.zip', '.zst', '.mhl',
+)
+
+# mip.json fields that change on every build; left out of the archive
+VOLATILE_MIP_FIELDS = ('timestamp', 'prepare_duration', 'compile_duration')
+
+# Timestamp of every archive entry unless SOURCE_DATE_EPOCH is set
+# (the earliest date a ZIP file can represent)
+DEFAULT_ARCHIVE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Files left out of bundles unless a package disables the defaults.
+# Files on the package's MATLAB path are shipped regardless.
+DEFAULT_BUNDLE_EXCLUDES = [
+    '**/.git/**', '**/.github/**', '**/.gitlab/**', '**/.circleci/**',
+    '**/.gitignore', '**/.gitattributes', '**/.gitmodules',
+    '**/.travis.yml', '**/.gitlab-ci.yml', '**/appveyor.yml',
+    '**/.DS_Store', '**/__pycache__/**',
+    '**/test/**', '**/tests/**', '**/doc/**', '**/docs/**',
+    '**/paper/**', '**/papers/**',
+]
+
+# Files that differ between the platform builds of a package; a layered
+# bundle puts them in the per-platform overlay
+PLATFORM_EXTENSIONS = (
+    '.mexa64', '.mexmaci64', '.mexmaca64', '.mexw64', '.mexw32', '.mexglx', '.mexmac',
+    '.so', '.dylib', '.dll', '.lib', '.a', '.o', '.obj', '.exe',
+)
+
+
+def _is_platform_file(path):
+    """Check whether a file is platform-specific (compiled binaries)."""
+    name = posixpath.basename(path).lower()
+    return name.endswith(PLATFORM_EXTENSIONS) or '.so.' in name
+
+
+def _glob_match(path, pattern):
+    """
+    Match a relative path against a bundle glob.
+    
+    Patterns use fnmatch syntax, where `*` also matches `/`; a leading
+    `**/` also matches at the top level.
+    """
+    if fnmatch.fnmatchcase(path, pattern):
+        return True
+    return pattern.startswith('**/') and fnmatch.fnmatchcase(path, pattern[3:])
+
+
+def _is_runtime_file(arcname, path_dirs):
+    """
+    Check whether a file is needed at runtime regardless of bundle rules.
+    
+    That is the case for top-level files (mip.json, load_package.m, ...)
+    and files in a directory on the MATLAB path, including its private,
+    @class and +package subdirectories.
+    """
+    parts = posixpath.dirname(arcname).split('/') if '/' in arcname else []
+    for i in range(len(parts), -1, -1):
+        if '/'.join(parts[:i]) in path_dirs:
+            return all(p == 'private' or p[:1] in '@+' for p in parts[i:])
+    return False
+
+
+def _archive_date_time():
+    """Get the timestamp of archive entries, honoring SOURCE_DATE_EPOCH."""
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if not epoch:
+        return DEFAULT_ARCHIVE_DATE_TIME
+    date_time = time.gmtime(int(epoch))[:6]
+    return max(date_time, DEFAULT_ARCHIVE_DATE_TIME)
+
+
+def _open_source(source):
+    """Open an archive member's source, a file path or bytes, for reading."""
+    return io.BytesIO(source) if isinstance(source, bytes) else open(source, 'rb')
+
+
+def _source_size(source):
+    """Get the uncompressed size of an archive member's source."""
+    return len(source) if isinstance(source, bytes) else os.path.getsize(source)
+
+
+def _zipinfo_level_attribute():
+    """
+    Get the ZipInfo attribute that ZipFile.open(zinfo, 'w') reads the
+    compression level from: public since Python 3.13, private before.
+    
+    Returns:
+        Attribute name, or None if ZipInfo has neither
+    """
+    for name in ('compress_level', '_compresslevel'):
+        if hasattr(zipfile.ZipInfo, name):
+            return name
+    return None
+
+
+def _zipfile_internals_available():
+    """Check for the ZipFile internals used by _write_compressed_member()."""
+    if not hasattr(zipfile.ZipInfo, 'FileHeader'):
+        return False
+    with zipfile.ZipFile(io.BytesIO(), 'w') as zipf:
+        return all(
+            hasattr(zipf, name)
+            for name in ('fp', 'start_dir', 'filelist', 'NameToInfo', '_didModify', '_writecheck')
+        )
+
+
+# Checked once at import time. Without the level attribute, members go
+# through ZipFile.writestr, which takes the level as an argument but
+# holds the whole file in memory. Without the ZipFile internals, members
+# are compressed on the writing thread, whatever compress_threads says.
+ZIPINFO_LEVEL_ATTRIBUTE = _zipinfo_level_attribute()
+PARALLEL_COMPRESSION_AVAILABLE = _zipfile_internals_available()
+
+
+def _stream_member(zipf, zinfo, source, level):
+    """
+    Stream one member into a ZipFile opened for writing.
+    
+    Uses the public ZipFile.open(zinfo, 'w'), so only one chunk of the
+    file is in memory at a time (unless ZIPINFO_LEVEL_ATTRIBUTE is None).
+    zinfo must have compress_type set.
+    """
+    if ZIPINFO_LEVEL_ATTRIBUTE is None:
+        with _open_source(source) as f:
+            zipf.writestr(zinfo, f.read(), compresslevel=level)
+        return
+    setattr(zinfo, ZIPINFO_LEVEL_ATTRIBUTE, level)
+    # Decides whether the member needs ZIP64 extensions
+    zinfo.file_size = _source_size(source)
+    with _open_source(source) as f, zipf.open(zinfo, 'w') as dest:
+        shutil.copyfileobj(f, dest, COMPRESS_CHUNK_SIZE)
+
+
+def _compress_file(source, compress_type, level):
+    """
+    Compress one archive member the way ZipFile.open(zinfo, 'w') does.
+    
+    Runs on a worker thread; zlib releases the GIL while compressing.
+    The whole compressed member is returned, so this is only used for
+    members of at most MAX_IN_MEMORY_MEMBER_SIZE bytes.
+    
+    Args:
+        source: Path of the file to compress, or its contents as bytes
+        compress_type: zipfile.ZIP_DEFLATED or zipfile.ZIP_STORED
+        level: Deflate level
+    
+    Returns:
+        Tuple of (compressed bytes, CRC-32, uncompressed size)
+    """
+    compressor = None
+    if compress_type == zipfile.ZIP_DEFLATED:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    chunks = []
+    crc = 0
+    size = 0
+    with _open_source(source) as f:
+        while True:
+            data = f.read(COMPRESS_CHUNK_SIZE)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            chunks.append(compressor.compress(data) if compressor else data)
+    if compressor:
+        chunks.append(compressor.flush())
+    return b''.join(chunks), crc, size
+
+
+def _write_compressed_member(zipf, zinfo, compressed):
+    """
+    Append an already-compressed member to a ZipFile opened for writing.
+    
+    zinfo must have compress_type, CRC and file_size set. The local
+    header is written the same way ZipFile.open(zinfo, 'w') does, so the
+    archive is byte-identical to one written by _stream_member().
+    
+    This relies on ZipFile internals and is only used when members are
+    compressed on several threads and PARALLEL_COMPRESSION_AVAILABLE is set.
+    """
+    zinfo.compress_size = len(compressed)
+    zinfo.flag_bits = 0x00
+    zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+    
+    zipf.fp.seek(zipf.start_dir)
+    zinfo.header_offset = zipf.fp.tell()
+    zipf._writecheck(zinfo)
+    zipf._didModify = True
+    zipf.fp.write(zinfo.FileHeader(zip64))
+    zipf.fp.write(compressed)
+    zipf.start_dir = zipf.fp.tell()
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+
+
+def _bundle_package_worker(bundler, dir_path):
+    """
+    Bundle one .dir package in a worker process.
+    
+    All output is captured and returned so that the parent process can
+    print each package's log as a single block.
+    
+    Returns:
+        Tuple of (success, captured output)
+    """
+    success, output = run_captured(bundler.bundle_package, dir_path)
+    return bool(success), output
+
 
 class PackageBundler:
     """Handles bundling prepared MATLAB packages into .mhl files."""
     
-    def __init__(self, dry_run=False, input_dir=None, output_dir=None):
+    def __init__(self, dry_run=False, input_dir=None, output_dir=None, jobs=1,
+                 compress_threads=1, compression_level=DEFAULT_COMPRESSION_LEVEL,
+                 stored_extensions=STORED_EXTENSIONS, zstd_level=None, delta=False,
+                 delta_base=None, layered=False, layers_only=False):
         """
         Initialize the package bundler.
         
@@ -30,8 +299,39 @@ class PackageBundler:
             dry_run: If True, simulate operations without actual bundling
             input_dir: Directory containing .dir packages (default: build/prepared)
             output_dir: Directory for output .mhl files (default: build/bundled)
+            jobs: Number of packages to bundle concurrently
+            compress_threads: Number of threads compressing the files of one package
+            compression_level: Deflate level 1-9, or 0 to store all files uncompressed
+            stored_extensions: File extensions stored without compression
+            zstd_level: If set, also create a .mhl.zst variant at this zstd level
+            delta: Also create a delta archive against the previously published build
+            delta_base: URL or directory of the previously published .mip.json
+                files (default: where each package's mhl_url points)
+            layered: Also create a platform-independent base archive and a
+                per-platform overlay
+            layers_only: Implies layered. For builds that get layers, skip
+                the zstd variant and mark the full .mhl as not to be uploaded
         """
         self.dry_run = dry_run
+        self.jobs = max(1, jobs)
+        self.compress_threads = max(1, compress_threads)
+        self.compression_level = compression_level
+        self.stored_extensions = tuple(ext.lower() for ext in stored_extensions)
+        self.zstd_level = zstd_level
+        self.delta = delta
+        self.delta_base = delta_base
+        self.layered = layered or layers_only
+        self.layers_only = layers_only
+        self._specs = None
+        
+        if self.compress_threads > 1 and not PARALLEL_COMPRESSION_AVAILABLE:
+            print("Warning: this Python's zipfile does not support parallel "
+                  "compression; compressing on one thread")
+        
+        if zstd_level is not None and zstandard is None:
+            raise ValueError(
+                "The zstd variant requires zstandard. Install with: pip install zstandard"
+            )
         
         # Set input directory
         if input_dir:
@@ -47,20 +347,403 @@ class PackageBundler:
             project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
             self.output_dir = os.path.join(project_root, 'build', 'bundled')
     
-    def _create_mhl_file(self, dir_path, output_path):
+    def _list_files(self, dir_path):
+        """
+        List the files to put in a .mhl file.
+        
+        Returns:
+            Sorted list of (archive name, file path)
+        """
+        members = []
+        for root, dirs, files in os.walk(dir_path):
+            for file in files:
+                file_path = os.path.join(root, file)
+                arcname = os.path.relpath(file_path, dir_path).replace(os.sep, '/')
+                members.append((arcname, file_path))
+        return sorted(members)
+    
+    def _package_specs(self):
+        """Load the package specs from packages/ (once)."""
+        if self._specs is None:
+            self._specs = load_package_specs(default_packages_dir())
+        return self._specs
+    
+    def _select_files(self, dir_path, mip_data):
+        """
+        Apply the package's bundle rules to the files of a .dir.
+        
+        Rules come from the `bundle` section of the package's prepare.yaml:
+        `include` (globs; default: everything), `exclude` (globs) and
+        `default_excludes` (whether DEFAULT_BUNDLE_EXCLUDES apply;
+        default: true).
+        
+        Returns:
+            Tuple of (shipped files, excluded files), each a sorted list
+            of (archive name, file path)
+        """
+        spec = self._package_specs().get(mip_data.get('name'), {})
+        rules = spec.get('yaml', {}).get('bundle') or {}
+        include = rules.get('include') or ['*']
+        exclude = list(rules.get('exclude') or [])
+        if rules.get('default_excludes', True):
+            exclude += DEFAULT_BUNDLE_EXCLUDES
+        
+        path_dirs = set()
+        for path in mip_data.get('paths', []):
+            path = posixpath.normpath(path.replace(os.sep, '/'))
+            path_dirs.add('' if path == '.' else path)
+        
+        selected, excluded = [], []
+        for arcname, file_path in self._list_files(dir_path):
+            if ('/' not in arcname or _is_runtime_file(arcname, path_dirs)
+                    or (any(_glob_match(arcname, p) for p in include)
+                        and not any(_glob_match(arcname, p) for p in exclude))):
+                selected.append((arcname, file_path))
+            else:
+                excluded.append((arcname, file_path))
+        return selected, excluded
+    
+    def _file_manifest(self, selected):
+        """
+        List the shipped files of a package with their size and sha256.
+        
+        mip.json itself is not listed.
+        
+        Args:
+            selected: Shipped files from _select_files()
+        
+        Returns:
+            Sorted list of {'path', 'size', 'sha256'}
+        """
+        return [
+            {'path': arcname, 'size': os.path.getsize(file_path), 'sha256': file_sha256(file_path)}
+            for arcname, file_path in selected
+            if arcname != 'mip.json'
+        ]
+    
+    def _archived_mip_json(self, mip_json_path, files):
+        """Contents of mip.json as stored in the archive, without volatile fields."""
+        with open(mip_json_path, 'r') as f:
+            mip_data = json.load(f)
+        for field in VOLATILE_MIP_FIELDS:
+            mip_data.pop(field, None)
+        mip_data['files'] = files
+        return json.dumps(mip_data, indent=2).encode('utf-8')
+    
+    def _compression_for(self, arcname, store_all=False):
+        """Get the (compress_type, level) for an archive member."""
+        if (store_all or self.compression_level == 0
+                or arcname.lower().endswith(self.stored_extensions)):
+            return zipfile.ZIP_STORED, None
+        return zipfile.ZIP_DEFLATED, self.compression_level
+    
+    def _zip_info(self, arcname, source, date_time):
+        """
+        Create a ZipInfo that does not depend on the file's on-disk metadata.
+        
+        Only the executable bit is kept from the file's permissions.
+        """
+        zinfo = zipfile.ZipInfo(arcname, date_time=date_time)
+        zinfo.create_system = 3  # Unix, so external_attr holds permissions
+        executable = not isinstance(source, bytes) and os.stat(source).st_mode & 0o111
+        zinfo.external_attr = (0o100755 if executable else 0o100644) << 16
+        return zinfo
+    
+    def _create_mhl_file(self, dir_path, output_path, files, store_all=False):
         """
         Create a .mhl file by zipping the directory.
         
+        The archive only depends on the relative paths, contents and
+        executable bits of the files, so identical input always gives an
+        identical .mhl file.
+        
         Args:
             dir_path: Directory to zip
             output_path: Path for the output .mhl file
+            files: File manifest from _file_manifest(); only these files
+                and mip.json are zipped
+            store_all: Store every file without compression
+        
+        Returns:
+            Dict with the number of files, the number of stored files and
+            the total uncompressed size
+        """
+        mip_json_path = os.path.join(dir_path, 'mip.json')
+        members = [('mip.json', self._archived_mip_json(mip_json_path, files))] + [
+            (entry['path'], os.path.join(dir_path, entry['path'])) for entry in files
+        ]
+        return self._write_archive(output_path, sorted(members), store_all)
+    
+    def _create_delta_file(self, dir_path, output_path, files, previous):
+        """
+        Create a delta archive against the previously published build.
+        
+        The archive contains the new mip.json, every added or changed file
+        and a delta.json with the base build and the deleted paths.
+        Applying it to an installation of the base build gives the new build.
+        
+        Args:
+            dir_path: Directory of the new build
+            output_path: Path for the output delta archive
+            files: File manifest of the new build
+            previous: Standalone .mip.json of the previous build
+        
+        Returns:
+            Tuple of (archive stats, number of changed files, number of deleted files)
+        """
+        previous_hashes = {entry['path']: entry['sha256'] for entry in previous['files']}
+        current_paths = set(entry['path'] for entry in files)
+        changed = [
+            entry for entry in files
+            if previous_hashes.get(entry['path']) != entry['sha256']
+        ]
+        deleted = sorted(path for path in previous_hashes if path not in current_paths)
+        
+        delta = {
+            'base_mhl_sha256': previous['mhl_sha256'],
+            'base_build_number': previous.get('build_number'),
+            'files': changed,
+            'deleted': deleted,
+        }
+        mip_json_path = os.path.join(dir_path, 'mip.json')
+        members = [
+            ('delta.json', json.dumps(delta, indent=2).encode('utf-8')),
+            ('mip.json', self._archived_mip_json(mip_json_path, files)),
+        ] + [
+            (entry['path'], os.path.join(dir_path, entry['path'])) for entry in changed
+        ]
+        stats = self._write_archive(output_path, sorted(members))
+        return stats, len(changed), len(deleted)
+    
+    def _write_archive(self, output_path, members, store_all=False):
+        """
+        Write a ZIP archive deterministically.
+        
+        Args:
+            output_path: Path for the output archive
+            members: Sorted list of (arcname, source); source is a file path or bytes
+            store_all: Store every file without compression
+        
+        Returns:
+            Dict with the number of files, the number of stored files and
+            the total uncompressed size
         """
+        members = [
+            (arcname, source) + self._compression_for(arcname, store_all)
+            for arcname, source in members
+        ]
+        
+        date_time = _archive_date_time()
         with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(dir_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, dir_path)
-                    zipf.write(file_path, arcname)
+            def add(member, compressed):
+                arcname, source, compress_type, level = member
+                zinfo = self._zip_info(arcname, source, date_time)
+                zinfo.compress_type = compress_type
+                if compressed is None:
+                    _stream_member(zipf, zinfo, source, level)
+                    return
+                data, crc, size = compressed
+                zinfo.CRC = crc
+                zinfo.file_size = size
+                _write_compressed_member(zipf, zinfo, data)
+            
+            if self.compress_threads == 1 or not PARALLEL_COMPRESSION_AVAILABLE:
+                for member in members:
+                    add(member, None)
+            else:
+                self._compress_members_parallel(members, add)
+        
+        return {
+            'files': len(members),
+            'stored_files': sum(1 for m in members if m[2] == zipfile.ZIP_STORED),
+            'input_size': sum(_source_size(m[1]) for m in members),
+        }
+    
+    def _compress_members_parallel(self, members, add):
+        """
+        Compress members on a thread pool and add them to the archive in order.
+        
+        At most a few members per thread are held in memory at once, and
+        members larger than MAX_IN_MEMORY_MEMBER_SIZE are streamed by the
+        calling thread instead. The archive is identical to the one
+        written with a single thread.
+        
+        Args:
+            members: List of (arcname, source, compress_type, level)
+            add: Called with each member and its _compress_file() result
+                (None for members to stream), in order
+        """
+        max_pending = self.compress_threads * 4
+        with ThreadPoolExecutor(max_workers=self.compress_threads) as executor:
+            pending = deque()
+            members = iter(members)
+            while True:
+                while len(pending) < max_pending:
+                    member = next(members, None)
+                    if member is None:
+                        break
+                    if _source_size(member[1]) > MAX_IN_MEMORY_MEMBER_SIZE:
+                        pending.append((member, None))
+                    else:
+                        pending.append((member, executor.submit(_compress_file, *member[1:])))
+                if not pending:
+                    break
+                member, future = pending.popleft()
+                add(member, future.result() if future else None)
+    
+    def _load_previous_metadata(self, mip_data, mhl_filename):
+        """
+        Get the standalone .mip.json of the previously published build.
+        
+        Builds are published under the same filename, so this is whatever
+        is currently at the package's location.
+        
+        Returns:
+            Parsed metadata, or None if there is no previous build
+        """
+        mip_json_filename = f"{mhl_filename}.mip.json"
+        if self.delta_base and os.path.isdir(self.delta_base):
+            try:
+                with open(os.path.join(self.delta_base, mip_json_filename), 'r') as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                return None
+        
+        if self.delta_base:
+            url = f"{self.delta_base.rstrip('/')}/{mip_json_filename}"
+        else:
+            url = f"{mip_data['mhl_url']}.mip.json"
+        response = requests.get(url, timeout=30)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+    
+    def _create_delta_variant(self, dir_path, mhl_filename, mip_data, files):
+        """
+        Create a delta archive if a previous build with a file manifest exists.
+        
+        Returns:
+            Variant entry for the standalone .mip.json, or None if no
+            delta was created
+        """
+        try:
+            previous = self._load_previous_metadata(mip_data, mhl_filename)
+        except (requests.RequestException, ValueError) as e:
+            print(f"  Warning: Could not load previous build metadata: {e}")
+            return None
+        
+        if not previous or 'files' not in previous or 'mhl_sha256' not in previous:
+            print(f"  No previous build with a file manifest, skipping delta")
+            return None
+        if previous['mhl_sha256'] == mip_data['mhl_sha256']:
+            print(f"  Unchanged since the previous build, skipping delta")
+            return None
+        
+        delta_filename = f"{mhl_filename}.delta-{previous['mhl_sha256'][:16]}.zip"
+        delta_path = os.path.join(self.output_dir, delta_filename)
+        print(f"  Creating delta against build {previous.get('build_number')}...")
+        stats, changed, deleted = self._create_delta_file(dir_path, delta_path, files, previous)
+        delta_size = os.path.getsize(delta_path)
+        print(
+            f"  {changed} changed/added, {deleted} deleted file(s): "
+            f"{format_size(delta_size)} instead of {format_size(mip_data['mhl_size'])}"
+        )
+        if delta_size >= mip_data['mhl_size']:
+            print(f"  Delta is not smaller than the full archive, discarding it")
+            os.remove(delta_path)
+            return None
+        
+        return {
+            'encoding': 'delta',
+            'filename': delta_filename,
+            'size': delta_size,
+            'sha256': file_sha256(delta_path),
+            'base_mhl_sha256': previous['mhl_sha256'],
+            'base_build_number': previous.get('build_number'),
+        }
+    
+    def _create_layers(self, dir_path, mhl_filename, mip_data, files):
+        """
+        Create a layered bundle: a shared base archive plus a platform overlay.
+        
+        The base holds every platform-independent file. It is named by a
+        hash of its file manifest (paths and sha256s), not of the archive:
+        builders for different platforms may deflate the same files to
+        different bytes, but their bases have the same name, and
+        upload_packages.py keeps the first one published. The overlay
+        holds mip.json and the compiled binaries of this build. Extracting
+        the base and then the overlay into one directory gives the same
+        files as the full .mhl.
+        
+        Returns:
+            List of layer entries for the standalone .mip.json, in
+            extraction order, or None if the package has no
+            platform-specific files
+        """
+        base_files = [entry for entry in files if not _is_platform_file(entry['path'])]
+        overlay_files = [entry for entry in files if _is_platform_file(entry['path'])]
+        if not overlay_files:
+            print(f"  No platform-specific files, skipping layers")
+            return None
+        
+        # Base: named after the files it holds, so identical bases share one object
+        manifest_sha256 = hashlib.sha256(json.dumps(
+            sorted([entry['path'], entry['sha256']] for entry in base_files)
+        ).encode('utf-8')).hexdigest()
+        base_filename = f"{mip_data['name']}-{mip_data.get('version', 'unspecified')}.base-{manifest_sha256[:16]}.zip"
+        self._write_archive(os.path.join(self.output_dir, base_filename), [
+            (entry['path'], os.path.join(dir_path, entry['path'])) for entry in base_files
+        ])
+        
+        # Overlay: this build's mip.json and binaries
+        overlay_filename = f"{mhl_filename}.overlay.zip"
+        overlay_path = os.path.join(self.output_dir, overlay_filename)
+        mip_json_path = os.path.join(dir_path, 'mip.json')
+        self._write_archive(overlay_path, sorted(
+            [('mip.json', self._archived_mip_json(mip_json_path, files))] + [
+                (entry['path'], os.path.join(dir_path, entry['path'])) for entry in overlay_files
+            ]
+        ))
+        
+        base_size = os.path.getsize(os.path.join(self.output_dir, base_filename))
+        overlay_size = os.path.getsize(overlay_path)
+        print(
+            f"  Layers: shared base {format_size(base_size)} ({len(base_files)} file(s)), "
+            f"overlay {format_size(overlay_size)} ({len(overlay_files)} file(s))"
+        )
+        return [
+            {'role': 'base', 'filename': base_filename, 'size': base_size,
+             'sha256': file_sha256(os.path.join(self.output_dir, base_filename))},
+            {'role': 'overlay', 'filename': overlay_filename, 'size': overlay_size,
+             'sha256': file_sha256(overlay_path)},
+        ]
+    
+    def _create_zstd_variant(self, dir_path, output_path, files):
+        """
+        Create a .mhl.zst file: an uncompressed .mhl compressed as a whole with zstd.
+        
+        Decompressing it yields a standard ZIP. Compressing the whole
+        archive at once lets zstd find redundancy across files.
+        
+        Args:
+            dir_path: Directory to zip
+            output_path: Path for the output .mhl.zst file
+            files: File manifest from _file_manifest()
+        """
+        stored_path = f"{output_path}.tmp"
+        try:
+            self._create_mhl_file(dir_path, stored_path, files, store_all=True)
+            # Always use zstd's multi-threaded mode: its output does not
+            # depend on the number of threads, unlike single-threaded mode
+            compressor = zstandard.ZstdCompressor(
+                level=self.zstd_level, threads=self.compress_threads
+            )
+            with open(stored_path, 'rb') as src, open(output_path, 'wb') as dst:
+                compressor.copy_stream(src, dst)
+        finally:
+            if os.path.exists(stored_path):
+                os.remove(stored_path)
     
     def bundle_package(self, dir_path):
         """
@@ -110,7 +793,76 @@ class PackageBundler:
             # Create .mhl file
             mhl_path = os.path.join(self.output_dir, mhl_filename)
             print(f"  Creating .mhl file...")
-            self._create_mhl_file(dir_path, mhl_path)
+            start = time.time()
+            selected, excluded = self._select_files(dir_path, mip_data)
+            if excluded:
+                excluded_size = sum(os.path.getsize(path) for _, path in excluded)
+                print(
+                    f"  Excluded {len(excluded)} file(s) not needed at runtime, "
+                    f"saving {format_size(excluded_size)} before compression"
+                )
+            files = self._file_manifest(selected)
+            stats = self._create_mhl_file(dir_path, mhl_path, files)
+            mhl_size = os.path.getsize(mhl_path)
+            ratio = mhl_size / stats['input_size'] if stats['input_size'] else 1.0
+            print(
+                f"  {format_size(stats['input_size'])} -> {format_size(mhl_size)} "
+                f"({ratio:.1%}) in {time.time() - start:.2f}s, "
+                f"{stats['stored_files']} of {stats['files']} file(s) stored uncompressed"
+            )
+            mip_data['mhl_sha256'] = file_sha256(mhl_path)
+            mip_data['mhl_size'] = mhl_size
+            mip_data['files'] = files
+            print(f"  sha256: {mip_data['mhl_sha256']}")
+            
+            # Create base and overlay layers
+            mip_data.pop('layers', None)
+            mip_data.pop('layers_only', None)
+            if self.layered:
+                layers = self._create_layers(dir_path, mhl_filename, mip_data, files)
+                if layers:
+                    mip_data['layers'] = layers
+                    if self.layers_only:
+                        # The .mhl is kept locally (its sha256 identifies
+                        # the build) but not uploaded
+                        print(f"  Layers only: the full .mhl will not be uploaded")
+                        mip_data['layers_only'] = True
+            
+            # Create zstd variant (an encoding of the full .mhl, so not
+            # for layers-only builds)
+            variants = []
+            if self.zstd_level is not None and not mip_data.get('layers_only'):
+                zst_filename = f"{mhl_filename}.zst"
+                zst_path = os.path.join(self.output_dir, zst_filename)
+                print(f"  Creating .mhl.zst file (zstd level {self.zstd_level})...")
+                start = time.time()
+                self._create_zstd_variant(dir_path, zst_path, files)
+                zst_size = os.path.getsize(zst_path)
+                ratio = zst_size / stats['input_size'] if stats['input_size'] else 1.0
+                print(
+                    f"  {format_size(stats['input_size'])} -> {format_size(zst_size)} "
+                    f"({ratio:.1%}) in {time.time() - start:.2f}s"
+                )
+                variants.append({
+                    'encoding': 'zstd',
+                    'filename': zst_filename,
+                    'size': zst_size,
+                    'sha256': file_sha256(zst_path)
+                })
+            
+            # Create delta archive
+            if self.delta:
+                delta_variant = self._create_delta_variant(dir_path, mhl_filename, mip_data, files)
+                if delta_variant:
+                    variants.append(delta_variant)
+            
+            mip_data.pop('variants', None)
+            if variants:
+                mip_data['variants'] = variants
+            
+            # A layers-only build has no published .mhl to point to
+            if mip_data.get('layers_only'):
+                mip_data.pop('mhl_url', None)
             
             # Create standalone mip.json file
             mip_json_output_path = os.path.join(self.output_dir, f"{mhl_filename}.mip.json")
@@ -127,9 +879,52 @@ class PackageBundler:
             traceback.print_exc()
             return False
     
-    def bundle_all(self):
+    def _package_name(self, dir_path):
+        """Get the package name of a .dir package from its mip.json."""
+        try:
+            with open(os.path.join(dir_path, 'mip.json'), 'r') as f:
+                return json.load(f).get('name')
+        except (OSError, ValueError):
+            return None
+    
+    def _order_by_dependencies(self, dir_paths, package_names=None,
+                               with_deps=False, with_dependents=False):
         """
-        Bundle all .dir packages in the input directory.
+        Select .dir packages and order them so dependencies come first.
+        
+        Args:
+            dir_paths: Paths of the .dir directories
+            package_names: Optional packages to select
+            with_deps: Also select the dependencies of package_names
+            with_dependents: Also select the packages depending on package_names
+        
+        Returns:
+            Ordered list of selected .dir paths
+        """
+        graph = PackageGraph.from_specs(load_package_specs(default_packages_dir()))
+        
+        selected = None
+        if package_names:
+            selected = graph.select(package_names, with_deps, with_dependents)
+        
+        rank = {name: i for i, name in enumerate(graph.topological_order())}
+        ordered = []
+        for dir_path in dir_paths:
+            name = self._package_name(dir_path)
+            if selected is not None and name not in selected:
+                continue
+            ordered.append((rank.get(name, len(rank)), os.path.basename(dir_path), dir_path))
+        
+        return [dir_path for _, _, dir_path in sorted(ordered)]
+    
+    def bundle_all(self, package_names=None, with_deps=False, with_dependents=False):
+        """
+        Bundle all .dir packages in the input directory, in dependency order.
+        
+        Args:
+            package_names: Optional packages to bundle (default: all)
+            with_deps: Also bundle the dependencies of package_names
+            with_dependents: Also bundle the packages depending on package_names
         
         Returns:
             True if all succeeded, False if any failed
@@ -153,9 +948,26 @@ class PackageBundler:
         print(f"Input directory: {self.input_dir}")
         print(f"Output directory: {self.output_dir}")
         
+        try:
+            dir_paths = self._order_by_dependencies(
+                dir_paths, package_names, with_deps, with_dependents
+            )
+        except KeyError as e:
+            print(f"Error: Unknown package {e}")
+            return False
+        except DependencyCycleError as e:
+            print(f"Error: {e}")
+            return False
+        
+        if package_names:
+            print(f"Selected {len(dir_paths)} .dir package(s)")
+        
+        if self.jobs > 1:
+            return self._bundle_parallel(dir_paths)
+        
         # Bundle each package
         all_success = True
-        for dir_path in sorted(dir_paths):
+        for dir_path in dir_paths:
             success = self.bundle_package(dir_path)
             if not success:
                 print(f"\nError: Bundle failed for {os.path.basename(dir_path)}")
@@ -163,6 +975,46 @@ class PackageBundler:
                 break  # Abort on first failure
         
         return all_success
+    
+    def _bundle_parallel(self, dir_paths):
+        """
+        Bundle .dir packages concurrently in a pool of worker processes.
+        
+        Compression is CPU-bound, so each package is zipped in its own
+        process. Logs are printed in the order of dir_paths, each as one
+        block. Unlike serial bundling, a failure does not stop the other
+        packages; all failures are summarized at the end.
+        
+        Args:
+            dir_paths: Ordered paths of the .dir directories
+        
+        Returns:
+            True if all succeeded, False if any failed
+        """
+        print(f"Bundling with {self.jobs} parallel job(s)")
+        failed = []
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [
+                executor.submit(_bundle_package_worker, self, dir_path)
+                for dir_path in dir_paths
+            ]
+            for dir_path, future in zip(dir_paths, futures):
+                try:
+                    success, output = future.result()
+                except Exception as e:
+                    success = False
+                    output = f"\nProcessing: {os.path.basename(dir_path)}\n  Worker failed: {e}\n"
+                print(output, end='', flush=True)
+                if not success:
+                    failed.append(os.path.basename(dir_path))
+        
+        if failed:
+            print(f"\nError: Bundle failed for {len(failed)} package(s):")
+            for dir_name in failed:
+                print(f"  {dir_name}")
+            return False
+        
+        return True
 
 def main():
     """Main entry point."""
@@ -184,22 +1036,109 @@ def main():
         type=str,
         help='Directory for output .mhl files (default: build/bundled)'
     )
+    parser.add_argument(
+        '--package',
+        type=str,
+        help='Bundle only the specified package by name'
+    )
+    parser.add_argument(
+        '--with-deps',
+        action='store_true',
+        help='With --package, also bundle the packages it depends on'
+    )
+    parser.add_argument(
+        '--with-dependents',
+        action='store_true',
+        help='With --package, also bundle the packages that depend on it'
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of packages to bundle in parallel (default: 1)'
+    )
+    parser.add_argument(
+        '--compress-threads',
+        type=int,
+        default=1,
+        help='Number of threads compressing the files of each package (default: 1)'
+    )
+    parser.add_argument(
+        '--compression-level',
+        type=int,
+        choices=range(0, 10),
+        default=DEFAULT_COMPRESSION_LEVEL,
+        help=f'Deflate level 1-9, or 0 to store files uncompressed (default: {DEFAULT_COMPRESSION_LEVEL})'
+    )
+    parser.add_argument(
+        '--store-extensions',
+        type=str,
+        default=','.join(STORED_EXTENSIONS),
+        help='Comma-separated file extensions stored without compression '
+             f'(default: {",".join(STORED_EXTENSIONS)})'
+    )
+    parser.add_argument(
+        '--zstd-level',
+        type=int,
+        default=None,
+        help='Also create a zstd-compressed .mhl.zst variant at this level (1-22); requires zstandard'
+    )
+    parser.add_argument(
+        '--delta',
+        action='store_true',
+        help='Also create a delta archive against the previously published build'
+    )
+    parser.add_argument(
+        '--delta-base',
+        type=str,
+        default=None,
+        help='URL or directory of the previously published .mip.json files '
+             '(default: the location in each package\'s mhl_url)'
+    )
+    parser.add_argument(
+        '--layered',
+        action='store_true',
+        help='Also create a shared base archive plus a per-platform overlay'
+    )
+    parser.add_argument(
+        '--layers-only',
+        action='store_true',
+        help='Like --layered, but builds that get layers publish neither the '
+             'full .mhl nor its zstd variant'
+    )
     
     args = parser.parse_args()
     
     # Create bundler
-    bundler = PackageBundler(
-        dry_run=args.dry_run,
-        input_dir=args.input_dir,
-        output_dir=args.output_dir
-    )
+    try:
+        bundler = PackageBundler(
+            dry_run=args.dry_run,
+            input_dir=args.input_dir,
+            output_dir=args.output_dir,
+            jobs=args.jobs,
+            compress_threads=args.compress_threads,
+            compression_level=args.compression_level,
+            stored_extensions=[ext.strip() for ext in args.store_extensions.split(',') if ext.strip()],
+            zstd_level=args.zstd_level,
+            delta=args.delta,
+            delta_base=args.delta_base,
+            layered=args.layered,
+            layers_only=args.layers_only
+        )
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
     
     # Bundle all packages
     print("Starting package bundling process...")
     if args.dry_run:
         print("[DRY RUN MODE - No actual bundling will occur]")
     
-    success = bundler.bundle_all()
+    success = bundler.bundle_all(
+        package_names=[args.package] if args.package else None,
+        with_deps=args.with_deps,
+        with_dependents=args.with_dependents
+    )
     
     if success:
         print("\n✓ All packages bundled successfully")
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Persistent local cache for compiled package artifacts.
+
+A compilation is identified by a key that hashes:
+1. Every file of the prepared .dir (except mip.json), which includes the
+   upstream sources and the compile script
+2. The compile script name
+3. The toolchain: the versions of the C, C++ and Fortran compilers, the
+   compiler flags in the environment and the MATLAB executable
+4. The build's build_type, matlab_tag, abi_tag and platform_tag
+
+The files a compilation creates or modifies (e.g. .mexa64 files) are
+stored under that key, along with the files it deletes. Files are
+compared by content hash, not by size and modification time. When the
+same key comes up again, the stored files are put back in place and the
+deleted files are removed instead of compiling.
+
+Entries are evicted least-recently-used first once the total size of
+the cache exceeds its size cap.
+
+Layout:
+    <cache_dir>/entries/<key>/manifest.json
+    <cache_dir>/entries/<key>/files/<relative path>
+    <cache_dir>/tmp/
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from typing import Dict, Any, Optional
+
+from build_utils import file_sha256
+from source_cache import SourceCache, evict_lru, parse_size
+
+
+DEFAULT_COMPILE_CACHE_MAX_SIZE = '2G'
+
+# Compilers whose version is part of the key: (environment variable, default)
+TOOLCHAIN_COMPILERS = [('CC', 'gcc'), ('CXX', 'g++'), ('FC', 'gfortran')]
+
+# Environment variables with compiler flags that are part of the key
+TOOLCHAIN_FLAG_VARS = ['CFLAGS', 'CXXFLAGS', 'FFLAGS', 'LDFLAGS', 'MEXFLAGS']
+
+# Files of a .dir that do not affect compilation
+_IGNORED_FILES = {'mip.json'}
+
+# Snapshot of a .dir: relative path -> sha256
+Snapshot = Dict[str, str]
+
+
+def default_compile_cache_dir() -> str:
+    """Get the default cache directory ($MIP_COMPILE_CACHE_DIR or ~/.cache/mip-core/compiled)."""
+    if os.environ.get('MIP_COMPILE_CACHE_DIR'):
+        return os.environ['MIP_COMPILE_CACHE_DIR']
+    xdg_cache = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(xdg_cache, 'mip-core', 'compiled')
+
+
+def _compiler_version(compiler: str) -> str:
+    """First line of `compiler --version`, or 'none' if it is not available."""
+    try:
+        result = subprocess.run(
+            [compiler, '--version'], capture_output=True, text=True, timeout=30
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return 'none'
+    lines = result.stdout.splitlines()
+    return lines[0].strip() if result.returncode == 0 and lines else 'none'
+
+
+def toolchain_fingerprint(matlab: str) -> Dict[str, str]:
+    """
+    Describe the toolchain used for compilation.
+
+    Args:
+        matlab: MATLAB executable
+
+    Returns:
+        Dict of compiler versions, compiler flags and the resolved MATLAB path
+    """
+    toolchain = {}
+    for var, default in TOOLCHAIN_COMPILERS:
+        toolchain[var] = _compiler_version(os.environ.get(var, default))
+    for var in TOOLCHAIN_FLAG_VARS:
+        toolchain[var] = os.environ.get(var, '')
+    # The MATLAB installation directory contains the release (e.g. R2024b)
+    matlab_path = shutil.which(matlab)
+    toolchain['matlab'] = os.path.realpath(matlab_path) if matlab_path else matlab
+    return toolchain
+
+
+def snapshot_dir(dir_path: str) -> Snapshot:
+    """Record the sha256 of every file in a directory tree."""
+    snapshot = {}
+    for root, dirs, files in os.walk(dir_path):
+        for file in files:
+            path = os.path.join(root, file)
+            rel_path = os.path.relpath(path, dir_path).replace(os.sep, '/')
+            if rel_path in _IGNORED_FILES:
+                continue
+            snapshot[rel_path] = file_sha256(path)
+    return snapshot
+
+
+class CompileCache:
+    """Cache of compilation outputs keyed by sources and toolchain."""
+
+    def __init__(self, cache_dir: str, max_bytes: int = parse_size(DEFAULT_COMPILE_CACHE_MAX_SIZE),
+                 matlab: str = 'matlab'):
+        """
+        Initialize the compile cache.
+
+        Args:
+            cache_dir: Root directory of the cache
+            max_bytes: Total size above which least-recently-used entries are evicted
+            matlab: MATLAB executable used for compilation
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.matlab = matlab
+        self.entries_dir = os.path.join(self.cache_dir, 'entries')
+        self.tmp_dir = os.path.join(self.cache_dir, 'tmp')
+        self._toolchain = None
+
+        for d in [self.entries_dir, self.tmp_dir]:
+            os.makedirs(d, exist_ok=True)
+
+    @property
+    def toolchain(self) -> Dict[str, str]:
+        """Toolchain fingerprint, computed on first use."""
+        if self._toolchain is None:
+            self._toolchain = toolchain_fingerprint(self.matlab)
+        return self._toolchain
+
+    def compute_key(self, sources: Snapshot, compile_script: str,
+                    mip_data: Dict[str, Any]) -> str:
+        """
+        Compute the cache key of compiling a .dir.
+
+        Args:
+            sources: snapshot_dir() of the prepared .dir directory
+            compile_script: Name of the compile script inside the .dir
+            mip_data: The .dir's mip.json
+
+        Returns:
+            Hex digest identifying the compilation
+        """
+        key_data = {
+            'sources': sources,
+            'compile_script': compile_script,
+            'toolchain': self.toolchain,
+            'build_type': os.environ.get('BUILD_TYPE', 'standard'),
+            'build': {
+                tag: mip_data.get(tag) for tag in ['matlab_tag', 'abi_tag', 'platform_tag']
+            },
+        }
+        serialized = json.dumps(key_data, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(serialized).hexdigest()
+
+    def restore(self, key: str, dir_path: str) -> Optional[Dict[str, Any]]:
+        """
+        Put the cached outputs of a compilation back into a .dir.
+
+        Args:
+            key: Cache key from compute_key()
+            dir_path: Path to the prepared .dir directory
+
+        Returns:
+            The entry's manifest (files, deleted, compile_duration), or None
+            on a miss
+        """
+        entry_dir = os.path.join(self.entries_dir, key)
+        try:
+            with open(os.path.join(entry_dir, 'manifest.json'), 'r') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        SourceCache.touch(entry_dir)
+        for rel_path in manifest['files']:
+            destination = os.path.join(dir_path, rel_path)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.copy2(os.path.join(entry_dir, 'files', rel_path), destination)
+        for rel_path in manifest.get('deleted', []):
+            path = os.path.join(dir_path, rel_path)
+            if os.path.isfile(path):
+                os.remove(path)
+        return manifest
+
+    def store(self, key: str, dir_path: str, before: Snapshot, compile_duration: float) -> int:
+        """
+        Store the files a compilation created or modified, and the list of
+        files it deleted.
+
+        Args:
+            key: Cache key from compute_key(), computed before compiling
+            dir_path: Path to the compiled .dir directory
+            before: snapshot_dir() of dir_path taken before compiling
+            compile_duration: How long the compilation took
+
+        Returns:
+            Number of files stored
+        """
+        after = snapshot_dir(dir_path)
+        changed = sorted(p for p, sha256 in after.items() if before.get(p) != sha256)
+        deleted = sorted(p for p in before if p not in after)
+
+        temp_entry = tempfile.mkdtemp(dir=self.tmp_dir)
+        for rel_path in changed:
+            destination = os.path.join(temp_entry, 'files', rel_path)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.copy2(os.path.join(dir_path, rel_path), destination)
+        with open(os.path.join(temp_entry, 'manifest.json'), 'w') as f:
+            json.dump({
+                'files': changed,
+                'deleted': deleted,
+                'compile_duration': round(compile_duration, 2),
+            }, f, indent=2)
+
+        entry_dir = os.path.join(self.entries_dir, key)
+        try:
+            os.rename(temp_entry, entry_dir)
+        except OSError:
+            # Another worker stored the same compilation first
+            if not os.path.isdir(entry_dir):
+                raise
+            shutil.rmtree(temp_entry, ignore_errors=True)
+
+        evict_lru([self.entries_dir], self.max_bytes, keep=entry_dir, label='cached build')
+        return len(changed)
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Compile prepared MATLAB packages in parallel MATLAB processes.
+
+This script is the Python counterpart of compile_packages.m. It:
+1. Discovers all .dir directories in build/prepared/
+2. Reads each .dir's mip.json and the package's prepare.yaml to find the
+   compile_script of the build matching BUILD_TYPE
+3. Runs each compile script in its own MATLAB process (`matlab -batch`),
+   several packages at a time, in dependency order
+4. Writes each package's compile output to build/logs/compile/<name>.log
+5. Updates mip.json with compilation duration
+
+Compilation outputs are cached (see compile_cache.py): a package whose
+sources, compile script and toolchain are unchanged since an earlier
+build gets its compiled files restored instead of being compiled again.
+
+The MATLAB executable is configurable (--matlab or $MATLAB), so a stub
+can stand in for MATLAB in tests.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from compile_cache import (
+    CompileCache, default_compile_cache_dir, snapshot_dir, DEFAULT_COMPILE_CACHE_MAX_SIZE
+)
+from source_cache import parse_size
+from package_graph import (
+    PackageGraph, DependencyCycleError, load_package_specs, default_packages_dir,
+    completed_future
+)
+
+
+def find_compile_script(mip_data: Dict[str, Any], yaml_data: Dict[str, Any],
+                        build_type: str) -> Optional[str]:
+    """
+    Find the compile_script of the build a .dir was prepared from.
+
+    Args:
+        mip_data: The .dir's mip.json
+        yaml_data: The package's prepare.yaml
+        build_type: Current BUILD_TYPE
+
+    Returns:
+        The compile script name, or None if no compilation is needed
+    """
+    for build in yaml_data.get('builds', []):
+        if (build.get('build_type') == build_type
+                and build.get('matlab_tag') == mip_data.get('matlab_tag')
+                and build.get('abi_tag') == mip_data.get('abi_tag')
+                and build.get('platform_tag') == mip_data.get('platform_tag')):
+            return build.get('compile_script')
+    return None
+
+
+class PackageCompiler:
+    """Handles compiling prepared MATLAB packages."""
+
+    def __init__(self, dry_run=False, input_dir=None, packages_dir=None,
+                 log_dir=None, matlab='matlab', jobs=1, timeout=None, cache_dir=None,
+                 cache_max_size=DEFAULT_COMPILE_CACHE_MAX_SIZE):
+        """
+        Initialize the package compiler.
+
+        Args:
+            dry_run: If True, simulate operations without compiling
+            input_dir: Directory containing .dir packages (default: build/prepared)
+            packages_dir: Directory containing package specs (default: packages/)
+            log_dir: Directory for per-package compile logs (default: build/logs/compile)
+            matlab: MATLAB executable
+            jobs: Number of packages compiled concurrently
+            timeout: Optional timeout in seconds for each compilation
+            cache_dir: Compile cache directory (None disables the cache)
+            cache_max_size: Size cap of the compile cache (e.g. '2G')
+        """
+        self.dry_run = dry_run
+        self.matlab = matlab
+        self.jobs = max(1, jobs)
+        self.timeout = timeout
+
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.input_dir = input_dir or os.path.join(project_root, 'build', 'prepared')
+        self.packages_dir = packages_dir or default_packages_dir()
+        self.log_dir = log_dir or os.path.join(project_root, 'build', 'logs', 'compile')
+
+        self.specs = load_package_specs(self.packages_dir)
+
+        self.compile_cache = None
+        if cache_dir and not self.dry_run:
+            self.compile_cache = CompileCache(
+                cache_dir, max_bytes=parse_size(cache_max_size), matlab=matlab
+            )
+
+    def compile_script_for(self, dir_path: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Look up what a .dir needs to be compiled.
+
+        Returns:
+            Tuple of (package name, compile script); the compile script
+            is None if no compilation is needed
+        """
+        try:
+            with open(os.path.join(dir_path, 'mip.json'), 'r') as f:
+                mip_data = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+
+        name = mip_data.get('name')
+        if name not in self.specs:
+            return name, None
+
+        build_type = os.environ.get('BUILD_TYPE', 'standard')
+        return name, find_compile_script(mip_data, self.specs[name]['yaml'], build_type)
+
+    def _update_compile_duration(self, dir_path: str, compile_duration: float):
+        """Update mip.json with compilation duration."""
+        mip_json_path = os.path.join(dir_path, 'mip.json')
+        with open(mip_json_path, 'r') as f:
+            mip_data = json.load(f)
+        mip_data['compile_duration'] = round(compile_duration, 2)
+        with open(mip_json_path, 'w') as f:
+            json.dump(mip_data, f, indent=2)
+
+    def compile_package(self, dir_path: str, compile_script: str) -> Tuple[bool, str]:
+        """
+        Compile a single .dir package in its own MATLAB process.
+
+        Args:
+            dir_path: Path to the .dir directory
+            compile_script: Name of the compile script inside dir_path
+
+        Returns:
+            Tuple of (success, log output)
+        """
+        dir_name = os.path.basename(dir_path)
+        lines = [f"\n{dir_name}: Found {compile_script} - compiling..."]
+
+        compile_script_path = os.path.join(dir_path, compile_script)
+        if not os.path.exists(compile_script_path):
+            lines.append(f"  Error: Compile script not found: {compile_script_path}")
+            return False, '\n'.join(lines) + '\n'
+
+        if self.dry_run:
+            lines.append(f"  [DRY RUN] Would run {compile_script}")
+            return True, '\n'.join(lines) + '\n'
+
+        cache_key = None
+        if self.compile_cache is not None:
+            with open(os.path.join(dir_path, 'mip.json'), 'r') as f:
+                mip_data = json.load(f)
+            before = snapshot_dir(dir_path)
+            cache_key = self.compile_cache.compute_key(before, compile_script, mip_data)
+            cached = self.compile_cache.restore(cache_key, dir_path)
+            if cached is not None:
+                lines.append(
+                    f"  Restored {len(cached['files'])} compiled file(s) from cache ({cache_key[:12]})"
+                )
+                self._update_compile_duration(dir_path, cached['compile_duration'])
+                lines.append(f"  Updated mip.json with compile_duration: {cached['compile_duration']:.2f}s")
+                return True, '\n'.join(lines) + '\n'
+
+        # Same as compile_packages.m: cd into the package and run the script
+        script_name = os.path.splitext(compile_script)[0]
+        escaped_dir = os.path.abspath(dir_path).replace("'", "''")
+        command = f"cd('{escaped_dir}'); {script_name}"
+
+        lines.append(f"  Running {compile_script}...")
+        compile_start = time.time()
+        try:
+            result = subprocess.run(
+                [self.matlab, '-batch', command],
+                capture_output=True,
+                text=True,
+                timeout=self.timeout
+            )
+            output = result.stdout + result.stderr
+            success = result.returncode == 0
+            if not success:
+                output += f"\nMATLAB exited with code {result.returncode}\n"
+        except subprocess.TimeoutExpired as e:
+            output = (e.stdout or '') if isinstance(e.stdout, str) else ''
+            output += f"\nTimed out after {self.timeout} seconds\n"
+            success = False
+        except OSError as e:
+            output = f"Could not run {self.matlab}: {e}\n"
+            success = False
+        compile_duration = time.time() - compile_start
+
+        # Keep the full MATLAB output in a per-package log file
+        os.makedirs(self.log_dir, exist_ok=True)
+        log_path = os.path.join(self.log_dir, f"{dir_name}.log")
+        with open(log_path, 'w') as f:
+            f.write(output)
+
+        lines.extend(f"    {line}" for line in output.rstrip('\n').splitlines())
+        lines.append(f"  Log: {log_path}")
+
+        if not success:
+            lines.append(f"  Error during compilation")
+            return False, '\n'.join(lines) + '\n'
+
+        lines.append(f"  Compilation completed in {compile_duration:.2f} seconds")
+        if cache_key is not None:
+            stored = self.compile_cache.store(cache_key, dir_path, before, compile_duration)
+            lines.append(f"  Cached {stored} compiled file(s) ({cache_key[:12]})")
+        self._update_compile_duration(dir_path, compile_duration)
+        lines.append(f"  Updated mip.json with compile_duration: {compile_duration:.2f}s")
+        return True, '\n'.join(lines) + '\n'
+
+    def _compile_dirs(self, plan: List[Tuple[str, str]]) -> Tuple[bool, str]:
+        """Compile the .dir directories of one package one after another."""
+        outputs = []
+        for dir_path, compile_script in plan:
+            success, output = self.compile_package(dir_path, compile_script)
+            outputs.append(output)
+            if not success:
+                return False, ''.join(outputs)
+        return True, ''.join(outputs)
+
+    def compile_all(self, package_names=None, with_deps=False, with_dependents=False):
+        """
+        Compile all .dir packages that need compilation.
+
+        Packages are compiled concurrently (up to jobs at a time), each
+        after the packages it depends on.
+
+        Args:
+            package_names: Optional packages to compile (default: all)
+            with_deps: Also compile the dependencies of package_names
+            with_dependents: Also compile the packages depending on package_names
+
+        Returns:
+            True if all succeeded, False if any failed
+        """
+        if not os.path.exists(self.input_dir):
+            print(f"Error: Prepared packages directory not found: {self.input_dir}")
+            return False
+
+        dir_paths = sorted(
+            os.path.join(self.input_dir, d)
+            for d in os.listdir(self.input_dir)
+            if os.path.isdir(os.path.join(self.input_dir, d)) and d.endswith('.dir')
+        )
+
+        if not dir_paths:
+            print(f"No .dir directories found in {self.input_dir}")
+            return True
+
+        print(f"Found {len(dir_paths)} .dir package(s)")
+
+        graph = PackageGraph.from_specs(self.specs)
+        try:
+            selected = None
+            if package_names:
+                selected = graph.select(package_names, with_deps, with_dependents)
+        except KeyError as e:
+            print(f"Error: Unknown package {e}")
+            return False
+
+        # Compile plan: package name -> [(dir_path, compile_script)]
+        plan = {}
+        for dir_path in dir_paths:
+            name, compile_script = self.compile_script_for(dir_path)
+            if selected is not None and name not in selected:
+                continue
+            if compile_script is None:
+                print(f"{os.path.basename(dir_path)}: No compilation needed")
+                continue
+            plan.setdefault(name, []).append((dir_path, compile_script))
+
+        print(f"Packages requiring compilation: {len(plan)}")
+        if not plan:
+            return True
+
+        def on_complete(name, future):
+            try:
+                success, output = future.result()
+            except Exception as e:
+                success, output = False, f"\n{name}: Compilation failed: {e}\n"
+            print(output, end='', flush=True)
+            return success
+
+        try:
+            if self.jobs == 1:
+                results = graph.schedule(
+                    plan, lambda name: completed_future(self._compile_dirs, plan[name]), on_complete
+                )
+            else:
+                print(f"Compiling with {self.jobs} parallel MATLAB process(es)")
+                with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                    results = graph.schedule(
+                        plan, lambda name: executor.submit(self._compile_dirs, plan[name]), on_complete
+                    )
+        except DependencyCycleError as e:
+            print(f"Error: {e}")
+            return False
+
+        failed = sorted(name for name, result in results.items() if not result)
+        if failed:
+            print(f"\nError: Compilation failed for {len(failed)} package(s): {', '.join(failed)}")
+            return False
+
+        return True
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(
+        description='Compile prepared MATLAB packages in parallel MATLAB processes'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Simulate operations without compiling'
+    )
+    parser.add_argument(
+        '--input-dir',
+        type=str,
+        help='Directory containing .dir packages (default: build/prepared)'
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of packages compiled concurrently (default: 1, like '
+             'compile_packages.m; each job is a MATLAB process that takes a '
+             'license seat and several GB of memory)'
+    )
+    parser.add_argument(
+        '--matlab',
+        type=str,
+        default=os.environ.get('MATLAB', 'matlab'),
+        help='MATLAB executable (default: $MATLAB or matlab)'
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=None,
+        help='Timeout in seconds for each compilation'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=default_compile_cache_dir(),
+        help='Directory for cached compilation outputs (default: $MIP_COMPILE_CACHE_DIR or ~/.cache/mip-core/compiled)'
+    )
+    parser.add_argument(
+        '--cache-max-size',
+        type=str,
+        default=DEFAULT_COMPILE_CACHE_MAX_SIZE,
+        help=f'Size cap of the compile cache, e.g. 500M or 10G (default: {DEFAULT_COMPILE_CACHE_MAX_SIZE})'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Always compile, without using or filling the compile cache'
+    )
+    parser.add_argument(
+        '--package',
+        type=str,
+        help='Compile only the specified package by name'
+    )
+    parser.add_argument(
+        '--with-deps',
+        action='store_true',
+        help='With --package, also compile the packages it depends on'
+    )
+    parser.add_argument(
+        '--with-dependents',
+        action='store_true',
+        help='With --package, also compile the packages that depend on it'
+    )
+
+    args = parser.parse_args()
+
+    compiler = PackageCompiler(
+        dry_run=args.dry_run,
+        input_dir=args.input_dir,
+        matlab=args.matlab,
+        jobs=args.jobs,
+        timeout=args.timeout,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        cache_max_size=args.cache_max_size
+    )
+
+    print("Starting package compilation process...")
+    if args.dry_run:
+        print("[DRY RUN MODE - No actual compilation will occur]")
+    print(f"Prepared packages directory: {compiler.input_dir}")
+    print(f"BUILD_TYPE: {os.environ.get('BUILD_TYPE', 'standard')}")
+
+    success = compiler.compile_all(
+        package_names=[args.package] if args.package else None,
+        with_deps=args.with_deps,
+        with_dependents=args.with_dependents
+    )
+
+    if success:
+        print("\n✓ All packages compiled successfully")
+        return 0
+    else:
+        print("\n✗ Compilation process failed")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
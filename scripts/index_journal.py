@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Journal of the published package metadata, kept in the bucket.
+
+upload_packages.py records every .mip.json it publishes in the journal,
+and assemble_index.py reads it instead of listing every object under
+core/packages/ (which includes all archives ever published).
+
+The journal is a single JSON object:
+    {
+      "packages": {"<.mip.json key>": {"etag": "...", "updated": "..."}},
+      "complete": true,
+      "updated": "..."
+    }
+
+It is only ever replaced with a conditional write: If-Match on the ETag it
+was read with, or If-None-Match: * when it is created. A writer that loses
+a race with another writer reads the journal again and reapplies its
+change, so concurrent uploads never drop each other's entries.
+
+Uploaders only update an existing journal. assemble_index.py creates it,
+or rebuilds it, from a full listing of the bucket. While the bucket is
+being listed the journal is marked incomplete ("complete": false) and not
+trusted by readers, but uploaders keep recording in it. Entries recorded
+during the listing are merged with the listing, so no upload is lost.
+"""
+
+import json
+import time
+import random
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+
+JOURNAL_KEY = 'core/index-journal.json'
+
+# Conflicting conditional writes before giving up
+MAX_CONFLICTS = 10
+
+_CONFLICT_CODES = {'PreconditionFailed', 'ConditionalRequestConflict'}
+
+# .mip.json key -> {'etag': ..., 'updated': ...}
+Entries = Dict[str, Dict[str, Any]]
+
+
+def _error_code(error: ClientError) -> str:
+    return error.response.get('Error', {}).get('Code', '')
+
+
+class IndexJournal:
+    """Reads and conditionally updates the index journal object."""
+
+    def __init__(self, s3_client, bucket_name: str, key: str = JOURNAL_KEY):
+        """
+        Initialize the journal.
+
+        Args:
+            s3_client: boto3 S3 client
+            bucket_name: Bucket holding the journal
+            key: Key of the journal object
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+
+    def _read(self) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Read the journal object: (contents, ETag), or (None, None) if it does not exist."""
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.key)
+        except ClientError as e:
+            if _error_code(e) in ('NoSuchKey', '404'):
+                return None, None
+            raise
+        journal = json.loads(response['Body'].read().decode('utf-8'))
+        journal.setdefault('packages', {})
+        return journal, response['ETag']
+
+    def load(self) -> Tuple[Optional[Entries], Optional[str]]:
+        """
+        Read the journal.
+
+        Returns:
+            Tuple of (entries, ETag of the journal object); both are None
+            if the journal does not exist or is being rebuilt
+        """
+        journal, etag = self._read()
+        if journal is None or not journal.get('complete', True):
+            return None, None
+        return journal['packages'], etag
+
+    def _write(self, entries: Entries, etag: Optional[str], complete: bool = True):
+        """Replace the journal if it still has the given ETag (or create it if etag is None)."""
+        condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+        body = {
+            'packages': {key: entries[key] for key in sorted(entries)},
+            'complete': complete,
+            'updated': datetime.utcnow().isoformat() + 'Z',
+        }
+        self.s3_client.put_object(
+            Bucket=self.bucket_name,
+            Key=self.key,
+            Body=json.dumps(body, indent=2).encode('utf-8'),
+            ContentType='application/json',
+            CacheControl='no-cache',
+            **condition
+        )
+
+    def _update(self, change: Callable[[Entries], bool], create: bool = False,
+                complete: Optional[bool] = None) -> Optional[bool]:
+        """
+        Apply a change to the journal's entries with a conditional write.
+
+        The change is reapplied to a fresh read whenever another writer
+        replaced the journal in the meantime.
+
+        Args:
+            change: Modifies the entries in place; returns whether it
+                changed anything
+            create: Create the journal if it does not exist
+            complete: Mark the journal complete or incomplete; by default
+                it stays as it is
+
+        Returns:
+            True if the journal was updated, False if the change had
+            nothing to do, None if there is no journal (and create is False)
+        """
+        for attempt in range(MAX_CONFLICTS):
+            journal, journal_etag = self._read()
+            if journal is None and not create:
+                return None
+            entries = journal['packages'] if journal else {}
+            changed = change(entries)
+            was_complete = journal.get('complete', True) if journal else None
+            mark = was_complete if complete is None else complete
+            if not changed and mark == was_complete:
+                return False
+            try:
+                self._write(entries, journal_etag, mark)
+                return True
+            except ClientError as e:
+                if _error_code(e) not in _CONFLICT_CODES:
+                    raise
+            # Another writer replaced the journal since it was read
+            time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+        raise Exception(f"Could not update {self.key}: {MAX_CONFLICTS} conflicting writes")
+
+    def record(self, mip_json_key: str, etag: str) -> Optional[bool]:
+        """
+        Record a published .mip.json in the journal.
+
+        Args:
+            mip_json_key: Key of the .mip.json
+            etag: ETag of the .mip.json object
+
+        Returns:
+            True if the journal was updated, False if it already had the
+            entry, None if there is no journal yet
+        """
+        def change(entries):
+            if entries.get(mip_json_key, {}).get('etag') == etag:
+                return False
+            entries[mip_json_key] = {
+                'etag': etag, 'updated': datetime.utcnow().isoformat() + 'Z'
+            }
+            return True
+
+        return self._update(change)
+
+    def remove(self, stale: Dict[str, str]) -> int:
+        """
+        Remove entries of .mip.json files that no longer exist.
+
+        An entry is kept if it was recorded again, with another ETag, after
+        it was read.
+
+        Args:
+            stale: Key -> ETag of the entries to remove
+
+        Returns:
+            Number of entries removed
+        """
+        removed = []
+
+        def change(entries):
+            removed[:] = [
+                key for key, etag in stale.items()
+                if key in entries and entries[key].get('etag') == etag
+            ]
+            for key in removed:
+                del entries[key]
+            return bool(removed)
+
+        self._update(change)
+        return len(removed)
+
+    def rebuild(self, list_entries: Callable[[], Entries]) -> Entries:
+        """
+        Create or replace the journal from a full listing of the bucket.
+
+        The journal is first marked incomplete (or created as such), so
+        that uploads during the listing are still recorded, but readers do
+        not trust it if the rebuild never finishes. The entries recorded
+        since then are merged into the listing, which is written with
+        If-Match; entries of .mip.json files that are neither listed nor
+        recorded again are dropped.
+
+        Args:
+            list_entries: Lists the bucket; returns the entries of all
+                published .mip.json files
+
+        Returns:
+            The entries of the rebuilt journal
+        """
+        before = {}
+
+        def remember(entries):
+            before.clear()
+            before.update(json.loads(json.dumps(entries)))
+            return False
+
+        self._update(remember, create=True, complete=False)
+        listed = list_entries()
+        for attempt in range(MAX_CONFLICTS):
+            journal, journal_etag = self._read()
+            current = journal['packages'] if journal else {}
+            # Entries recorded by uploaders while the bucket was being listed
+            recorded = {
+                key: entry for key, entry in current.items() if before.get(key) != entry
+            }
+            entries = {**listed, **recorded}
+            try:
+                self._write(entries, journal_etag)
+                return entries
+            except ClientError as e:
+                if _error_code(e) not in _CONFLICT_CODES:
+                    raise
+            time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+        raise Exception(f"Could not rebuild {self.key}: {MAX_CONFLICTS} conflicting writes")
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Dependency graph of the packages defined in packages/.
+
+This module:
+1. Reads the `dependencies` declared in each prepare.yaml
+2. Orders packages so that dependencies come before their dependents
+3. Detects dependency cycles
+4. Selects a package together with its dependencies and/or dependents
+5. Schedules work on an executor, starting each package as soon as all
+   of its dependencies have finished successfully
+
+Dependencies on packages that are not defined in packages/ are ignored
+for ordering purposes.
+
+Run directly to print the build order:
+    python scripts/package_graph.py [--package NAME] [--with-deps] [--with-dependents]
+"""
+
+import os
+import sys
+import argparse
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+import yaml
+
+
+class DependencyCycleError(ValueError):
+    """Raised when package dependencies form a cycle."""
+
+
+def default_packages_dir() -> str:
+    """Get the packages/ directory of this repository."""
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(project_root, 'packages')
+
+
+def load_package_specs(packages_dir: str) -> Dict[str, Dict]:
+    """
+    Load all prepare.yaml files in a packages directory.
+
+    Args:
+        packages_dir: Directory containing one subdirectory per package
+
+    Returns:
+        Dict mapping package name to {'dir': package directory, 'yaml': parsed YAML}
+    """
+    specs = {}
+    for d in sorted(os.listdir(packages_dir)):
+        package_dir = os.path.join(packages_dir, d)
+        yaml_path = os.path.join(package_dir, 'prepare.yaml')
+        if not os.path.isfile(yaml_path):
+            continue
+        with open(yaml_path, 'r') as f:
+            yaml_data = yaml.safe_load(f) or {}
+        name = yaml_data.get('name', d)
+        specs[name] = {'dir': package_dir, 'yaml': yaml_data}
+    return specs
+
+
+def completed_future(fn: Callable, *args, **kwargs) -> Future:
+    """Run a function immediately and wrap its outcome in a completed Future."""
+    future = Future()
+    try:
+        future.set_result(fn(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+class PackageGraph:
+    """Directed acyclic graph of package dependencies."""
+
+    def __init__(self, dependencies: Dict[str, Iterable[str]]):
+        """
+        Initialize the graph.
+
+        Args:
+            dependencies: Dict mapping each package name to the names it depends on
+        """
+        self.dependencies = {
+            name: sorted(set(d for d in deps if d in dependencies and d != name))
+            for name, deps in dependencies.items()
+        }
+        self.dependents = {name: [] for name in self.dependencies}
+        for name, deps in self.dependencies.items():
+            for dep in deps:
+                self.dependents[dep].append(name)
+        for name in self.dependents:
+            self.dependents[name].sort()
+
+    @classmethod
+    def from_specs(cls, specs: Dict[str, Dict]) -> 'PackageGraph':
+        """Build the graph from load_package_specs() output."""
+        return cls({
+            name: spec['yaml'].get('dependencies', []) or []
+            for name, spec in specs.items()
+        })
+
+    def _closure(self, names: Iterable[str], edges: Dict[str, List[str]]) -> Set[str]:
+        """All packages reachable from names along edges (including names)."""
+        seen = set()
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            stack.extend(edges.get(name, []))
+        return seen
+
+    def select(self, names: Iterable[str], with_deps: bool = False,
+               with_dependents: bool = False) -> Set[str]:
+        """
+        Select packages by name, optionally with their dependencies and/or dependents.
+
+        Args:
+            names: Package names to start from
+            with_deps: Include all (transitive) dependencies
+            with_dependents: Include all (transitive) dependents
+
+        Returns:
+            Set of selected package names
+
+        Raises:
+            KeyError: If a name is not a known package
+        """
+        names = list(names)
+        for name in names:
+            if name not in self.dependencies:
+                raise KeyError(name)
+
+        selected = set(names)
+        if with_deps:
+            selected |= self._closure(names, self.dependencies)
+        if with_dependents:
+            selected |= self._closure(names, self.dependents)
+        return selected
+
+    def find_cycle(self) -> Optional[List[str]]:
+        """
+        Find a dependency cycle.
+
+        Returns:
+            List of package names forming a cycle (first name repeated at
+            the end), or None if the graph is acyclic
+        """
+        state = {}  # name -> 'visiting' or 'done'
+        path = []
+
+        def visit(name):
+            state[name] = 'visiting'
+            path.append(name)
+            for dep in self.dependencies[name]:
+                if state.get(dep) == 'visiting':
+                    return path[path.index(dep):] + [dep]
+                if dep not in state:
+                    cycle = visit(dep)
+                    if cycle:
+                        return cycle
+            path.pop()
+            state[name] = 'done'
+            return None
+
+        for name in sorted(self.dependencies):
+            if name not in state:
+                cycle = visit(name)
+                if cycle:
+                    return cycle
+        return None
+
+    def topological_order(self, names: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Order packages so that every package comes after its dependencies.
+
+        Ties are broken alphabetically, so the order is deterministic.
+
+        Args:
+            names: Packages to order (default: all packages)
+
+        Returns:
+            Ordered list of package names
+
+        Raises:
+            DependencyCycleError: If the dependencies form a cycle
+        """
+        cycle = self.find_cycle()
+        if cycle:
+            raise DependencyCycleError(f"Dependency cycle: {' -> '.join(cycle)}")
+
+        selected = set(self.dependencies if names is None else names)
+        remaining = {
+            name: set(d for d in self.dependencies[name] if d in selected)
+            for name in selected
+        }
+
+        order = []
+        ready = sorted(name for name, deps in remaining.items() if not deps)
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for dependent in self.dependents[name]:
+                if dependent in remaining and name in remaining[dependent]:
+                    remaining[dependent].discard(name)
+                    if not remaining[dependent]:
+                        ready.append(dependent)
+                        ready.sort()
+        return order
+
+    def schedule(self, names: Iterable[str], submit: Callable[[str], Future],
+                 on_complete: Callable[[str, Future], bool]) -> Dict[str, Optional[bool]]:
+        """
+        Run work for packages in dependency order, in parallel where possible.
+
+        A package is submitted as soon as all of its selected dependencies
+        have completed successfully. If a package fails, its (transitive)
+        dependents are skipped; independent packages keep running.
+
+        Args:
+            names: Packages to process
+            submit: Starts the work for a package and returns its Future
+                (e.g. executor.submit, or completed_future for serial runs)
+            on_complete: Called with each finished package and its Future;
+                returns whether the package succeeded
+
+        Returns:
+            Dict mapping package name to True (succeeded), False (failed)
+            or None (skipped because a dependency failed)
+
+        Raises:
+            DependencyCycleError: If the dependencies form a cycle
+        """
+        order = self.topological_order(names)
+        selected = set(order)
+        waiting_on = {
+            name: set(d for d in self.dependencies[name] if d in selected)
+            for name in order
+        }
+        results = {}
+        running = {}
+
+        def start_ready():
+            for name in order:
+                if name in results or name in running.values() or waiting_on[name]:
+                    continue
+                running[submit(name)] = name
+
+        def skip_dependents(name):
+            for dependent in self._closure(self.dependents[name], self.dependents):
+                if dependent in selected and dependent not in results:
+                    results[dependent] = None
+
+        start_ready()
+        while running:
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                success = bool(on_complete(name, future))
+                results[name] = success
+                if success:
+                    for dependent in self.dependents[name]:
+                        if dependent in waiting_on:
+                            waiting_on[dependent].discard(name)
+                else:
+                    skip_dependents(name)
+            start_ready()
+
+        return results
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(
+        description='Print packages in dependency order'
+    )
+    parser.add_argument(
+        '--package',
+        type=str,
+        action='append',
+        help='Start from the specified package (can be repeated)'
+    )
+    parser.add_argument(
+        '--with-deps',
+        action='store_true',
+        help='Include the dependencies of the selected packages'
+    )
+    parser.add_argument(
+        '--with-dependents',
+        action='store_true',
+        help='Include the packages that depend on the selected packages'
+    )
+
+    args = parser.parse_args()
+
+    graph = PackageGraph.from_specs(load_package_specs(default_packages_dir()))
+
+    try:
+        names = None
+        if args.package:
+            names = graph.select(args.package, args.with_deps, args.with_dependents)
+        for name in graph.topological_order(names):
+            print(name)
+    except KeyError as e:
+        print(f"Error: Unknown package {e}")
+        return 1
+    except DependencyCycleError as e:
+        print(f"Error: {e}")
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -17,141 +17,560 @@ import shutil
 import subprocess
 import argparse
 import time
+import hashlib
 import requests
 import zipfile
+import tempfile
+import contextlib
 import yaml
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 
+from build_utils import run_captured, file_sha256
+from source_cache import SourceCache, default_cache_dir, parse_size, DEFAULT_CACHE_MAX_SIZE
+from package_graph import (
+    PackageGraph, DependencyCycleError, load_package_specs, completed_future
+)
 
-def download_and_extract_zip(url: str, destination: str):
+
+# Streaming download settings
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = (10, 60)  # (connect, read) seconds
+DOWNLOAD_MAX_RETRIES = 5
+
+
+def stream_download(url: str, path: str, expected_sha256: Optional[str] = None) -> Dict[str, Any]:
     """
-    Download a ZIP file from a URL and extract it to destination.
+    Download a URL to a file in fixed-size chunks.
+    
+    Memory use is bounded by the chunk size. If the connection drops, the
+    download resumes from the last received byte using an HTTP Range
+    request (guarded by If-Range so a changed upstream file restarts the
+    download instead of being spliced). A response that ends before the
+    size announced by Content-Length or Content-Range is resumed the same
+    way.
     
     Args:
-        url: The URL to download the ZIP file from
-        destination: The directory name to extract to
-    """
-    download_file = "temp_download.zip"
+        url: The URL to download
+        path: The local file to write to
+        expected_sha256: Optional hex digest the downloaded file must match
+    
+    Returns:
+        Dict with the file's sha256, size, and the response's etag and
+        last_modified validators
     
-    print(f'  Downloading {url}...')
-    response = requests.get(url, timeout=30)
-    response.raise_for_status()
+    Raises:
+        ValueError: If expected_sha256 is given and does not match, or if
+            the server sends more bytes than it announced
+    """
+    hasher = hashlib.sha256()
+    written = 0
+    # Total size of the file, as announced by the server (None if unknown)
+    expected_size = None
+    attempt = 0
+    info = {'etag': None, 'last_modified': None}
     
-    with open(download_file, 'wb') as f:
-        f.write(response.content)
-    print('  Download complete.')
+    with open(path, 'wb') as f:
+        while True:
+            headers = {'Accept-Encoding': 'identity'}
+            if written:
+                headers['Range'] = f'bytes={written}-'
+                etag = info['etag']
+                validator = etag if etag and not etag.startswith('W/') else info['last_modified']
+                if validator:
+                    headers['If-Range'] = validator
+            
+            try:
+                with requests.get(url, headers=headers, stream=True,
+                                  timeout=DOWNLOAD_TIMEOUT) as response:
+                    response.raise_for_status()
+                    
+                    if written and response.status_code != 206:
+                        # Server ignored the range (or the file changed): start over
+                        print('  Server did not resume the download, restarting...')
+                        f.seek(0)
+                        f.truncate()
+                        hasher = hashlib.sha256()
+                        written = 0
+                    
+                    if not written:
+                        info['etag'] = response.headers.get('ETag')
+                        info['last_modified'] = response.headers.get('Last-Modified')
+                    expected_size = _announced_size(response, written)
+                    
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        written += len(chunk)
+                    
+                    if expected_size is not None and written != expected_size:
+                        if written > expected_size:
+                            raise ValueError(
+                                f"Download of {url} is larger than announced: "
+                                f"{written} of {expected_size} bytes"
+                            )
+                        raise requests.ConnectionError(
+                            f"Response ended after {written} of {expected_size} bytes"
+                        )
+                break
+                
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                attempt += 1
+                if attempt > DOWNLOAD_MAX_RETRIES:
+                    raise
+                print(f'  Connection dropped after {written} bytes ({e})')
+                print(f'  Resuming download (attempt {attempt}/{DOWNLOAD_MAX_RETRIES})...')
+                time.sleep(min(2 ** attempt, 30))
     
-    print(f"  Extracting to {destination}...")
-    with zipfile.ZipFile(download_file, 'r') as zip_ref:
-        zip_ref.extractall(destination)
+    digest = hasher.hexdigest()
+    if expected_sha256 and digest != expected_sha256.lower():
+        raise ValueError(
+            f"SHA256 mismatch for {url}: expected {expected_sha256}, got {digest}"
+        )
     
-    os.remove(download_file)
+    info['sha256'] = digest
+    info['size'] = written
+    return info
 
 
-def clone_git_repository(url: str, destination: str):
+def _announced_size(response: requests.Response, offset: int) -> Optional[int]:
     """
-    Clone a git repository and remove .git directories.
+    Get the total file size announced by a download response.
     
     Args:
-        url: The URL of the git repository to clone
-        destination: The directory name to clone into
+        response: Response to a download request
+        offset: Number of bytes already downloaded before this response
+    
+    Returns:
+        Size in bytes from Content-Range (206) or Content-Length (200),
+        or None if the server did not announce it
     """
-    print(f'  Cloning {url}...')
-    subprocess.run(
-        ["git", "clone", url, destination],
-        check=True,
-        capture_output=True
-    )
+    if response.status_code == 206:
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get('Content-Length', '')
+    return offset + int(length) if length.isdigit() else None
+
+
+def _is_unchanged_upstream(url: str, record: Dict[str, Any]) -> bool:
+    """
+    Revalidate a cached download with a conditional request.
     
-    # Remove .git directories to reduce size
-    print("  Removing .git directories...")
-    for root, dirs, files in os.walk(destination):
-        if ".git" in dirs:
-            git_dir = os.path.join(root, ".git")
-            shutil.rmtree(git_dir)
-            dirs.remove(".git")
+    Returns:
+        True if the server confirms (304) that the cached copy is current
+    """
+    headers = {}
+    if record.get('etag'):
+        headers['If-None-Match'] = record['etag']
+    if record.get('last_modified'):
+        headers['If-Modified-Since'] = record['last_modified']
+    if not headers:
+        return False
+    
+    try:
+        with requests.get(url, headers=headers, stream=True,
+                          timeout=DOWNLOAD_TIMEOUT) as response:
+            return response.status_code == 304
+    except requests.RequestException:
+        return False
 
 
-def collect_exposed_symbols(base_dir: str, extensions: List[str]) -> List[str]:
+def _cached_zip_candidates(url: str, sha256: Optional[str], cache: SourceCache):
+    """
+    Yield download info of the cached archives that may be used for a URL.
+    
+    First the archive with the declared sha256, then the archive last
+    downloaded from the URL if the server reports it unchanged.
     """
-    Collect exposed symbols from a directory.
+    if sha256:
+        yield {'sha256': sha256.lower()}
+    record = cache.lookup_zip_url(url)
+    if (record and (not sha256 or record['sha256'] == sha256.lower())
+            and _is_unchanged_upstream(url, record)):
+        yield record
+
+
+def download_and_extract_zip(url: str, destination: str,
+                             sha256: Optional[str] = None,
+                             cache: Optional[SourceCache] = None) -> Dict[str, Any]:
+    """
+    Download a ZIP file from a URL and extract it to destination.
+    
+    With a cache, an archive whose sha256 is declared and already cached is
+    used without touching the network, and an archive downloaded before
+    from the same URL is reused if the server reports it unchanged.
     
     Args:
-        base_dir: The directory to scan
-        extensions: List of file extensions to include (e.g., ['.m', '.c'])
+        url: The URL to download the ZIP file from
+        destination: The directory to extract to
+        sha256: Optional expected sha256 of the ZIP file
+        cache: Optional source cache
     
     Returns:
-        List of symbol names
+        Download info with the archive's sha256
     """
-    symbols = []
+    if cache is not None:
+        # The cached archive is locked while it is extracted, so that
+        # another worker cannot evict it meanwhile
+        for info in _cached_zip_candidates(url, sha256, cache):
+            with cache.lock(cache.zip_path(info['sha256']), shared=True):
+                archive_path = cache.get_zip(info['sha256'])
+                if archive_path:
+                    print(f'  Using cached archive for {url}')
+                    print(f"  Extracting to {os.path.basename(destination)}...")
+                    with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+                        zip_ref.extractall(destination)
+                    return info
+    
+    if cache is not None:
+        download_file = cache.temp_path(suffix='.zip')
+    else:
+        # Use a unique temp file next to the destination so concurrent
+        # preparations never share a download file
+        parent_dir = os.path.dirname(os.path.abspath(destination))
+        os.makedirs(parent_dir, exist_ok=True)
+        fd, download_file = tempfile.mkstemp(suffix='.zip', dir=parent_dir)
+        os.close(fd)
+    
+    try:
+        print(f'  Downloading {url}...')
+        info = stream_download(url, download_file, expected_sha256=sha256)
+        print(f"  Download complete ({info['size']} bytes).")
+        if sha256:
+            print('  Verified sha256 checksum.')
+        
+        # Extract before the archive goes into the cache, where another
+        # worker's eviction could remove it
+        print(f"  Extracting to {os.path.basename(destination)}...")
+        with zipfile.ZipFile(download_file, 'r') as zip_ref:
+            zip_ref.extractall(destination)
+        
+        if cache is not None:
+            cache.store_zip(url, download_file, info)
+            download_file = None
+    finally:
+        if download_file and os.path.exists(download_file):
+            os.remove(download_file)
+    
+    return info
+
+
+def _run_git(args: List[str], cwd: Optional[str] = None) -> str:
+    """Run a git command and return its stdout, raising with git's stderr on failure."""
+    result = subprocess.run(
+        ["git", *args],
+        cwd=cwd,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"git {args[0]} failed: {result.stderr.strip()}")
+    return result.stdout
 
-    if not os.path.exists(base_dir):
-        return symbols
 
-    items = os.listdir(base_dir)
+def _is_commit_hash(ref: Optional[str]) -> bool:
+    """Check whether a ref is a full commit hash."""
+    return bool(ref) and len(ref) == 40 and all(c in '0123456789abcdef' for c in ref.lower())
 
-    for item in sorted(items):
-        item_path = os.path.join(base_dir, item)
 
-        if os.path.isfile(item_path):
-            # Check if file has one of the specified extensions
-            for ext in extensions:
-                if item.endswith(ext):
-                    # Remove the extension
-                    symbols.append(item[:-len(ext)])
-                    break
-        elif os.path.isdir(item_path) and (item.startswith('+') or item.startswith('@')):
-            # Add package or class directory (without + or @)
-            symbols.append(item[1:])
+def _update_git_mirror(url: str, ref: Optional[str], cache: SourceCache) -> str:
+    """
+    Create or update the cached bare mirror of a repository.
+    
+    A mirror that already contains a pinned commit is used without
+    contacting the remote. The caller must hold the mirror's lock.
+    
+    Returns:
+        Path to the mirror
+    """
+    mirror = cache.mirror_path(url)
     
-    return symbols
+    if os.path.isdir(mirror):
+        if _is_commit_hash(ref):
+            result = subprocess.run(
+                ["git", "cat-file", "-e", f"{ref}^{{commit}}"],
+                cwd=mirror,
+                capture_output=True
+            )
+            if result.returncode == 0:
+                print(f'  Using cached mirror of {url}')
+                cache.touch(mirror)
+                return mirror
+        print(f'  Updating cached mirror of {url}...')
+        _run_git(["remote", "update", "--prune"], cwd=mirror)
+        cache.touch(mirror)
+        cache.evict(keep=mirror)
+        return mirror
+    
+    print(f'  Creating cached mirror of {url}...')
+    temp_dir = cache.temp_dir()
+    try:
+        temp_mirror = os.path.join(temp_dir, 'mirror.git')
+        _run_git(["clone", "-q", "--mirror", url, temp_mirror])
+        return cache.add_mirror(url, temp_mirror)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
 
 
-def generate_recursive_paths(base_path: str, exclude_dirs: List[str]) -> List[str]:
+def clone_git_repository(url: str, destination: str, ref: Optional[str] = None,
+                         shallow: bool = False,
+                         sparse_paths: Optional[List[str]] = None,
+                         cache: Optional[SourceCache] = None) -> str:
     """
-    Generate a list of all subdirectories recursively, excluding specified directories.
+    Clone a git repository and remove its .git directory.
+    
+    By default the full history of the default branch is cloned. A ref
+    (branch, tag or commit), a shallow fetch and a sparse checkout can be
+    requested to avoid transferring history and files that are never used.
     
     Args:
-        base_path: The base directory to start from
-        exclude_dirs: List of directory names to exclude
+        url: The URL of the git repository to clone
+        destination: The directory to clone into
+        ref: Optional branch, tag or commit to check out
+        shallow: If True, fetch only the requested commit (depth 1)
+        sparse_paths: Optional repository-relative directories to check out
+        cache: Optional source cache; if given, the clone is made from a
+            local bare mirror that is kept up to date with the remote
     
     Returns:
-        List of relative paths
+        The commit hash that was checked out
+    """
+    with contextlib.ExitStack() as stack:
+        source = url
+        if cache is not None:
+            # The mirror stays locked until the clone is done, so that no
+            # other worker updates or evicts it meanwhile
+            stack.enter_context(cache.lock(cache.mirror_path(url)))
+            # file:// so that shallow fetches are honored for the local mirror
+            source = 'file://' + _update_git_mirror(url, ref, cache)
+        
+        print(f'  Cloning {url}...')
+        
+        if ref or shallow or sparse_paths:
+            _run_git(["init", "-q", destination])
+            _run_git(["remote", "add", "origin", source], cwd=destination)
+        
+            if sparse_paths:
+                print(f"  Sparse checkout: {', '.join(sparse_paths)}")
+                _run_git(["sparse-checkout", "set", "--cone", *sparse_paths], cwd=destination)
+        
+            fetch_args = ["fetch", "-q"]
+            if shallow:
+                fetch_args += ["--depth", "1"]
+            if sparse_paths:
+                # Only download the blobs that the sparse checkout needs
+                fetch_args += ["--filter=blob:none"]
+            fetch_args += ["origin", ref or "HEAD"]
+        
+            _run_git(fetch_args, cwd=destination)
+            _run_git(["checkout", "-q", "--detach", "FETCH_HEAD"], cwd=destination)
+        else:
+            _run_git(["clone", "-q", source, destination])
+    
+    commit = _run_git(["rev-parse", "HEAD"], cwd=destination).strip()
+    print(f"  Checked out commit {commit}")
+    
+    # Remove .git directory to reduce size
+    print("  Removing .git directory...")
+    shutil.rmtree(os.path.join(destination, ".git"))
+    
+    return commit
+
+
+def _sparse_paths_for(config: Dict[str, Any],
+                      addpaths_config: List[Any]) -> Optional[List[str]]:
+    """
+    Determine the sparse checkout directories for a clone_git section.
+    
+    `sparse: true` limits the checkout to the addpaths under the clone
+    destination; `sparse` may also be an explicit list of
+    repository-relative directories. Returns None for a full checkout.
+    """
+    sparse = config.get('sparse', False)
+    if not sparse:
+        return None
+    if isinstance(sparse, list):
+        return sparse
+    
+    destination = config['destination'].strip('/')
+    sparse_paths = []
+    for path_item in addpaths_config:
+        path = path_item if isinstance(path_item, str) else path_item['path']
+        path = path.strip('/')
+        if path == destination:
+            # The repository root is on the path, so everything is needed
+            return None
+        if path.startswith(destination + '/'):
+            sparse_paths.append(path[len(destination) + 1:])
+    
+    return sorted(set(sparse_paths)) or None
+
+
+# MEX binaries removed from source trees (for example, kdtree has windows
+# and macos mex files checked in)
+MEX_EXTENSIONS = ['.mexw64', '.mexa64', '.mexmaci64', '.mexmaca64', '.mexw32', '.mexglx', '.mexmac']
+
+
+class PackageTreeIndex:
+    """
+    In-memory index of a package directory tree.
+    
+    The tree is scanned once with os.scandir, visiting each directory a
+    single time. Path generation, symbol collection and MEX binary lookup
+    are then answered from the index without touching the filesystem again.
     """
-    paths = []
     
-    for root, dirs, files in os.walk(base_path):
-        # Remove excluded directories from the search
-        dirs[:] = [d for d in dirs if d not in exclude_dirs]
+    def __init__(self, root: str):
+        """
+        Scan a directory tree.
+        
+        Args:
+            root: The directory to index
+        """
+        self.root = root
+        # Relative directory path ('' for root) -> (file names, subdirectory names)
+        self.dirs: Dict[str, tuple] = {}
         
-        # Add this directory if it contains .m files
-        m_files = [f for f in files if f.endswith('.m')]
-        if m_files:
-            # Get relative path from base_path parent
-            rel_path = os.path.relpath(root, os.path.dirname(base_path))
-            paths.append(rel_path)
+        stack = ['']
+        while stack:
+            rel_dir = stack.pop()
+            files, subdirs = [], []
+            try:
+                with os.scandir(os.path.join(root, rel_dir)) as it:
+                    for entry in it:
+                        if entry.is_dir():
+                            subdirs.append(entry.name)
+                            # Like os.walk, list symlinked directories but don't descend
+                            if not entry.is_symlink():
+                                stack.append(os.path.join(rel_dir, entry.name))
+                        elif entry.is_file():
+                            files.append(entry.name)
+            except OSError:
+                continue
+            self.dirs[rel_dir] = (files, subdirs)
     
-    return sorted(paths)
+    @staticmethod
+    def _key(path: str) -> str:
+        """Normalize a relative path (as written in prepare.yaml) to an index key."""
+        path = os.path.normpath(path)
+        return '' if path == '.' else path
+    
+    def find_files(self, extensions: List[str]) -> List[str]:
+        """Get relative paths of all files ending with one of the extensions."""
+        matches = []
+        for rel_dir, (files, _) in self.dirs.items():
+            for file in files:
+                if any(file.endswith(ext) for ext in extensions):
+                    matches.append(os.path.join(rel_dir, file))
+        return sorted(matches)
+    
+    def remove_file(self, rel_path: str):
+        """Delete a file from disk and from the index."""
+        os.remove(os.path.join(self.root, rel_path))
+        rel_dir, name = os.path.split(rel_path)
+        self.dirs[rel_dir][0].remove(name)
+    
+    def recursive_paths(self, base_path: str, exclude_dirs: List[str]) -> List[str]:
+        """
+        Get all directories under base_path that contain .m files.
+        
+        Args:
+            base_path: The base directory, relative to the root
+            exclude_dirs: Directory names to exclude (at any depth)
+        
+        Returns:
+            Sorted list of paths relative to the root
+        """
+        base = self._key(base_path)
+        if base not in self.dirs:
+            return []
+        
+        paths = []
+        stack = [base]
+        while stack:
+            rel_dir = stack.pop()
+            files, subdirs = self.dirs.get(rel_dir, ([], []))
+            if any(f.endswith('.m') for f in files):
+                paths.append(rel_dir)
+            for d in subdirs:
+                if d not in exclude_dirs:
+                    stack.append(os.path.join(rel_dir, d))
+        
+        return sorted(paths)
+    
+    def exposed_symbols(self, path: str, extensions: List[str]) -> List[Dict[str, str]]:
+        """
+        Collect exposed symbols from a directory.
+        
+        Args:
+            path: The directory to scan, relative to the root
+            extensions: List of file extensions to include (e.g., ['.m', '.c'])
+        
+        Returns:
+            List of symbols, each a dict with the symbol name, its kind
+            ('function', 'class' for @ directories, 'package' for +
+            directories) and its path relative to the root
+        """
+        key = self._key(path)
+        if key not in self.dirs:
+            return []
+        
+        files, subdirs = self.dirs[key]
+        file_names = set(files)
+        symbols = []
+        
+        for item in sorted(files + subdirs):
+            item_path = os.path.join(key, item).replace(os.sep, '/')
+            if item in file_names:
+                # Check if file has one of the specified extensions
+                for ext in extensions:
+                    if item.endswith(ext):
+                        # Remove the extension
+                        symbols.append({'name': item[:-len(ext)], 'kind': 'function', 'path': item_path})
+                        break
+            elif item.startswith('+') or item.startswith('@'):
+                # Add package or class directory (without + or @)
+                kind = 'package' if item.startswith('+') else 'class'
+                symbols.append({'name': item[1:], 'kind': kind, 'path': item_path})
+        
+        return symbols
+
+
+def _matlab_cell_array(items: List[str]) -> str:
+    """Format strings as a multi-line MATLAB cell array literal."""
+    quoted = ["'" + item.replace("'", "''") + "'" for item in items]
+    return "{ ...\n" + ", ...\n".join(f"        {q}" for q in quoted) + " ...\n    }"
 
 
 def create_load_and_unload_scripts(mhl_dir: str, paths: List[str]):
     """
     Create load_package.m and unload_package.m scripts.
     
+    Each script changes the MATLAB path with a single addpath/rmpath call
+    on a precomputed path string, so MATLAB rescans its path cache once
+    rather than once per directory.
+    
     Args:
         mhl_dir: The MHL package directory
         paths: List of paths to add to MATLAB path
     """
+    # addpath puts the first entry of a path string on top, whereas adding
+    # directories one at a time leaves the last one on top; list them in
+    # reverse to keep the established precedence
+    rel_paths = _matlab_cell_array(list(reversed(paths)))
+    
     # Create load_package.m
     load_script_path = os.path.join(mhl_dir, 'load_package.m')
     with open(load_script_path, 'w') as f:
         f.write("function load_package()\n")
         f.write("    % Add package directories to MATLAB path\n")
         f.write("    pkg_dir = fileparts(mfilename('fullpath'));\n")
-        for path in paths:
-            f.write(f"    addpath(fullfile(pkg_dir, '{path}'));\n")
+        if paths:
+            f.write(f"    rel_paths = {rel_paths};\n")
+            f.write("    addpath(strjoin(fullfile(pkg_dir, rel_paths), pathsep));\n")
         f.write("end\n")
     
     # Create unload_package.m
@@ -160,8 +579,9 @@ def create_load_and_unload_scripts(mhl_dir: str, paths: List[str]):
         f.write("function unload_package()\n")
         f.write("    % Remove package directories from MATLAB path\n")
         f.write("    pkg_dir = fileparts(mfilename('fullpath'));\n")
-        for path in paths:
-            f.write(f"    rmpath(fullfile(pkg_dir, '{path}'));\n")
+        if paths:
+            f.write(f"    rel_paths = {rel_paths};\n")
+            f.write("    rmpath(strjoin(fullfile(pkg_dir, rel_paths), pathsep));\n")
         f.write("end\n")
 
 
@@ -187,13 +607,51 @@ def get_current_platform_tag() -> str:
     return 'any'
 
 
+_session = None
+
+
+def _get_session() -> requests.Session:
+    """Get this process's shared HTTP session (keep-alive connection pooling)."""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
+def _prepare_package_worker(preparer: 'PackagePreparer', package_dir: str):
+    """
+    Prepare one package directory in a worker process.
+    
+    All output is captured and returned so that the parent process can
+    print each package's log as a single block.
+    
+    Returns:
+        Tuple of (success, captured output, paths of the .dir directories
+        that were prepared)
+    """
+    preparer.prepared_dirs = []
+    success, output = run_captured(preparer.prepare_package_dir, package_dir)
+    return bool(success), output, preparer.prepared_dirs
+
+
 class PackagePreparer:
     """Handles preparing MATLAB packages from YAML specifications."""
     
-    def __init__(self, dry_run=False, force=False, output_dir=None):
+    def __init__(self, dry_run=False, force=False, output_dir=None, jobs=1,
+                 cache_dir=None, cache_max_size=DEFAULT_CACHE_MAX_SIZE,
+                 defer_manifest=False):
         self.dry_run = dry_run
         self.force = force
+        self.jobs = max(1, jobs)
+        # Leave writing manifest records to the caller (see
+        # record_prepared_dir()), e.g. until the build is also uploaded
+        self.defer_manifest = defer_manifest
         self.base_url = "https://mip-packages.neurosift.app/core/packages"
+        self.index_url = "https://mip-org.github.io/mip-core/index.json"
+        self._remote_index = None
+        
+        # .dir directories prepared by this preparer (skipped builds excluded)
+        self.prepared_dirs = []
         
         if output_dir:
             self.output_dir = output_dir
@@ -203,6 +661,16 @@ class PackagePreparer:
         
         if not self.dry_run:
             os.makedirs(self.output_dir, exist_ok=True)
+        
+        # Local manifest of input fingerprints, one record per build
+        self.manifest_dir = os.path.join(
+            os.path.dirname(os.path.abspath(self.output_dir)), 'manifest'
+        )
+        
+        # Source cache for downloaded archives and git mirrors (None disables it)
+        self.source_cache = None
+        if cache_dir and not self.dry_run:
+            self.source_cache = SourceCache(cache_dir, max_bytes=parse_size(cache_max_size))
     
     def _get_mhl_filename(self, package_data: Dict[str, Any], build: Dict[str, Any]) -> str:
         """Generate the .mhl filename for a package build."""
@@ -211,114 +679,330 @@ class PackagePreparer:
             f"{build['matlab_tag']}-{build['abi_tag']}-{build['platform_tag']}.mhl"
         )
     
-    def _check_existing_package(self, mhl_filename: str, package_data: Dict[str, Any]) -> bool:
-        """Check if package exists in bucket with matching metadata."""
-        mip_json_url = f"{self.base_url}/{mhl_filename}.mip.json"
+    def _load_remote_index(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Fetch the published index.json once and key its entries by .mhl filename.
         
+        Returns:
+            Dict mapping .mhl filename to its published metadata (empty if
+            the index could not be fetched)
+        """
+        if self._remote_index is not None:
+            return self._remote_index
+        
+        self._remote_index = {}
         try:
-            response = requests.get(mip_json_url, timeout=10)
+            response = _get_session().get(self.index_url, timeout=10)
+            response.raise_for_status()
+            packages = response.json().get('packages', [])
+        except (requests.RequestException, ValueError) as e:
+            print(f"Warning: Could not fetch package index: {e}")
+            return self._remote_index
+        
+        for metadata in packages:
+            mip_json_url = metadata.get('mip_json_url', '')
+            if mip_json_url.endswith('.mip.json'):
+                mhl_filename = os.path.basename(mip_json_url)[:-len('.mip.json')]
+            else:
+                mhl_filename = os.path.basename(metadata.get('mhl_url', ''))
+            if mhl_filename:
+                self._remote_index[mhl_filename] = metadata
+        
+        print(f"Loaded package index with {len(self._remote_index)} published build(s)")
+        return self._remote_index
+    
+    def _metadata_matches(self, existing_metadata: Dict[str, Any],
+                          package_data: Dict[str, Any]) -> bool:
+        """Compare key metadata fields of a published build with the YAML spec."""
+        fields_to_compare = [
+            'name', 'description', 'version', 'build_number',
+            'dependencies', 'homepage', 'repository', 'license'
+        ]
+        
+        for field in fields_to_compare:
+            if existing_metadata.get(field) != package_data.get(field):
+                print(f"  Metadata mismatch in field '{field}'")
+                return False
+        
+        return True
+    
+    def _published_metadata(self, mhl_filename: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the metadata of the published build.
+        
+        Uses the published index when the build is listed there, and only
+        falls back to fetching the build's .mip.json for builds that are
+        missing from the index (e.g. published after the index was assembled).
+        
+        Returns:
+            The published metadata, or None if the build is not published
+            or could not be checked
+        """
+        existing_metadata = self._load_remote_index().get(mhl_filename)
+        if existing_metadata is not None:
+            return existing_metadata
+        
+        mip_json_url = f"{self.base_url}/{mhl_filename}.mip.json"
+        try:
+            response = _get_session().get(mip_json_url, timeout=10)
             if response.status_code == 404:
                 print(f"  Package not found in bucket")
-                return False
+                return None
             
             response.raise_for_status()
-            existing_metadata = response.json()
+            return response.json()
             
-            # Compare key metadata fields
-            fields_to_compare = [
-                'name', 'description', 'version', 'build_number',
-                'dependencies', 'homepage', 'repository', 'license'
-            ]
-            
-            for field in fields_to_compare:
-                if existing_metadata.get(field) != package_data.get(field):
-                    print(f"  Metadata mismatch in field '{field}'")
-                    return False
-            
-            print(f"  Package exists with matching metadata")
-            return True
-            
-        except requests.RequestException as e:
+        except (requests.RequestException, ValueError) as e:
             print(f"  Error checking existing package: {e}")
+            return None
+    
+    def _check_existing_package(self, mhl_filename: str, package_data: Dict[str, Any]) -> bool:
+        """Check if package exists in bucket with matching metadata."""
+        existing_metadata = self._published_metadata(mhl_filename)
+        if existing_metadata is None:
             return False
+        
+        if not self._metadata_matches(existing_metadata, package_data):
+            return False
+        
+        print(f"  Package exists with matching metadata")
+        return True
+    
+    def _resolve_upstream(self, prepare_config: Dict[str, Any]) -> Optional[str]:
+        """
+        Resolve the upstream source to an immutable identifier.
+        
+        Git sources resolve to a commit hash (via ls-remote unless the ref is
+        already a commit). ZIP sources resolve to the declared sha256, or to
+        the server's ETag/Last-Modified validator.
+        
+        Returns:
+            Identifier string, or None if the source cannot be resolved
+        """
+        if 'clone_git' in prepare_config:
+            config = prepare_config['clone_git']
+            ref = config.get('ref')
+            if _is_commit_hash(ref):
+                return f"git:{ref.lower()}"
+            try:
+                output = _run_git(["ls-remote", config['url'], ref or "HEAD"])
+            except RuntimeError as e:
+                print(f"  Warning: Could not resolve {config['url']}: {e}")
+                return None
+            refs = [line.split('\t') for line in output.splitlines() if '\t' in line]
+            # Prefer the peeled commit of an annotated tag
+            peeled = [sha for sha, name in refs if name.endswith('^{}')]
+            commits = peeled or [sha for sha, name in refs]
+            return f"git:{commits[0]}" if commits else None
+        
+        if 'download_zip' in prepare_config:
+            config = prepare_config['download_zip']
+            if config.get('sha256'):
+                return f"sha256:{config['sha256'].lower()}"
+            try:
+                response = _get_session().head(config['url'], allow_redirects=True, timeout=10)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                print(f"  Warning: Could not resolve {config['url']}: {e}")
+                return None
+            etag = response.headers.get('ETag')
+            if etag and not etag.startswith('W/'):
+                return f"etag:{etag}"
+            if response.headers.get('Last-Modified'):
+                return f"last-modified:{response.headers['Last-Modified']}"
+            return None
+        
+        return "none"
+    
+    @staticmethod
+    def _fetched_upstream(prepare_config: Dict[str, Any], fetched: Any) -> Optional[str]:
+        """
+        Identify the upstream source that was actually fetched.
+        
+        Produces the same kind of identifier as _resolve_upstream(), so
+        that the two can be compared on the next run.
+        
+        Args:
+            prepare_config: The prepare section of prepare.yaml
+            fetched: Commit returned by clone_git_repository(), or download
+                info returned by download_and_extract_zip()
+        
+        Returns:
+            Identifier string, or None if the source cannot be identified
+        """
+        if 'clone_git' in prepare_config:
+            return f"git:{fetched}"
+        
+        if 'download_zip' in prepare_config:
+            if prepare_config['download_zip'].get('sha256'):
+                return f"sha256:{fetched['sha256']}"
+            etag = fetched.get('etag')
+            if etag and not etag.startswith('W/'):
+                return f"etag:{etag}"
+            if fetched.get('last_modified'):
+                return f"last-modified:{fetched['last_modified']}"
+            return None
+        
+        return "none"
+    
+    def _compute_fingerprint(self, package_dir: str, yaml_data: Dict[str, Any],
+                             build: Dict[str, Any], upstream: str) -> str:
+        """
+        Compute the input fingerprint of a build.
+        
+        Covers the prepare.yaml contents, the compile script, the upstream
+        source and the version of this tool.
+        
+        Args:
+            upstream: Identifier of the upstream source, from
+                _resolve_upstream() or _fetched_upstream()
+        
+        Returns:
+            Hex digest
+        """
+        def file_digest(path):
+            return file_sha256(path) if os.path.exists(path) else None
+        
+        inputs = {
+            'prepare_yaml': file_digest(os.path.join(package_dir, 'prepare.yaml')),
+            'compile_script': (
+                file_digest(os.path.join(package_dir, build['compile_script']))
+                if 'compile_script' in build else None
+            ),
+            'upstream': upstream,
+            'build': build,
+            'tool_version': file_digest(os.path.abspath(__file__)),
+        }
+        encoded = json.dumps(inputs, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()
+    
+    def _manifest_entry_path(self, wheel_name: str) -> str:
+        """Path of the manifest record for a build (one file per build)."""
+        return os.path.join(self.manifest_dir, f"{wheel_name}.json")
+    
+    def _read_manifest_entry(self, wheel_name: str) -> Optional[Dict[str, Any]]:
+        """Read the manifest record of the last successful prepare of a build."""
+        try:
+            with open(self._manifest_entry_path(wheel_name), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+    
+    def _write_manifest_entry(self, wheel_name: str, fingerprint: str):
+        """Record the fingerprint of a successfully prepared build."""
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        entry = {
+            'wheel_name': wheel_name,
+            'fingerprint': fingerprint,
+            'prepared_at': datetime.utcnow().isoformat() + 'Z'
+        }
+        entry_path = self._manifest_entry_path(wheel_name)
+        fd, tmp_path = tempfile.mkstemp(suffix='.json', dir=self.manifest_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp_path, entry_path)
+    
+    def _remove_manifest_entry(self, wheel_name: str):
+        """Forget a build's fingerprint (e.g. after a failed prepare)."""
+        try:
+            os.remove(self._manifest_entry_path(wheel_name))
+        except FileNotFoundError:
+            pass
+    
+    def record_prepared_dir(self, dir_path: str):
+        """
+        Write the manifest record of a prepared .dir from the fingerprint
+        in its mip.json. Used with defer_manifest.
+        """
+        try:
+            with open(os.path.join(dir_path, 'mip.json'), 'r') as f:
+                fingerprint = json.load(f).get('fingerprint')
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if fingerprint:
+            self._write_manifest_entry(os.path.basename(dir_path)[:-len('.dir')], fingerprint)
     
     def _prepare_package(self, package_dir: str, yaml_data: Dict[str, Any], 
                         build: Dict[str, Any], mhl_dir: str):
-        """Prepare a single package."""
+        """
+        Prepare a single package.
+        
+        Returns:
+            Tuple of (paths, symbol table, identifier of the fetched upstream
+            source or None)
+        """
         prepare_config = yaml_data.get('prepare', {})
+        fetched = None
         
-        # Change to the mhl_dir for downloads/clones
-        original_dir = os.getcwd()
-        os.chdir(mhl_dir)
+        # Handle download_zip
+        if 'download_zip' in prepare_config:
+            if 'clone_git' in prepare_config:
+                raise ValueError("Cannot have both download_zip and clone_git in prepare.yaml")
+            config = prepare_config['download_zip']
+            fetched = download_and_extract_zip(
+                config['url'], os.path.join(mhl_dir, config['destination']),
+                sha256=config.get('sha256'),
+                cache=self.source_cache
+            )
         
-        try:
-            # Handle download_zip
-            if 'download_zip' in prepare_config:
-                if 'clone_git' in prepare_config:
-                    raise ValueError("Cannot have both download_zip and clone_git in prepare.yaml")
-                config = prepare_config['download_zip']
-                download_and_extract_zip(config['url'], config['destination'])
-            
-            # Handle clone_git
-            elif 'clone_git' in prepare_config:
-                config = prepare_config['clone_git']
-                clone_git_repository(config['url'], config['destination'])
-            
-            # Compute all paths
-            addpaths_config = prepare_config.get('addpaths', [])
-            all_paths = []
-            
-            for path_item in addpaths_config:
-                if isinstance(path_item, str):
-                    # Simple path string
-                    all_paths.append(path_item)
-                elif isinstance(path_item, dict):
-                    path = path_item['path']
-                    if path_item.get('recursive', False):
-                        # Generate recursive paths
-                        exclude = path_item.get('exclude', [])
-                        full_path = os.path.join(mhl_dir, path)
-                        recursive_paths = generate_recursive_paths(full_path, exclude)
-                        all_paths.extend(recursive_paths)
-                    else:
-                        all_paths.append(path)
-            
-            print(f"  Computed {len(all_paths)} path(s)")
-
-            # Remove all mex binaries from source tree, for security
-            # for example, kdtree has windows and macos mex files checked in
-            mex_extensions = ['.mexw64', '.mexa64', '.mexmaci64', '.mexmaca64', '.mexw32', '.mexglx', '.mexmac']
-            print("  Removing mex binaries from source tree...")
-            for root, dirs, files in os.walk(mhl_dir):
-                for file in files:
-                    if any(file.endswith(ext) for ext in mex_extensions):
-                        file_path = os.path.join(root, file)
-                        os.remove(file_path)
-                        print(f"    Removed mex binary: {file_path}")
-            
-            # Create load/unload scripts
-            create_load_and_unload_scripts(mhl_dir, all_paths)
-            
-            # Collect exposed symbols from all paths
-            symbol_extensions = yaml_data.get('symbol_extensions', ['.m'])
-            exposed_symbols = []
-            
-            for path in all_paths:
-                full_path = os.path.join(mhl_dir, path)
-                if os.path.exists(full_path):
-                    symbols = collect_exposed_symbols(full_path, symbol_extensions)
-                    exposed_symbols.extend(symbols)
-            
-            print(f"  Collected {len(exposed_symbols)} exposed symbol(s)")
-            
-            return exposed_symbols
-            
-        finally:
-            os.chdir(original_dir)
+        # Handle clone_git
+        elif 'clone_git' in prepare_config:
+            config = prepare_config['clone_git']
+            fetched = clone_git_repository(
+                config['url'], os.path.join(mhl_dir, config['destination']),
+                ref=config.get('ref'),
+                shallow=config.get('shallow', False),
+                sparse_paths=_sparse_paths_for(config, prepare_config.get('addpaths', [])),
+                cache=self.source_cache
+            )
+        
+        # Index the source tree once
+        tree = PackageTreeIndex(mhl_dir)
+        
+        # Compute all paths
+        addpaths_config = prepare_config.get('addpaths', [])
+        all_paths = []
+        
+        for path_item in addpaths_config:
+            if isinstance(path_item, str):
+                # Simple path string
+                all_paths.append(path_item)
+            elif isinstance(path_item, dict):
+                path = path_item['path']
+                if path_item.get('recursive', False):
+                    # Generate recursive paths
+                    exclude = path_item.get('exclude', [])
+                    all_paths.extend(tree.recursive_paths(path, exclude))
+                else:
+                    all_paths.append(path)
+        
+        print(f"  Computed {len(all_paths)} path(s)")
+
+        # Remove all mex binaries from source tree, for security
+        print("  Removing mex binaries from source tree...")
+        for rel_path in tree.find_files(MEX_EXTENSIONS):
+            tree.remove_file(rel_path)
+            print(f"    Removed mex binary: {os.path.join(mhl_dir, rel_path)}")
+        
+        # Create load/unload scripts
+        create_load_and_unload_scripts(mhl_dir, all_paths)
+        
+        # Collect exposed symbols from all paths
+        symbol_extensions = yaml_data.get('symbol_extensions', ['.m'])
+        symbol_table = []
+        
+        for path in all_paths:
+            symbol_table.extend(tree.exposed_symbols(path, symbol_extensions))
+        
+        print(f"  Collected {len(symbol_table)} exposed symbol(s)")
+        
+        return all_paths, symbol_table, self._fetched_upstream(prepare_config, fetched)
     
     def _create_mip_json(self, mhl_dir: str, yaml_data: Dict[str, Any],
-                        build: Dict[str, Any], exposed_symbols: List[str],
-                        prepare_duration: float, mhl_filename: str):
+                        build: Dict[str, Any], paths: List[str],
+                        symbol_table: List[Dict[str, str]],
+                        prepare_duration: float, mhl_filename: str,
+                        fingerprint: Optional[str] = None):
         """Create mip.json metadata file."""
         mip_data = {
             'name': yaml_data['name'],
@@ -333,10 +1017,13 @@ class PackagePreparer:
             'abi_tag': build['abi_tag'],
             'platform_tag': build['platform_tag'],
             'usage_examples': yaml_data.get('usage_examples', []),
-            'exposed_symbols': exposed_symbols,
+            'paths': paths,
+            'exposed_symbols': [symbol['name'] for symbol in symbol_table],
+            'symbol_table': symbol_table,
             'timestamp': datetime.utcnow().isoformat() + 'Z',
             'prepare_duration': round(prepare_duration, 2),
             'compile_duration': 0,
+            'fingerprint': fingerprint,
             'mhl_url': f"{self.base_url}/{mhl_filename}"
         }
         
@@ -376,18 +1063,40 @@ class PackagePreparer:
             wheel_name = mhl_filename[:-4]  # Remove .mhl
             print(f"  Wheel name: {wheel_name}")
             
-            # Check if exists
-            if not self.force and self._check_existing_package(mhl_filename, yaml_data):
-                print(f"  Skipping - package already up to date")
-                continue
+            output_dir_path = os.path.join(self.output_dir, f"{wheel_name}.dir")
+            
+            if not self.force:
+                recorded = self._read_manifest_entry(wheel_name)
+                if recorded is not None:
+                    # A local record knows about upstream changes that the
+                    # remote metadata comparison cannot see. Upstream is only
+                    # resolved here, where there is a record to compare with.
+                    upstream = self._resolve_upstream(yaml_data.get('prepare', {}))
+                    fingerprint = upstream and self._compute_fingerprint(
+                        package_dir, yaml_data, build, upstream
+                    )
+                    # The record only says this build was prepared here; a
+                    # later compile, bundle or upload may still have failed.
+                    # Skip only once a build of these inputs is published.
+                    if (fingerprint and recorded.get('fingerprint') == fingerprint
+                            and os.path.exists(os.path.join(output_dir_path, 'mip.json'))):
+                        published = self._published_metadata(mhl_filename)
+                        if published and published.get('fingerprint') == fingerprint:
+                            print(f"  Skipping - inputs unchanged since last prepare")
+                            continue
+                        print(f"  Inputs unchanged, but this build is not published yet")
+                    else:
+                        print(f"  Inputs changed since last prepare")
+                    self._remove_manifest_entry(wheel_name)
+                elif self._check_existing_package(mhl_filename, yaml_data):
+                    print(f"  Skipping - package already up to date")
+                    continue
             
             if self.dry_run:
                 print(f"  [DRY RUN] Would prepare {wheel_name}.dir")
                 continue
             
             # Create output directory
-            output_dir_path = os.path.join(self.output_dir, f"{wheel_name}.dir")
-            
             if os.path.exists(output_dir_path):
                 print(f"  Removing existing directory")
                 shutil.rmtree(output_dir_path)
@@ -400,18 +1109,24 @@ class PackagePreparer:
                 print(f"  Preparing package...")
                 prepare_start = time.time()
                 
-                exposed_symbols = self._prepare_package(
+                paths, symbol_table, upstream = self._prepare_package(
                     package_dir, yaml_data, build, output_dir_path
                 )
                 
                 prepare_duration = time.time() - prepare_start
                 print(f"  Prepare completed in {prepare_duration:.2f} seconds")
                 
+                # Fingerprint what was actually fetched, not what upstream
+                # resolved to before fetching
+                fingerprint = upstream and self._compute_fingerprint(
+                    package_dir, yaml_data, build, upstream
+                )
+                
                 # Create mip.json
                 print(f"  Creating mip.json...")
                 self._create_mip_json(
-                    output_dir_path, yaml_data, build, exposed_symbols,
-                    prepare_duration, mhl_filename
+                    output_dir_path, yaml_data, build, paths, symbol_table,
+                    prepare_duration, mhl_filename, fingerprint
                 )
                 
                 # Copy compile script if specified
@@ -425,6 +1140,10 @@ class PackagePreparer:
                     else:
                         print(f"  Warning: compile_script '{compile_script}' not found in package directory")
                 
+                if fingerprint and not self.defer_manifest:
+                    self._write_manifest_entry(wheel_name, fingerprint)
+                
+                self.prepared_dirs.append(output_dir_path)
                 print(f"  Successfully prepared {wheel_name}.dir")
                 
             except Exception as e:
@@ -434,13 +1153,26 @@ class PackagePreparer:
                 
                 if os.path.exists(output_dir_path):
                     shutil.rmtree(output_dir_path, ignore_errors=True)
+                self._remove_manifest_entry(wheel_name)
                 
                 return False
         
         return True
     
-    def prepare_all_packages(self) -> bool:
-        """Prepare all packages in packages/."""
+    def prepare_all_packages(self, package_names: Optional[List[str]] = None,
+                             with_deps: bool = False,
+                             with_dependents: bool = False) -> bool:
+        """
+        Prepare packages in packages/ in dependency order.
+        
+        Args:
+            package_names: Packages to prepare (default: all packages)
+            with_deps: Also prepare the dependencies of package_names
+            with_dependents: Also prepare the packages that depend on package_names
+        
+        Returns:
+            True if all selected packages were prepared successfully
+        """
         project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         packages_dir = os.path.join(project_root, 'packages')
 
@@ -448,31 +1180,86 @@ class PackagePreparer:
             print(f"Error: packages directory not found at {packages_dir}")
             return False
         
-        # Get all package directories
-        package_dirs = [
-            os.path.join(packages_dir, d)
-            for d in os.listdir(packages_dir)
-            if os.path.isdir(os.path.join(packages_dir, d))
-        ]
+        specs = load_package_specs(packages_dir)
         
-        if not package_dirs:
+        if not specs:
             print("No package directories found")
             return False
         
-        print(f"Found {len(package_dirs)} package(s)")
+        graph = PackageGraph.from_specs(specs)
+        
+        if package_names is None:
+            names = set(specs)
+        else:
+            # Accept package directory names as well as package names
+            by_dir = {os.path.basename(spec['dir']): name for name, spec in specs.items()}
+            try:
+                names = graph.select(
+                    [by_dir.get(n, n) for n in package_names], with_deps, with_dependents
+                )
+            except KeyError as e:
+                print(f"Error: Unknown package {e}")
+                return False
+        
+        print(f"Found {len(specs)} package(s), {len(names)} selected")
         print(f"Output directory: {self.output_dir}")
         print(f"BUILD_TYPE: {os.environ.get('BUILD_TYPE', 'standard')}")
         
-        # Prepare each package
-        all_success = True
-        for package_dir in sorted(package_dirs):
-            success = self.prepare_package_dir(package_dir)
-            if not success:
-                print(f"\nError: Preparation failed for {os.path.basename(package_dir)}")
-                all_success = False
-                break
+        if not self.force:
+            # Fetch the published index once, before any workers start, so
+            # every freshness check below is a local lookup
+            self._load_remote_index()
+        
+        try:
+            results = self._prepare_scheduled(graph, names, specs)
+        except DependencyCycleError as e:
+            print(f"\nError: {e}")
+            return False
+        
+        failed = sorted(name for name, result in results.items() if result is False)
+        skipped = sorted(name for name, result in results.items() if result is None)
+        
+        if failed:
+            print(f"\nError: Preparation failed for {len(failed)} package(s): {', '.join(failed)}")
+        if skipped:
+            print(f"Skipped {len(skipped)} package(s) whose dependencies failed: {', '.join(skipped)}")
+        
+        return not failed and not skipped
+    
+    def _prepare_scheduled(self, graph: PackageGraph, names: set,
+                           specs: Dict[str, Dict]) -> Dict[str, Optional[bool]]:
+        """
+        Prepare packages in dependency order.
+        
+        With more than one job, packages run concurrently in a pool of
+        worker processes, so downloads, clones and log output never
+        interfere with each other; each package's log is printed as one
+        block when it finishes. A package starts once its dependencies
+        have been prepared, and is skipped if one of them failed.
         
-        return all_success
+        Returns:
+            Per-package results from PackageGraph.schedule
+        """
+        def on_complete(name, future):
+            try:
+                success, output = future.result()[:2]
+            except Exception as e:
+                success, output = False, f"\nProcessing package: {name}\n  Worker failed: {e}\n"
+            print(output, end='', flush=True)
+            return success
+        
+        if self.jobs == 1:
+            def submit(name):
+                return completed_future(
+                    lambda: (self.prepare_package_dir(specs[name]['dir']), '')
+                )
+            return graph.schedule(names, submit, on_complete)
+        
+        print(f"Preparing with {self.jobs} parallel job(s)")
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            def submit(name):
+                return executor.submit(_prepare_package_worker, self, specs[name]['dir'])
+            return graph.schedule(names, submit, on_complete)
 
 
 def main():
@@ -488,7 +1275,7 @@ def main():
     parser.add_argument(
         '--force',
         action='store_true',
-        help='Rebuild packages even if they exist in the bucket'
+        help='Rebuild packages even if they exist in the bucket or are unchanged locally'
     )
     parser.add_argument(
         '--output-dir',
@@ -500,13 +1287,50 @@ def main():
         type=str,
         help='Prepare only the specified package by name'
     )
+    parser.add_argument(
+        '--with-deps',
+        action='store_true',
+        help='With --package, also prepare the packages it depends on'
+    )
+    parser.add_argument(
+        '--with-dependents',
+        action='store_true',
+        help='With --package, also prepare the packages that depend on it'
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of packages to prepare in parallel (default: 1)'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=default_cache_dir(),
+        help='Directory for cached source archives and git mirrors '
+             '(default: $MIP_CACHE_DIR or ~/.cache/mip-core/sources)'
+    )
+    parser.add_argument(
+        '--cache-max-size',
+        type=str,
+        default=DEFAULT_CACHE_MAX_SIZE,
+        help=f'Size cap of the source cache, e.g. 500M or 10G (default: {DEFAULT_CACHE_MAX_SIZE})'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Always fetch sources from the network without caching them'
+    )
     
     args = parser.parse_args()
     
     preparer = PackagePreparer(
         dry_run=args.dry_run,
         force=args.force,
-        output_dir=args.output_dir
+        output_dir=args.output_dir,
+        jobs=args.jobs,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        cache_max_size=args.cache_max_size
     )
     
     print("Starting package preparation process...")
@@ -514,9 +1338,11 @@ def main():
         print("[DRY RUN MODE - No actual building will occur]")
     if args.force:
         print("[FORCE MODE - Will rebuild all packages]")
+    if preparer.source_cache:
+        print(f"Source cache: {preparer.source_cache.cache_dir}")
     
     if args.package:
-        # Prepare single package
+        # Prepare selected package (and optionally its dependencies/dependents)
         project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         packages_dir = os.path.join(project_root, 'packages')
         package_dir = os.path.join(packages_dir, args.package)
@@ -529,11 +1355,17 @@ def main():
             print(f"\n✗ Error: '{args.package}' is not a directory")
             return 1
         
-        print(f"Preparing single package: {args.package}")
-        print(f"Output directory: {preparer.output_dir}")
-        print(f"BUILD_TYPE: {os.environ.get('BUILD_TYPE', 'standard')}")
+        print(f"Preparing package: {args.package}")
+        if args.with_deps:
+            print("  including its dependencies")
+        if args.with_dependents:
+            print("  including its dependents")
         
-        success = preparer.prepare_package_dir(package_dir)
+        success = preparer.prepare_all_packages(
+            [args.package],
+            with_deps=args.with_deps,
+            with_dependents=args.with_dependents
+        )
     else:
         # Prepare all packages
         success = preparer.prepare_all_packages()
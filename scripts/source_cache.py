@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Persistent local cache for upstream package sources.
+
+The cache stores:
+1. Downloaded ZIP archives, content-addressed by their sha256, plus a
+   small record per URL with the sha256 and HTTP validators (ETag /
+   Last-Modified) of the last download
+2. Bare git mirrors, one per repository URL, which are updated
+   incrementally and cloned from locally
+
+Entries are evicted least-recently-used first once the total size of
+the cache exceeds its size cap. All writes go through a temporary file
+or directory followed by an atomic rename, so several prepare workers
+can share one cache. A worker holds a lock on an entry while it uses it
+(see SourceCache.lock), and eviction skips entries that are locked.
+
+Layout:
+    <cache_dir>/zips/objects/<sha256>.zip
+    <cache_dir>/zips/urls/<url key>.json
+    <cache_dir>/git/<url key>.git
+    <cache_dir>/locks/<entry name>.lock
+    <cache_dir>/tmp/
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import contextlib
+from typing import Dict, Any, Iterator, Optional, List
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory file locks (Windows): entries are used and evicted unlocked
+    fcntl = None
+
+
+DEFAULT_CACHE_MAX_SIZE = '5G'
+
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def default_cache_dir() -> str:
+    """Get the default cache directory ($MIP_CACHE_DIR or ~/.cache/mip-core/sources)."""
+    if os.environ.get('MIP_CACHE_DIR'):
+        return os.environ['MIP_CACHE_DIR']
+    xdg_cache = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(xdg_cache, 'mip-core', 'sources')
+
+
+def parse_size(size: str) -> int:
+    """
+    Parse a human-readable size such as '500M' or '5G' into bytes.
+
+    Args:
+        size: Size string with an optional K/M/G/T suffix
+
+    Returns:
+        Size in bytes
+    """
+    size = str(size).strip().upper().rstrip('B')
+    unit = size[-1:] if size[-1:] in _SIZE_UNITS else ''
+    number = size[:-1] if unit else size
+    try:
+        return int(float(number) * _SIZE_UNITS[unit])
+    except ValueError:
+        raise ValueError(f"Invalid size: {size!r}")
+
+
+def _entry_size(path: str) -> int:
+    """Size of a file, or total size of the files in a directory."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return total
+
+
+@contextlib.contextmanager
+def entry_lock(lock_dir: str, path: str, shared: bool = False,
+               blocking: bool = True) -> Iterator[bool]:
+    """
+    Hold an advisory lock on a cache entry.
+
+    The lock is taken with flock on <lock_dir>/<entry name>.lock, so it is
+    released when the holder exits, even if it crashes.
+
+    Args:
+        lock_dir: Directory of the lock files
+        path: The cache entry
+        shared: Take a shared lock (readers) instead of an exclusive one
+        blocking: Wait for the lock; otherwise give up if it is held
+
+    Yields:
+        Whether the lock was acquired (always True when blocking)
+    """
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(lock_dir, exist_ok=True)
+    lock_path = os.path.join(lock_dir, f"{os.path.basename(path)}.lock")
+    with open(lock_path, 'a') as f:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(f, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def evict_lru(parents: List[str], max_bytes: int, keep: Optional[str] = None,
+              label: str = 'cache entry', lock_dir: Optional[str] = None):
+    """
+    Remove least-recently-used entries until their total size fits max_bytes.
+
+    Every file or directory directly inside one of parents is an entry;
+    its modification time is its last use (see SourceCache.touch).
+
+    Args:
+        parents: Directories containing the entries
+        max_bytes: Size cap
+        keep: Entry that must not be evicted (the one just used)
+        label: Description of an entry, for log messages
+        lock_dir: Directory of the entry locks (see entry_lock); entries
+            locked by another user are not evicted
+    """
+    entries = []
+    for parent in parents:
+        for name in os.listdir(parent):
+            path = os.path.join(parent, name)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            entries.append((mtime, _entry_size(path), path))
+    total = sum(size for _, size, _ in entries)
+
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        with contextlib.ExitStack() as stack:
+            if lock_dir is not None and not stack.enter_context(
+                    entry_lock(lock_dir, path, blocking=False)):
+                print(f"  Not evicting {label} {os.path.basename(path)}: in use")
+                continue
+            print(f"  Evicting {label} {os.path.basename(path)} ({size} bytes)")
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        total -= size
+
+
+class SourceCache:
+    """Content-addressed cache of ZIP archives and bare git mirrors."""
+
+    def __init__(self, cache_dir: str, max_bytes: int = parse_size(DEFAULT_CACHE_MAX_SIZE)):
+        """
+        Initialize the source cache.
+
+        Args:
+            cache_dir: Root directory of the cache
+            max_bytes: Total size above which least-recently-used entries are evicted
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.zip_objects_dir = os.path.join(self.cache_dir, 'zips', 'objects')
+        self.zip_urls_dir = os.path.join(self.cache_dir, 'zips', 'urls')
+        self.git_dir = os.path.join(self.cache_dir, 'git')
+        self.tmp_dir = os.path.join(self.cache_dir, 'tmp')
+        self.lock_dir = os.path.join(self.cache_dir, 'locks')
+
+        for d in [self.zip_objects_dir, self.zip_urls_dir, self.git_dir, self.tmp_dir,
+                  self.lock_dir]:
+            os.makedirs(d, exist_ok=True)
+
+    @staticmethod
+    def _url_key(url: str) -> str:
+        """Stable filesystem-safe key for a URL."""
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+
+    @staticmethod
+    def touch(path: str):
+        """Mark a cache entry as recently used."""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def lock(self, path: str, shared: bool = False):
+        """
+        Lock a cache entry while using it, so that it is not evicted.
+
+        Git mirrors are locked exclusively, since updating one writes to it;
+        archives are locked shared while they are extracted.
+
+        Args:
+            path: The cache entry (it does not need to exist yet)
+            shared: Take a shared lock instead of an exclusive one
+        """
+        return entry_lock(self.lock_dir, path, shared=shared)
+
+    def temp_path(self, suffix: str = '') -> str:
+        """Create a unique temporary file inside the cache (same filesystem as entries)."""
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.tmp_dir)
+        os.close(fd)
+        return path
+
+    # ZIP archives
+
+    def zip_path(self, sha256: str) -> str:
+        """Path of the cached archive with a content hash (may not exist)."""
+        return os.path.join(self.zip_objects_dir, f"{sha256.lower()}.zip")
+
+    def get_zip(self, sha256: str) -> Optional[str]:
+        """
+        Look up a cached archive by content hash.
+
+        Returns:
+            Path to the cached archive, or None if not cached
+        """
+        path = self.zip_path(sha256)
+        if not os.path.isfile(path):
+            return None
+        self.touch(path)
+        return path
+
+    def lookup_zip_url(self, url: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the record of the last download of a URL.
+
+        Returns:
+            Dict with sha256, size, etag and last_modified, or None if the
+            URL has not been downloaded or its archive has been evicted
+        """
+        record_path = os.path.join(self.zip_urls_dir, f"{self._url_key(url)}.json")
+        try:
+            with open(record_path, 'r') as f:
+                record = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if record.get('url') != url or not record.get('sha256'):
+            return None
+        if not os.path.isfile(os.path.join(self.zip_objects_dir, f"{record['sha256']}.zip")):
+            return None
+        return record
+
+    def store_zip(self, url: str, temp_path: str, info: Dict[str, Any]) -> str:
+        """
+        Move a freshly downloaded archive into the cache.
+
+        Args:
+            url: The URL the archive was downloaded from
+            temp_path: Downloaded file (from temp_path()); moved, not copied
+            info: Download info with at least sha256
+
+        Returns:
+            Path to the cached archive
+        """
+        object_path = os.path.join(self.zip_objects_dir, f"{info['sha256']}.zip")
+        os.replace(temp_path, object_path)
+
+        record = {
+            'url': url,
+            'sha256': info['sha256'],
+            'size': info.get('size'),
+            'etag': info.get('etag'),
+            'last_modified': info.get('last_modified'),
+        }
+        record_path = os.path.join(self.zip_urls_dir, f"{self._url_key(url)}.json")
+        record_tmp = self.temp_path(suffix='.json')
+        with open(record_tmp, 'w') as f:
+            json.dump(record, f, indent=2)
+        os.replace(record_tmp, record_path)
+
+        self.evict(keep=object_path)
+        return object_path
+
+    # Git mirrors
+
+    def mirror_path(self, url: str) -> str:
+        """Path of the bare mirror for a repository URL (may not exist yet)."""
+        return os.path.join(self.git_dir, f"{self._url_key(url)}.git")
+
+    def temp_dir(self) -> str:
+        """Create a unique temporary directory inside the cache."""
+        return tempfile.mkdtemp(dir=self.tmp_dir)
+
+    def add_mirror(self, url: str, temp_mirror: str) -> str:
+        """
+        Move a freshly created mirror into place.
+
+        If another worker created the same mirror first, the new copy is
+        discarded and the existing one is used.
+
+        Returns:
+            Path to the cached mirror
+        """
+        mirror = self.mirror_path(url)
+        try:
+            os.rename(temp_mirror, mirror)
+        except OSError:
+            if not os.path.isdir(mirror):
+                raise
+            shutil.rmtree(temp_mirror, ignore_errors=True)
+        self.evict(keep=mirror)
+        return mirror
+
+    # Eviction
+
+    def evict(self, keep: Optional[str] = None):
+        """
+        Remove least-recently-used entries until the cache fits its size cap.
+
+        Args:
+            keep: Entry that must not be evicted (the one just used)
+        """
+        evict_lru([self.zip_objects_dir, self.git_dir], self.max_bytes, keep, 'cached source',
+                  lock_dir=self.lock_dir)
@@ -4,7 +4,26 @@ Upload bundled MATLAB packages (.mhl files) to Cloudflare R2 bucket.
 
 This script:
 1. Discovers all .mhl and .mip.json files in the input directory
-2. Uploads them to Cloudflare R2
+2. Uploads them to Cloudflare R2, several packages at a time, with large
+   files split into parts that are uploaded concurrently
+
+Every object is stored with the sha256 of its content as metadata. Files
+whose sha256 matches the object already in the bucket are not uploaded
+again.
+
+Transient errors are retried with exponential backoff and jitter, within
+a retry budget shared by the whole run. The upload IDs of multipart
+uploads in progress are recorded in <input_dir>/.multipart-uploads/, one
+file per key, so that an interrupted upload of a large file resumes from
+the parts that were already uploaded.
+
+With --content-addressed, archives are published under keys derived from
+their sha256 (core/blobs/<sha256>/<filename>) with a long-lived immutable
+Cache-Control. Only the .mip.json at its fixed key, which points to them,
+is mutable and gets a short max-age.
+
+Each published .mip.json is recorded, with its ETag, in the index journal
+(see index_journal.py) that assemble_index.py reads.
 
 This script processes .mhl files created by bundle_packages.py
 Index assembly is handled separately by assemble_index.py
@@ -12,30 +31,103 @@ Index assembly is handled separately by assemble_index.py
 
 import os
 import sys
+import json
+import time
+import random
 import argparse
+import tempfile
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import boto3
-    from botocore.exceptions import ClientError
+    from botocore.config import Config
+    from botocore.exceptions import ClientError, HTTPClientError
+    from botocore.exceptions import ConnectionError as BotoConnectionError
 except ImportError:
     print("Error: boto3 is required. Install with: pip install boto3")
     sys.exit(1)
 
+from build_utils import file_sha256, format_size
+from index_journal import IndexJournal
+from package_graph import completed_future
+from source_cache import parse_size
+
+DEFAULT_MULTIPART_CHUNK_SIZE = '16M'
+DEFAULT_TRANSFER_CONCURRENCY = 8
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_BUDGET = 50
+
+# Backoff before retry n (0-based) is uniform in [0, min(cap, base * 2**n)] seconds
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_CAP = 20.0
+
+# Error codes worth retrying besides 5xx and 429 responses
+RETRYABLE_ERROR_CODES = {
+    'RequestTimeout', 'RequestTimeoutException', 'SlowDown',
+    'Throttling', 'ThrottlingException', 'InternalError', 'ServiceUnavailable',
+}
+
+MULTIPART_STATE_DIRNAME = '.multipart-uploads'
+
+# Error codes of a conditional write that lost to another writer
+PRECONDITION_ERROR_CODES = {'PreconditionFailed', 'ConditionalRequestConflict'}
+
+# Cache-Control of content-addressed archives and of the .mip.json pointing to them
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+POINTER_CACHE_CONTROL = 'public, max-age=300'
+
+
+def _is_retryable(error):
+    """Whether an error from an S3 request is likely transient."""
+    if isinstance(error, (BotoConnectionError, HTTPClientError)):
+        return True
+    if isinstance(error, ClientError):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        code = error.response.get('Error', {}).get('Code')
+        return status >= 500 or status == 429 or code in RETRYABLE_ERROR_CODES
+    return False
+
+
 class PackageUploader:
     """Handles uploading bundled MATLAB packages to R2."""
     
-    def __init__(self, dry_run=False, input_dir=None):
+    def __init__(self, dry_run=False, input_dir=None, jobs=1,
+                 multipart_chunk_size=DEFAULT_MULTIPART_CHUNK_SIZE,
+                 transfer_concurrency=DEFAULT_TRANSFER_CONCURRENCY, force=False,
+                 max_retries=DEFAULT_MAX_RETRIES, retry_budget=DEFAULT_RETRY_BUDGET,
+                 content_addressed=False):
         """
         Initialize the package uploader.
         
         Args:
             dry_run: If True, simulate operations without actual uploading
             input_dir: Directory containing .mhl files (default: build/bundled)
+            jobs: Number of packages uploaded concurrently
+            multipart_chunk_size: Part size of multipart uploads (e.g. '16M');
+                files larger than one part are uploaded in parts
+            transfer_concurrency: Number of parts of one file uploaded concurrently
+            force: If True, upload files even if the bucket already has them
+            max_retries: Maximum number of retries of a single request
+            retry_budget: Maximum number of retries over the whole run
+            content_addressed: If True, publish archives under immutable
+                keys derived from their sha256
         """
         self.dry_run = dry_run
+        self.force = force
+        self.jobs = max(1, jobs)
+        self.multipart_chunk_size = parse_size(multipart_chunk_size)
+        self.transfer_concurrency = max(1, transfer_concurrency)
+        self.max_retries = max(0, max_retries)
+        self.retry_budget = max(0, retry_budget)
+        self.retries = 0
+        self.content_addressed = content_addressed
         self.base_url = "https://mip-packages.neurosift.app/core/packages"
         self.bucket_name = "mip-packages"
         self.bucket_prefix = "core/packages"
+        self.public_url = "https://mip-packages.neurosift.app"
+        self.blob_prefix = "core/blobs"
         
         # Set input directory
         if input_dir:
@@ -44,6 +136,17 @@ class PackageUploader:
             project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
             self.input_dir = os.path.join(project_root, 'build', 'bundled')
         
+        # Totals over all upload threads
+        self._stats_lock = threading.Lock()
+        self.stats = {'uploaded_files': 0, 'uploaded_bytes': 0,
+                      'skipped_files': 0, 'skipped_bytes': 0}
+        
+        # Upload IDs of multipart uploads in progress, by key
+        self.multipart_state_dir = os.path.join(self.input_dir, MULTIPART_STATE_DIRNAME)
+        
+        # Upload threads of this process update the index journal one at a time
+        self._journal_lock = threading.Lock()
+        
         # Initialize R2 client
         if not dry_run:
             self._init_r2_client()
@@ -60,37 +163,356 @@ class PackageUploader:
                 "AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_ENDPOINT_URL"
             )
         
+        # One client is shared by all upload threads; every package being
+        # uploaded may have transfer_concurrency requests in flight.
+        # Retries are done by _with_retries, under the retry budget.
         self.s3_client = boto3.client(
             's3',
             aws_access_key_id=access_key,
             aws_secret_access_key=secret_key,
             endpoint_url=endpoint_url,
-            region_name='auto'  # R2 uses 'auto' for region
+            region_name='auto',  # R2 uses 'auto' for region
+            config=Config(
+                max_pool_connections=self.jobs * self.transfer_concurrency + 2,
+                retries={'total_max_attempts': 1}
+            )
         )
+        self.journal = IndexJournal(self.s3_client, self.bucket_name)
+    
+    def _take_retry(self):
+        """Use up one retry of the budget; False if it is exhausted."""
+        with self._stats_lock:
+            if self.retries >= self.retry_budget:
+                return False
+            self.retries += 1
+            return True
     
-    def _upload_to_r2(self, local_path, remote_key):
+    def _with_retries(self, fn, *args, **kwargs):
         """
-        Upload a file to Cloudflare R2.
+        Call fn, retrying transient errors with exponential backoff and jitter.
+        
+        Args:
+            fn: Function making one S3 request; called again for each retry
+        
+        Returns:
+            The result of fn
+        """
+        attempt = 0
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not _is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                if not self._take_retry():
+                    raise Exception(f"Retry budget of {self.retry_budget} exhausted: {e}") from e
+                time.sleep(random.uniform(0, min(RETRY_BACKOFF_CAP, RETRY_BACKOFF_BASE * 2 ** attempt)))
+                attempt += 1
+    
+    def _count(self, kind, num_bytes):
+        """Add an uploaded or skipped file to the totals."""
+        with self._stats_lock:
+            self.stats[f'{kind}_files'] += 1
+            self.stats[f'{kind}_bytes'] += num_bytes
+    
+    def _remote_object(self, remote_key):
+        """
+        Get the HEAD response of an object in the bucket.
         
         Args:
-            local_path: Local file path
             remote_key: S3 key (path in bucket)
+        
+        Returns:
+            The response, or None if the object does not exist
         """
         try:
-            self.s3_client.upload_file(
-                local_path,
-                self.bucket_name,
-                remote_key,
-                ExtraArgs={'ContentType': self._get_content_type(local_path)}
+            return self._with_retries(
+                self.s3_client.head_object, Bucket=self.bucket_name, Key=remote_key
             )
-            print(f"  Uploaded to s3://{self.bucket_name}/{remote_key}")
         except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+    
+    def _remote_sha256(self, remote_key):
+        """
+        Get the sha256 recorded for an object in the bucket.
+        
+        Args:
+            remote_key: S3 key (path in bucket)
+        
+        Returns:
+            The sha256 metadata of the object, or None if the object does
+            not exist or has none
+        """
+        response = self._remote_object(remote_key)
+        if response is None:
+            return None
+        return response.get('Metadata', {}).get('sha256')
+    
+    def _upload_to_r2(self, local_path, remote_key, sha256=None, cache_control=None,
+                      if_absent=False):
+        """
+        Upload a file to Cloudflare R2, unless the bucket already has it.
+        
+        Args:
+            local_path: Local file path
+            remote_key: S3 key (path in bucket)
+            sha256: sha256 of the file, if already known
+            cache_control: Optional Cache-Control of the object
+            if_absent: Only create the object if there is none under the
+                key (If-None-Match: *)
+        
+        Returns:
+            Log line describing the upload, or None if if_absent is set
+            and another object was published under the key first
+        """
+        size = os.path.getsize(local_path)
+        try:
+            sha256 = sha256 or file_sha256(local_path)
+            if not self.force and self._remote_sha256(remote_key) == sha256:
+                self._count('skipped', size)
+                return f"  Unchanged, skipped s3://{self.bucket_name}/{remote_key} ({format_size(size)})"
+            extra_args = {
+                'ContentType': self._get_content_type(local_path),
+                'Metadata': {'sha256': sha256}
+            }
+            if cache_control:
+                extra_args['CacheControl'] = cache_control
+            condition = {'IfNoneMatch': '*'} if if_absent else {}
+            if size > self.multipart_chunk_size:
+                resumed = self._multipart_upload(
+                    local_path, remote_key, sha256, extra_args, condition
+                )
+            else:
+                self._with_retries(
+                    self._put_object, local_path, remote_key, {**extra_args, **condition}
+                )
+                resumed = 0
+            self._count('uploaded', size)
+            line = f"  Uploaded to s3://{self.bucket_name}/{remote_key} ({format_size(size)})"
+            if resumed:
+                line += f", resumed after {resumed} part(s) uploaded earlier"
+            return line
+        except ClientError as e:
+            if if_absent and e.response.get('Error', {}).get('Code') in PRECONDITION_ERROR_CODES:
+                return None
             raise Exception(f"Failed to upload to R2: {e}")
     
+    def _publish_base(self, entry, local_path, remote_key, cache_control=None):
+        """
+        Upload a base layer, unless a base is already published under its key.
+        
+        Bases are named by a hash of the files they hold, so a published
+        base can stand in for the local one even if its bytes differ (e.g.
+        deflated by another zlib version). It is never replaced, not even
+        with --force, because the .mip.json files of other builds record
+        its sha256. The upload only creates the object if the key is free,
+        and entry gets the sha256 and size of the base that is published.
+        
+        Args:
+            entry: The base's layer entry in the .mip.json to upload
+            local_path: Local path of the base
+            remote_key: S3 key of the base
+            cache_control: Optional Cache-Control of the object
+        
+        Returns:
+            Log line
+        """
+        # A lost race leaves another writer's base under the key; read it again
+        for attempt in range(3):
+            published = self._remote_object(remote_key)
+            if published is not None:
+                sha256 = published.get('Metadata', {}).get('sha256')
+                if not sha256:
+                    raise Exception(f"Base at {remote_key} has no sha256 metadata")
+                entry['sha256'] = sha256
+                entry['size'] = published['ContentLength']
+                self._count('skipped', os.path.getsize(local_path))
+                return f"  Base already published, reusing s3://{self.bucket_name}/{remote_key}"
+            line = self._upload_to_r2(
+                local_path, remote_key, entry['sha256'], cache_control, if_absent=True
+            )
+            if line:
+                return line
+        raise Exception(f"Could not publish the base at {remote_key}")
+    
+    def _record_in_journal(self, mip_json_key):
+        """
+        Record an uploaded .mip.json in the index journal.
+        
+        Args:
+            mip_json_key: S3 key of the .mip.json
+        
+        Returns:
+            Log line
+        """
+        etag = self._with_retries(
+            self.s3_client.head_object, Bucket=self.bucket_name, Key=mip_json_key
+        )['ETag']
+        with self._journal_lock:
+            recorded = self._with_retries(self.journal.record, mip_json_key, etag)
+        if recorded is None:
+            return f"  No index journal yet (assemble_index.py creates {self.journal.key})"
+        if recorded:
+            return "  Recorded in index journal"
+        return "  Index journal already up to date"
+    
+    def _put_object(self, local_path, remote_key, extra_args):
+        """Upload a file in a single request."""
+        with open(local_path, 'rb') as f:
+            self.s3_client.put_object(
+                Bucket=self.bucket_name, Key=remote_key, Body=f, **extra_args
+            )
+    
+    def _multipart_state_path(self, remote_key):
+        """Path of the file recording the multipart upload of a key."""
+        return os.path.join(self.multipart_state_dir, remote_key.replace('/', '__') + '.json')
+    
+    def _load_multipart_record(self, remote_key):
+        """Read the recorded multipart upload of a key: {upload_id, sha256, part_size}, or None."""
+        try:
+            with open(self._multipart_state_path(remote_key), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+    
+    def _record_multipart(self, remote_key, record):
+        """
+        Record (or with record=None, forget) the multipart upload of a key.
+        
+        Each key has its own state file, which is replaced atomically. No
+        file is shared by uploads of different keys, so uploaders in other
+        threads or processes (such as the build pipeline's upload workers)
+        never drop each other's records, and an interrupted run never
+        leaves a file half-written.
+        """
+        state_path = self._multipart_state_path(remote_key)
+        if record is None:
+            try:
+                os.remove(state_path)
+            except FileNotFoundError:
+                pass
+            return
+        os.makedirs(self.multipart_state_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.multipart_state_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(record, f, indent=2, sort_keys=True)
+        os.replace(temp_path, state_path)
+    
+    def _uploaded_parts(self, remote_key, upload_id):
+        """Get the parts of a multipart upload already in the bucket: number -> (size, etag)."""
+        parts = {}
+        paginator = self.s3_client.get_paginator('list_parts')
+        pages = paginator.paginate(Bucket=self.bucket_name, Key=remote_key, UploadId=upload_id)
+        for page in pages:
+            for part in page.get('Parts', []):
+                parts[part['PartNumber']] = (part['Size'], part['ETag'])
+        return parts
+    
+    def _multipart_upload(self, local_path, remote_key, sha256, extra_args, condition=None):
+        """
+        Upload a large file in parts, resuming a recorded upload of the same content.
+        
+        Args:
+            local_path: Local file path
+            remote_key: S3 key (path in bucket)
+            sha256: sha256 of the file
+            extra_args: ContentType and Metadata of the object
+            condition: Optional conditional-write arguments (IfNoneMatch)
+                of the request that completes the upload
+        
+        Returns:
+            Number of parts that were already uploaded by an earlier run
+        """
+        size = os.path.getsize(local_path)
+        part_size = self.multipart_chunk_size
+        part_count = (size + part_size - 1) // part_size
+        
+        def part_length(number):
+            return min(part_size, size - (number - 1) * part_size)
+        
+        # Resume the recorded upload if it was for the same content
+        upload_id, uploaded = None, {}
+        record = self._load_multipart_record(remote_key)
+        if record and record['sha256'] == sha256 and record['part_size'] == part_size:
+            try:
+                uploaded = self._with_retries(self._uploaded_parts, remote_key, record['upload_id'])
+                upload_id = record['upload_id']
+            except ClientError as e:
+                # The upload was completed, aborted or expired
+                if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                    raise
+        elif record:
+            # The file changed since; its parts are of no use
+            try:
+                self.s3_client.abort_multipart_upload(
+                    Bucket=self.bucket_name, Key=remote_key, UploadId=record['upload_id']
+                )
+            except ClientError:
+                pass
+        if upload_id is None:
+            response = self._with_retries(
+                self.s3_client.create_multipart_upload,
+                Bucket=self.bucket_name, Key=remote_key, **extra_args
+            )
+            upload_id = response['UploadId']
+            self._record_multipart(remote_key, {
+                'upload_id': upload_id, 'sha256': sha256, 'part_size': part_size
+            })
+        
+        etags = {
+            number: etag for number, (length, etag) in uploaded.items()
+            if number <= part_count and length == part_length(number)
+        }
+        resumed = len(etags)
+        
+        def upload_part(number):
+            with open(local_path, 'rb') as f:
+                f.seek((number - 1) * part_size)
+                data = f.read(part_length(number))
+            response = self._with_retries(
+                self.s3_client.upload_part,
+                Bucket=self.bucket_name, Key=remote_key, UploadId=upload_id,
+                PartNumber=number, Body=data
+            )
+            return response['ETag']
+        
+        missing = [n for n in range(1, part_count + 1) if n not in etags]
+        with ThreadPoolExecutor(max_workers=self.transfer_concurrency) as executor:
+            for number, etag in zip(missing, executor.map(upload_part, missing)):
+                etags[number] = etag
+        
+        try:
+            self._with_retries(
+                self.s3_client.complete_multipart_upload,
+                Bucket=self.bucket_name, Key=remote_key, UploadId=upload_id,
+                MultipartUpload={'Parts': [
+                    {'PartNumber': number, 'ETag': etags[number]} for number in sorted(etags)
+                ]},
+                **(condition or {})
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in PRECONDITION_ERROR_CODES:
+                raise
+            # Another object was published under the key; the parts are of no use
+            try:
+                self.s3_client.abort_multipart_upload(
+                    Bucket=self.bucket_name, Key=remote_key, UploadId=upload_id
+                )
+            except ClientError:
+                pass
+            self._record_multipart(remote_key, None)
+            raise
+        self._record_multipart(remote_key, None)
+        return resumed
+    
     def _get_content_type(self, file_path):
         """Get appropriate content type for file."""
-        if file_path.endswith('.mhl'):
+        if file_path.endswith('.mhl') or file_path.endswith('.zip'):
             return 'application/zip'
+        elif file_path.endswith('.zst'):
+            return 'application/zstd'
         elif file_path.endswith('.json'):
             return 'application/json'
         return 'application/octet-stream'
@@ -105,38 +527,168 @@ class PackageUploader:
         Returns:
             True if successful, False otherwise
         """
+        success, output = self._upload_package(mhl_path)
+        print(output, end='', flush=True)
+        return success
+    
+    def _upload_package(self, mhl_path):
+        """
+        Upload a single .mhl package and its .mip.json file.
+        
+        Output is collected instead of printed, so that packages uploaded
+        in parallel threads do not interleave their logs.
+        
+        Args:
+            mhl_path: Path to the .mhl file
+        
+        Returns:
+            Tuple of (success, log output)
+        """
         mhl_filename = os.path.basename(mhl_path)
+        lines = [f"\nUploading: {mhl_filename}"]
         
-        print(f"\nUploading: {mhl_filename}")
+        def result(success):
+            return success, '\n'.join(lines) + '\n'
         
         # Check for corresponding .mip.json file
         mip_json_path = f"{mhl_path}.mip.json"
         if not os.path.exists(mip_json_path):
-            print(f"  Error: {mhl_filename}.mip.json not found")
-            return False
+            lines.append(f"  Error: {mhl_filename}.mip.json not found")
+            return result(False)
+        
+        # Alternative encodings (e.g. .mhl.zst) and layers listed in the .mip.json
+        try:
+            with open(mip_json_path, 'r') as f:
+                metadata = json.load(f)
+        except (OSError, ValueError) as e:
+            lines.append(f"  Error reading {mhl_filename}.mip.json: {e}")
+            return result(False)
+        entries = metadata.get('variants', []) + metadata.get('layers', [])
+        variant_filenames = [entry['filename'] for entry in entries]
+        for filename in variant_filenames:
+            if not os.path.exists(os.path.join(os.path.dirname(mhl_path), filename)):
+                lines.append(f"  Error: {filename} not found")
+                return result(False)
         
         if self.dry_run:
-            print(f"  [DRY RUN] Would upload {mhl_filename}")
-            print(f"  [DRY RUN] Would upload {mhl_filename}.mip.json")
-            return True
+            if not metadata.get('layers_only'):
+                lines.append(f"  [DRY RUN] Would upload {mhl_filename}")
+            for filename in variant_filenames:
+                lines.append(f"  [DRY RUN] Would upload {filename}")
+            lines.append(f"  [DRY RUN] Would upload {mhl_filename}.mip.json")
+            return result(True)
+        
+        if self.content_addressed:
+            try:
+                lines.extend(self._upload_content_addressed(mhl_path, metadata))
+                lines.append(self._record_in_journal(f"{self.bucket_prefix}/{mhl_filename}.mip.json"))
+                lines.append(f"  Successfully uploaded {mhl_filename}")
+                return result(True)
+            except Exception as e:
+                lines.append(f"  Error uploading package: {e}")
+                lines.append(traceback.format_exc().rstrip('\n'))
+                return result(False)
         
         try:
-            # Upload .mhl file
-            mhl_key = f"{self.bucket_prefix}/{mhl_filename}"
-            self._upload_to_r2(mhl_path, mhl_key)
+            # Upload .mhl file (layers-only builds publish just their layers)
+            if not metadata.get('layers_only'):
+                mhl_key = f"{self.bucket_prefix}/{mhl_filename}"
+                lines.append(self._upload_to_r2(mhl_path, mhl_key))
+            
+            # Upload variant and layer files
+            published = json.loads(json.dumps(metadata))
+            for entry in published.get('variants', []) + published.get('layers', []):
+                path = os.path.join(os.path.dirname(mhl_path), entry['filename'])
+                key = f"{self.bucket_prefix}/{entry['filename']}"
+                if entry.get('role') == 'base':
+                    lines.append(self._publish_base(entry, path, key))
+                else:
+                    lines.append(self._upload_to_r2(path, key))
             
-            # Upload .mip.json file
+            # Upload .mip.json file (last, so that it never refers to
+            # files that are not uploaded yet), pointing to the base
+            # that is actually published
             mip_json_key = f"{self.bucket_prefix}/{mhl_filename}.mip.json"
-            self._upload_to_r2(mip_json_path, mip_json_key)
+            if published != metadata:
+                lines.append(self._upload_metadata(published, os.path.dirname(mhl_path), mip_json_key))
+            else:
+                lines.append(self._upload_to_r2(mip_json_path, mip_json_key))
+            lines.append(self._record_in_journal(mip_json_key))
             
-            print(f"  Successfully uploaded {mhl_filename}")
-            return True
+            lines.append(f"  Successfully uploaded {mhl_filename}")
+            return result(True)
             
         except Exception as e:
-            print(f"  Error uploading package: {e}")
-            import traceback
-            traceback.print_exc()
-            return False
+            lines.append(f"  Error uploading package: {e}")
+            lines.append(traceback.format_exc().rstrip('\n'))
+            return result(False)
+    
+    def _upload_content_addressed(self, mhl_path, metadata):
+        """
+        Upload a package's archives under content-hash keys, then its .mip.json.
+        
+        The uploaded .mip.json records the key (mhl_key, and key of each
+        variant and layer) and URL of every archive.
+        
+        Args:
+            mhl_path: Path to the .mhl file
+            metadata: The package's standalone .mip.json
+        
+        Returns:
+            Log lines
+        """
+        lines = []
+        bundled_dir = os.path.dirname(mhl_path)
+        mhl_filename = os.path.basename(mhl_path)
+        pointer = json.loads(json.dumps(metadata))
+        
+        def upload_blob(path):
+            sha256 = file_sha256(path)
+            key = f"{self.blob_prefix}/{sha256}/{os.path.basename(path)}"
+            lines.append(self._upload_to_r2(path, key, sha256, IMMUTABLE_CACHE_CONTROL))
+            return key
+        
+        if not pointer.get('layers_only'):
+            pointer['mhl_key'] = upload_blob(mhl_path)
+            pointer['mhl_url'] = f"{self.public_url}/{pointer['mhl_key']}"
+        for entry in pointer.get('variants', []) + pointer.get('layers', []):
+            path = os.path.join(bundled_dir, entry['filename'])
+            if entry.get('role') == 'base':
+                # Named by its files rather than its bytes; see _publish_base()
+                entry['key'] = f"{self.blob_prefix}/bases/{entry['filename']}"
+                lines.append(self._publish_base(entry, path, entry['key'], IMMUTABLE_CACHE_CONTROL))
+            else:
+                entry['key'] = upload_blob(path)
+            entry['url'] = f"{self.public_url}/{entry['key']}"
+        
+        # Upload the .mip.json last, so that it never refers to archives
+        # that are not uploaded yet
+        lines.append(self._upload_metadata(
+            pointer, bundled_dir, f"{self.bucket_prefix}/{mhl_filename}.mip.json",
+            POINTER_CACHE_CONTROL
+        ))
+        return lines
+    
+    def _upload_metadata(self, metadata, bundled_dir, remote_key, cache_control=None):
+        """
+        Upload a .mip.json that differs from the local file.
+        
+        Args:
+            metadata: Contents of the .mip.json
+            bundled_dir: Directory for the temporary file
+            remote_key: S3 key of the .mip.json
+            cache_control: Optional Cache-Control of the object
+        
+        Returns:
+            Log line
+        """
+        fd, temp_path = tempfile.mkstemp(dir=bundled_dir, suffix='.mip.json')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(metadata, f, indent=2)
+            return self._upload_to_r2(temp_path, remote_key, cache_control=cache_control)
+        finally:
+            os.remove(temp_path)
     
     def upload_all(self):
         """
@@ -164,16 +716,47 @@ class PackageUploader:
         print(f"Found {len(mhl_files)} .mhl package(s)")
         print(f"Input directory: {self.input_dir}")
         
-        # Upload each package
-        all_success = True
-        for mhl_path in sorted(mhl_files):
-            success = self.upload_package(mhl_path)
-            if not success:
-                print(f"\nError: Upload failed for {os.path.basename(mhl_path)}")
-                all_success = False
-                break  # Abort on first failure
+        # Upload the packages concurrently. Logs are printed in order, each
+        # as one block; a failure does not stop the other packages.
+        mhl_files = sorted(mhl_files)
+        failed = []
+        if self.jobs == 1:
+            futures = (completed_future(self._upload_package, p) for p in mhl_files)
+            executor = None
+        else:
+            print(f"Uploading with {self.jobs} parallel job(s)")
+            executor = ThreadPoolExecutor(max_workers=self.jobs)
+            futures = [executor.submit(self._upload_package, p) for p in mhl_files]
+        try:
+            for mhl_path, future in zip(mhl_files, futures):
+                try:
+                    success, output = future.result()
+                except Exception as e:
+                    success = False
+                    output = f"\nUploading: {os.path.basename(mhl_path)}\n  Upload failed: {e}\n"
+                print(output, end='', flush=True)
+                if not success:
+                    failed.append(os.path.basename(mhl_path))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        
+        if not self.dry_run:
+            stats = self.stats
+            print(
+                f"\nUploaded {stats['uploaded_files']} file(s) ({format_size(stats['uploaded_bytes'])}), "
+                f"skipped {stats['skipped_files']} unchanged file(s) ({format_size(stats['skipped_bytes'])})"
+            )
+            if self.retries:
+                print(f"Retried {self.retries} request(s) (budget: {self.retry_budget})")
         
-        return all_success
+        if failed:
+            print(f"\nError: Upload failed for {len(failed)} of {len(mhl_files)} package(s):")
+            for mhl_filename in failed:
+                print(f"  {mhl_filename}")
+            return False
+        
+        return True
 
 def main():
     """Main entry point."""
@@ -190,13 +773,60 @@ def main():
         type=str,
         help='Directory containing .mhl files (default: build/bundled)'
     )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=4,
+        help='Number of packages uploaded concurrently (default: 4)'
+    )
+    parser.add_argument(
+        '--multipart-chunk-size',
+        type=str,
+        default=DEFAULT_MULTIPART_CHUNK_SIZE,
+        help=f'Part size of multipart uploads (default: {DEFAULT_MULTIPART_CHUNK_SIZE})'
+    )
+    parser.add_argument(
+        '--transfer-concurrency',
+        type=int,
+        default=DEFAULT_TRANSFER_CONCURRENCY,
+        help=f'Parts of one file uploaded concurrently (default: {DEFAULT_TRANSFER_CONCURRENCY})'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Upload files even if the bucket already has the same content'
+    )
+    parser.add_argument(
+        '--max-retries',
+        type=int,
+        default=DEFAULT_MAX_RETRIES,
+        help=f'Maximum number of retries of a single request (default: {DEFAULT_MAX_RETRIES})'
+    )
+    parser.add_argument(
+        '--retry-budget',
+        type=int,
+        default=DEFAULT_RETRY_BUDGET,
+        help=f'Maximum number of retries over the whole run (default: {DEFAULT_RETRY_BUDGET})'
+    )
+    parser.add_argument(
+        '--content-addressed',
+        action='store_true',
+        help='Publish archives under immutable content-hash keys'
+    )
     
     args = parser.parse_args()
     
     # Create uploader
     uploader = PackageUploader(
         dry_run=args.dry_run,
-        input_dir=args.input_dir
+        input_dir=args.input_dir,
+        jobs=args.jobs,
+        multipart_chunk_size=args.multipart_chunk_size,
+        transfer_concurrency=args.transfer_concurrency,
+        force=args.force,
+        max_retries=args.max_retries,
+        retry_budget=args.retry_budget,
+        content_addressed=args.content_addressed
     )
     
     # Upload all packages
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'scripts'))
+
+from assemble_index import IndexAssembler
+
+
+def metadata(name, platform_tag, symbol_table=None, exposed_symbols=None):
+    build = f'{name}-1.0-any-none-{platform_tag}.mhl'
+    entry = {'name': name, 'mip_json_url': f'https://example.org/{build}.mip.json'}
+    if symbol_table is not None:
+        entry['symbol_table'] = symbol_table
+    if exposed_symbols is not None:
+        entry['exposed_symbols'] = exposed_symbols
+    return entry
+
+
+def test_symbol_index_maps_symbols_to_builds_and_reports_collisions():
+    solve = {'name': 'solve', 'kind': 'function', 'path': 'alpha/solve.m'}
+    packages = [
+        metadata('alpha', 'linux_x86_64', [
+            solve, {'name': 'Grid', 'kind': 'class', 'path': 'alpha/@Grid'},
+        ]),
+        metadata('alpha', 'macos_arm64', [solve]),
+        metadata('beta', 'any', [{'name': 'solve', 'kind': 'function', 'path': 'beta/solve.m'}]),
+        # Older builds only list the names
+        metadata('gamma', 'any', exposed_symbols=['util']),
+    ]
+
+    symbols, collisions = IndexAssembler(dry_run=True)._build_symbol_index(packages)
+
+    assert list(symbols) == ['Grid', 'solve', 'util']
+    assert symbols['Grid'] == [{
+        'package': 'alpha', 'build': 'alpha-1.0-any-none-linux_x86_64.mhl',
+        'kind': 'class', 'path': 'alpha/@Grid',
+    }]
+    assert [(p['package'], p['build']) for p in symbols['solve']] == [
+        ('alpha', 'alpha-1.0-any-none-linux_x86_64.mhl'),
+        ('alpha', 'alpha-1.0-any-none-macos_arm64.mhl'),
+        ('beta', 'beta-1.0-any-none-any.mhl'),
+    ]
+    assert symbols['util'] == [{
+        'package': 'gamma', 'build': 'gamma-1.0-any-none-any.mhl', 'kind': None, 'path': None,
+    }]
+    # Several builds of one package are not a collision
+    assert collisions == {'solve': ['alpha', 'beta']}
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+import sys
+import json
+import time
+import threading
+from pathlib import Path
+
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'scripts'))
+
+from build_pipeline import BuildPipeline
+from package_graph import PackageGraph, load_package_specs
+from prepare_packages import PackagePreparer
+
+
+def make_pipeline(tmp_path, compile_jobs=1, fail=(), slow=(), dependencies=None):
+    """A pipeline whose stages only record what they were given."""
+    pipeline = BuildPipeline(
+        force=True, compile_jobs=compile_jobs, queue_size=1, cache_dir=None
+    )
+    pipeline.uploaded = []
+    if dependencies is not None:
+        pipeline.graph = PackageGraph(dependencies)
+
+    def prepare(executor, name):
+        return [str(tmp_path / f"{name}.dir")]
+
+    def compile(dir_path):
+        if Path(dir_path).stem in slow:
+            time.sleep(0.5)
+        if Path(dir_path).stem in fail:
+            raise RuntimeError('compile script crashed')
+        return [dir_path]
+
+    def bundle(executor, dir_path):
+        return [dir_path[:-len('.dir')] + '.mhl']
+
+    def upload(executor, mhl_path):
+        pipeline.uploaded.append(Path(mhl_path).stem)
+        return [mhl_path]
+
+    pipeline._prepare, pipeline._compile = prepare, compile
+    pipeline._bundle, pipeline._upload = bundle, upload
+    return pipeline
+
+
+def run_with_timeout(pipeline, names, timeout=30):
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(ok=pipeline.run(names)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'pipeline did not finish'
+    return result['ok']
+
+
+def test_exception_in_a_stage_fails_only_that_item(tmp_path):
+    names = [f"pkg{i}" for i in range(6)]
+    for compile_jobs in [1, 2]:
+        pipeline = make_pipeline(tmp_path, compile_jobs=compile_jobs, fail={'pkg1'})
+
+        assert not run_with_timeout(pipeline, names)
+
+        assert pipeline.failures == [('compile', 'pkg1.dir')]
+        assert sorted(pipeline.uploaded) == [n for n in names if n != 'pkg1']
+
+
+def test_dependents_of_failed_packages_are_not_uploaded(tmp_path):
+    dependencies = {'base': [], 'app': ['base'], 'tool': ['app'], 'other': []}
+
+    # base is still compiling when app reaches the upload stage
+    pipeline = make_pipeline(
+        tmp_path, compile_jobs=2, fail={'base'}, slow={'base'}, dependencies=dependencies
+    )
+    assert not run_with_timeout(pipeline, ['base', 'app', 'tool', 'other'])
+    assert pipeline.uploaded == ['other']
+    assert ('compile', 'base.dir') in pipeline.failures
+    assert ('skipped', 'app.mhl') in pipeline.failures
+
+    # Without the failure, app is uploaded after base
+    pipeline = make_pipeline(
+        tmp_path, compile_jobs=2, slow={'base'}, dependencies=dependencies
+    )
+    assert run_with_timeout(pipeline, ['base', 'app', 'tool', 'other'])
+    assert pipeline.uploaded.index('base') < pipeline.uploaded.index('app') < pipeline.uploaded.index('tool')
+
+
+def test_failed_upload_is_retried_on_the_next_run(tmp_path, monkeypatch):
+    packages_dir = tmp_path / 'packages'
+    (packages_dir / 'pkg').mkdir(parents=True)
+    (packages_dir / 'pkg' / 'prepare.yaml').write_text(yaml.safe_dump({
+        'name': 'pkg', 'description': 'pkg package', 'version': '1.0', 'build_number': 1,
+        'builds': [{'build_type': 'standard', 'matlab_tag': 'any',
+                    'abi_tag': 'none', 'platform_tag': 'any'}],
+    }))
+    monkeypatch.setenv('BUILD_TYPE', 'standard')
+    # What the fake upload stage published, readable from the prepare workers
+    published_path = tmp_path / 'published.json'
+    published_path.write_text('{}')
+    monkeypatch.setattr(PackagePreparer, '_load_remote_index', lambda self: {})
+    monkeypatch.setattr(
+        PackagePreparer, '_published_metadata',
+        lambda self, filename: json.loads(published_path.read_text()).get(filename)
+    )
+    output_dir = tmp_path / 'build' / 'prepared'
+    record = tmp_path / 'build' / 'manifest' / 'pkg-1.0-any-none-any.json'
+
+    def run(upload_fails):
+        pipeline = BuildPipeline(compile=False, queue_size=1, cache_dir=None)
+        pipeline.specs = load_package_specs(str(packages_dir))
+        pipeline.graph = PackageGraph.from_specs(pipeline.specs)
+        pipeline.preparer = PackagePreparer(output_dir=str(output_dir), defer_manifest=True)
+        prepared = []
+        uploaded = []
+
+        def bundle(executor, dir_path):
+            prepared.append(Path(dir_path).name)
+            return [dir_path[:-len('.dir')] + '.mhl']
+
+        def upload(executor, mhl_path):
+            if upload_fails:
+                raise RuntimeError('connection reset')
+            mip_json = Path(mhl_path[:-len('.mhl')] + '.dir') / 'mip.json'
+            published_path.write_text(json.dumps({Path(mhl_path).name: json.loads(mip_json.read_text())}))
+            uploaded.append(Path(mhl_path).name)
+            return [mhl_path]
+
+        pipeline._bundle, pipeline._upload = bundle, upload
+        return run_with_timeout(pipeline, ['pkg']), prepared, uploaded
+
+    assert run(upload_fails=True) == (False, ['pkg-1.0-any-none-any.dir'], [])
+    assert not record.exists()
+
+    assert run(upload_fails=False) == (True, ['pkg-1.0-any-none-any.dir'], ['pkg-1.0-any-none-any.mhl'])
+    assert record.exists()
+
+    # Uploaded with unchanged inputs: skipped
+    assert run(upload_fails=False) == (True, [], [])
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import json
+import zipfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'scripts'))
+
+import bundle_packages
+from bundle_packages import PackageBundler
+
+
+def make_dir_package(root, timestamp):
+    dir_path = root / 'demo-1.0-any-none-any.dir'
+    (dir_path / 'demo' / 'private').mkdir(parents=True)
+    (dir_path / 'demo' / 'demo.m').write_text("function demo()\ndisp('demo')\nend\n" * 100)
+    (dir_path / 'demo' / 'private' / 'helper.m').write_text("function helper()\nend\n")
+    (dir_path / 'demo' / 'data.mat').write_bytes(os.urandom(4096))
+    (dir_path / 'mip.json').write_text(json.dumps({
+        'name': 'demo',
+        'timestamp': timestamp,
+        'prepare_duration': 1.25,
+        'compile_duration': 0,
+    }))
+    return dir_path
+
+
+def test_bundles_are_reproducible(tmp_path):
+    first = make_dir_package(tmp_path / 'first', '2024-01-01T00:00:00Z')
+    second = make_dir_package(tmp_path / 'second', '2024-06-01T12:00:00Z')
+    # Same contents, different on-disk metadata
+    (second / 'demo' / 'data.mat').write_bytes((first / 'demo' / 'data.mat').read_bytes())
+    os.utime(second / 'demo' / 'demo.m', (0, 0))
+    os.chmod(second / 'demo' / 'private' / 'helper.m', 0o600)
+
+    PackageBundler(output_dir=str(tmp_path / 'out1')).bundle_package(str(first))
+    PackageBundler(output_dir=str(tmp_path / 'out2'), compress_threads=3).bundle_package(str(second))
+
+    mhl1 = tmp_path / 'out1' / 'demo-1.0-any-none-any.mhl'
+    mhl2 = tmp_path / 'out2' / 'demo-1.0-any-none-any.mhl'
+    assert mhl1.read_bytes() == mhl2.read_bytes()
+
+    with zipfile.ZipFile(mhl1) as zipf:
+        assert zipf.namelist() == sorted(zipf.namelist())
+        assert zipf.getinfo('demo/data.mat').compress_type == zipfile.ZIP_STORED
+        assert 'timestamp' not in json.loads(zipf.read('mip.json'))
+
+    metadata = json.loads((tmp_path / 'out1' / 'demo-1.0-any-none-any.mhl.mip.json').read_text())
+    assert metadata['timestamp'] == '2024-01-01T00:00:00Z'
+    assert metadata['mhl_size'] == mhl1.stat().st_size
+    assert len(metadata['mhl_sha256']) == 64
+
+
+def test_delta_against_previous_build(tmp_path):
+    dir_path = make_dir_package(tmp_path / 'src', '2024-01-01T00:00:00Z')
+    previous_dir = tmp_path / 'previous'
+    PackageBundler(output_dir=str(previous_dir)).bundle_package(str(dir_path))
+
+    (dir_path / 'demo' / 'demo.m').write_text("function demo()\ndisp('changed')\nend\n")
+    (dir_path / 'demo' / 'private' / 'helper.m').unlink()
+    bundler = PackageBundler(output_dir=str(tmp_path / 'out'), delta=True, delta_base=str(previous_dir))
+    assert bundler.bundle_package(str(dir_path))
+
+    metadata = json.loads((tmp_path / 'out' / 'demo-1.0-any-none-any.mhl.mip.json').read_text())
+    [variant] = metadata['variants']
+    assert variant['encoding'] == 'delta'
+    with zipfile.ZipFile(tmp_path / 'out' / variant['filename']) as zipf:
+        assert zipf.namelist() == ['delta.json', 'demo/demo.m', 'mip.json']
+        delta = json.loads(zipf.read('delta.json'))
+    assert delta['deleted'] == ['demo/private/helper.m']
+    assert [entry['path'] for entry in delta['files']] == ['demo/demo.m']
+
+
+def test_bundle_leaves_out_files_not_needed_at_runtime(tmp_path):
+    dir_path = make_dir_package(tmp_path / 'src', '2024-01-01T00:00:00Z')
+    metadata = json.loads((dir_path / 'mip.json').read_text())
+    metadata['paths'] = ['demo', 'demo/tests/helpers']
+    (dir_path / 'mip.json').write_text(json.dumps(metadata))
+    for rel_path in ['demo/tests/test_demo.m', 'demo/tests/helpers/assert_close.m',
+                     'demo/docs/guide.html', 'demo/.github/workflows/ci.yml',
+                     'demo/@thing/thing.m', 'load_package.m']:
+        (dir_path / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (dir_path / rel_path).write_text('% file\n')
+
+    assert PackageBundler(output_dir=str(tmp_path / 'out')).bundle_package(str(dir_path))
+
+    with zipfile.ZipFile(tmp_path / 'out' / 'demo-1.0-any-none-any.mhl') as zipf:
+        names = zipf.namelist()
+    assert 'demo/tests/test_demo.m' not in names
+    assert 'demo/docs/guide.html' not in names
+    assert 'demo/.github/workflows/ci.yml' not in names
+    # On the MATLAB path, so shipped despite the default excludes
+    assert 'demo/tests/helpers/assert_close.m' in names
+    assert 'demo/@thing/thing.m' in names
+    assert 'load_package.m' in names
+
+
+def test_layered_builds_share_one_base(tmp_path):
+    bases = set()
+    # The builders deflate differently, but the base is named by its files
+    for platform, mex, level in [('linux_x86_64', 'kd.mexa64', 6), ('macos_arm64', 'kd.mexmaca64', 9)]:
+        dir_path = make_dir_package(tmp_path / platform, '2024-01-01T00:00:00Z')
+        dir_path = dir_path.rename(dir_path.with_name(f'demo-1.0-any-none-{platform}.dir'))
+        metadata = json.loads((dir_path / 'mip.json').read_text())
+        metadata['platform_tag'] = platform
+        (dir_path / 'mip.json').write_text(json.dumps(metadata))
+        (dir_path / 'demo' / 'data.mat').write_bytes(b'same on every platform')
+        (dir_path / 'demo' / mex).write_bytes(platform.encode())
+
+        out_dir = tmp_path / 'out'
+        assert PackageBundler(output_dir=str(out_dir), layered=True, compression_level=level).bundle_package(str(dir_path))
+
+        metadata = json.loads((out_dir / f'{dir_path.name[:-4]}.mhl.mip.json').read_text())
+        base, overlay = metadata['layers']
+        bases.add(base['filename'])
+        with zipfile.ZipFile(out_dir / overlay['filename']) as zipf:
+            assert zipf.namelist() == [f'demo/{mex}', 'mip.json']
+
+    assert len(bases) == 1
+
+
+def make_input_dir(root):
+    """Three packages, of which 'broken' has no mip.json."""
+    for name in ['alpha', 'beta', 'broken']:
+        dir_path = make_dir_package(root / name, '2024-01-01T00:00:00Z')
+        if name == 'broken':
+            (dir_path / 'mip.json').unlink()
+        dir_path.rename(root / f'{name}-1.0-any-none-any.dir')
+        (root / name).rmdir()
+    return root
+
+
+def test_parallel_bundling_matches_serial_and_reports_all_failures(tmp_path, capsys):
+    input_dir = make_input_dir(tmp_path / 'prepared')
+
+    serial = PackageBundler(input_dir=str(input_dir), output_dir=str(tmp_path / 'serial'))
+    assert not serial.bundle_all()
+    serial_output = capsys.readouterr().out
+    parallel = PackageBundler(input_dir=str(input_dir), output_dir=str(tmp_path / 'parallel'), jobs=2)
+    assert not parallel.bundle_all()
+    output = capsys.readouterr().out
+
+    # Serial bundling stops at the first failure, parallel bundling does not
+    assert 'Bundle failed for broken-1.0-any-none-any.dir' in serial_output
+    assert 'Bundle failed for 1 package(s):\n  broken-1.0-any-none-any.dir' in output
+    for name in ['alpha', 'beta']:
+        mhl = f'{name}-1.0-any-none-any.mhl'
+        assert (tmp_path / 'parallel' / mhl).read_bytes() == (tmp_path / 'serial' / mhl).read_bytes()
+    # Logs are printed in order, one block per package
+    alpha_log = output.index('alpha-1.0-any-none-any.dir')
+    beta_log = output.index('beta-1.0-any-none-any.dir')
+    assert alpha_log < beta_log < output.index('broken-1.0-any-none-any.dir')
+
+
+def bundled_members(output_dir):
+    with zipfile.ZipFile(output_dir / 'demo-1.0-any-none-any.mhl') as zipf:
+        return {info.filename: info for info in zipf.infolist()}
+
+
+def test_compression_policy(tmp_path):
+    dir_path = make_dir_package(tmp_path / 'src', '2024-01-01T00:00:00Z')
+
+    PackageBundler(output_dir=str(tmp_path / 'default')).bundle_package(str(dir_path))
+    members = bundled_members(tmp_path / 'default')
+    assert members['demo/data.mat'].compress_type == zipfile.ZIP_STORED
+    assert members['demo/demo.m'].compress_type == zipfile.ZIP_DEFLATED
+    assert members['demo/demo.m'].compress_size < members['demo/demo.m'].file_size
+
+    PackageBundler(output_dir=str(tmp_path / 'custom'), stored_extensions=['.M']).bundle_package(str(dir_path))
+    members = bundled_members(tmp_path / 'custom')
+    assert members['demo/demo.m'].compress_type == zipfile.ZIP_STORED
+    assert members['demo/data.mat'].compress_type == zipfile.ZIP_DEFLATED
+
+    PackageBundler(output_dir=str(tmp_path / 'level0'), compression_level=0).bundle_package(str(dir_path))
+    members = bundled_members(tmp_path / 'level0')
+    assert {m.compress_type for m in members.values()} == {zipfile.ZIP_STORED}
+
+    default_mhl = tmp_path / 'default' / 'demo-1.0-any-none-any.mhl'
+    PackageBundler(output_dir=str(tmp_path / 'level1'), compression_level=1).bundle_package(str(dir_path))
+    assert (tmp_path / 'level1' / 'demo-1.0-any-none-any.mhl').read_bytes() != default_mhl.read_bytes()
+
+
+def test_zstd_variant_decompresses_to_a_stored_mhl(tmp_path):
+    zstandard = pytest.importorskip('zstandard')
+    dir_path = make_dir_package(tmp_path / 'src', '2024-01-01T00:00:00Z')
+    output_dir = tmp_path / 'out'
+
+    PackageBundler(output_dir=str(output_dir), zstd_level=3).bundle_package(str(dir_path))
+
+    zst_path = output_dir / 'demo-1.0-any-none-any.mhl.zst'
+    metadata = json.loads((output_dir / 'demo-1.0-any-none-any.mhl.mip.json').read_text())
+    variant, = [v for v in metadata['variants'] if v['encoding'] == 'zstd']
+    assert variant['filename'] == zst_path.name
+    assert variant['size'] == zst_path.stat().st_size
+    with zstandard.ZstdDecompressor().stream_reader(zst_path.open('rb')) as reader:
+        archive = io.BytesIO(reader.read())
+    with zipfile.ZipFile(archive) as zipf:
+        assert {info.compress_type for info in zipf.infolist()} == {zipfile.ZIP_STORED}
+        mhl = bundled_members(output_dir)
+        assert sorted(zipf.namelist()) == sorted(mhl)
+        assert zipf.read('demo/demo.m') == (dir_path / 'demo' / 'demo.m').read_bytes()
+
+
+def test_package_bundle_rules(tmp_path):
+    dir_path = make_dir_package(tmp_path / 'src', '2024-01-01T00:00:00Z')
+    metadata = json.loads((dir_path / 'mip.json').read_text())
+    metadata['paths'] = ['demo']
+    (dir_path / 'mip.json').write_text(json.dumps(metadata))
+    for rel_path in ['demo/tests/test_demo.m', 'extra/docs/guide.txt', 'extra/notes.txt',
+                     'extra/data/big.bin', 'extra/data/small.csv']:
+        (dir_path / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (dir_path / rel_path).write_text('% file\n')
+
+    def shipped(rules):
+        bundler = PackageBundler(output_dir=str(tmp_path / 'out'))
+        bundler._specs = {'demo': {'yaml': {'bundle': rules}}}
+        selected, _ = bundler._select_files(str(dir_path), metadata)
+        return [arcname for arcname, _ in selected if arcname.startswith('extra/')]
+
+    assert shipped({}) == ['extra/data/big.bin', 'extra/data/small.csv', 'extra/notes.txt']
+    assert shipped({'exclude': ['**/*.bin']}) == ['extra/data/small.csv', 'extra/notes.txt']
+    assert shipped({'include': ['extra/data/*']}) == ['extra/data/big.bin', 'extra/data/small.csv']
+    assert shipped({'default_excludes': False}) == [
+        'extra/data/big.bin', 'extra/data/small.csv', 'extra/docs/guide.txt', 'extra/notes.txt'
+    ]
+    # Files on the MATLAB path are shipped whatever the rules
+    bundler = PackageBundler(output_dir=str(tmp_path / 'out'))
+    bundler._specs = {'demo': {'yaml': {'bundle': {'include': ['extra/*']}}}}
+    selected, _ = bundler._select_files(str(dir_path), metadata)
+    names = [arcname for arcname, _ in selected]
+    assert 'demo/demo.m' in names and 'demo/private/helper.m' in names
+    # ... but not their subdirectories
+    assert 'demo/tests/test_demo.m' not in names
+
+
+def test_threaded_compression_is_byte_identical_to_serial(tmp_path, monkeypatch):
+    dir_path = make_dir_package(tmp_path / 'src', '2024-01-01T00:00:00Z')
+    for i in range(40):
+        (dir_path / 'demo' / f'f{i}.m').write_text(f"function f{i}()\n" + "x = 1;\n" * (i * 50))
+    # Stream the larger members on the writing thread, compress the others on workers
+    monkeypatch.setattr(bundle_packages, 'MAX_IN_MEMORY_MEMBER_SIZE', 1000)
+
+    outputs = {}
+    for threads in [1, 4]:
+        output_dir = tmp_path / f'threads{threads}'
+        PackageBundler(output_dir=str(output_dir), compress_threads=threads).bundle_package(str(dir_path))
+        outputs[threads] = (output_dir / 'demo-1.0-any-none-any.mhl').read_bytes()
+    assert outputs[4] == outputs[1]
+
+    # Without the ZipFile internals, threads fall back to serial compression
+    monkeypatch.setattr(bundle_packages, 'PARALLEL_COMPRESSION_AVAILABLE', False)
+    monkeypatch.setattr(bundle_packages, '_write_compressed_member', None)
+    output_dir = tmp_path / 'fallback'
+    PackageBundler(output_dir=str(output_dir), compress_threads=4).bundle_package(str(dir_path))
+    assert (output_dir / 'demo-1.0-any-none-any.mhl').read_bytes() == outputs[1]
+
+    # Without the level attribute, members go through writestr
+    monkeypatch.setattr(bundle_packages, 'ZIPINFO_LEVEL_ATTRIBUTE', None)
+    output_dir = tmp_path / 'writestr'
+    PackageBundler(output_dir=str(output_dir)).bundle_package(str(dir_path))
+    assert (output_dir / 'demo-1.0-any-none-any.mhl').read_bytes() == outputs[1]
+
+
+def test_layers_only_builds_publish_no_full_archive(tmp_path):
+    pytest.importorskip('zstandard')
+    dir_path = make_dir_package(tmp_path / 'src', '2024-01-01T00:00:00Z')
+    (dir_path / 'demo' / 'kd.mexa64').write_bytes(b'binary')
+    plain = make_dir_package(tmp_path / 'plain', '2024-01-01T00:00:00Z')
+    for path in [dir_path, plain]:
+        metadata = json.loads((path / 'mip.json').read_text())
+        metadata['mhl_url'] = 'https://example.org/demo-1.0-any-none-any.mhl'
+        (path / 'mip.json').write_text(json.dumps(metadata))
+
+    bundler = PackageBundler(output_dir=str(tmp_path / 'out'), layers_only=True, zstd_level=3)
+    assert bundler.bundle_package(str(dir_path))
+    metadata = json.loads((tmp_path / 'out' / 'demo-1.0-any-none-any.mhl.mip.json').read_text())
+    assert metadata['layers_only'] and len(metadata['layers']) == 2
+    assert 'mhl_url' not in metadata and 'variants' not in metadata
+    assert not (tmp_path / 'out' / 'demo-1.0-any-none-any.mhl.zst').exists()
+
+    # Without platform-specific files there are no layers: bundled as usual
+    assert bundler.bundle_package(str(plain))
+    metadata = json.loads((tmp_path / 'out' / 'demo-1.0-any-none-any.mhl.mip.json').read_text())
+    assert 'layers_only' not in metadata and 'layers' not in metadata
+    assert metadata['mhl_url'] and metadata['variants'][0]['encoding'] == 'zstd'
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import stat
+import textwrap
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'scripts'))
+
+from compile_packages import PackageCompiler
+
+
+# Stands in for `matlab -batch "cd('<dir>'); <script>"`: records the call
+# in the package directory and fails for scripts named fail_*. Like a
+# build, it also deletes stale.o and rewrites config.h in place, keeping
+# its size and modification time.
+STUB_MATLAB = textwrap.dedent('''\
+    #!{python}
+    import os, re, sys
+    command = sys.argv[2]
+    directory, script = re.match(r"cd\\('(.*)'\\); (\\w+)", command).groups()
+    print(f"running {{script}}")
+    with open(os.path.join(directory, 'compiled.txt'), 'w') as f:
+        f.write(script)
+    stale = os.path.join(directory, 'stale.o')
+    if os.path.exists(stale):
+        os.remove(stale)
+    config = os.path.join(directory, 'config.h')
+    if os.path.exists(config):
+        st = os.stat(config)
+        with open(config, 'w') as f:
+            f.write('#define X 2\\n')
+        os.utime(config, ns=(st.st_atime_ns, st.st_mtime_ns))
+    sys.exit(1 if script.startswith('fail_') else 0)
+''')
+
+
+def make_package(packages_dir, prepared_dir, name, compile_script, dependencies=()):
+    spec_dir = packages_dir / name
+    spec_dir.mkdir(parents=True)
+    (spec_dir / 'prepare.yaml').write_text(json.dumps({
+        'name': name,
+        'dependencies': list(dependencies),
+        'builds': [{
+            'build_type': 'standard',
+            'matlab_tag': 'any',
+            'abi_tag': 'none',
+            'platform_tag': 'any',
+            'compile_script': compile_script,
+        }],
+    }))
+
+    dir_path = prepared_dir / f"{name}-1.0-any-none-any.dir"
+    dir_path.mkdir(parents=True)
+    (dir_path / compile_script).write_text("disp('compiling')\n")
+    (dir_path / 'mip.json').write_text(json.dumps({
+        'name': name,
+        'matlab_tag': 'any',
+        'abi_tag': 'none',
+        'platform_tag': 'any',
+    }))
+    return dir_path
+
+
+def make_compiler(tmp_path, jobs=2, cache_dir=None):
+    matlab = tmp_path / 'matlab'
+    matlab.write_text(STUB_MATLAB.format(python=sys.executable))
+    matlab.chmod(matlab.stat().st_mode | stat.S_IEXEC)
+    return PackageCompiler(
+        input_dir=str(tmp_path / 'prepared'),
+        packages_dir=str(tmp_path / 'packages'),
+        log_dir=str(tmp_path / 'logs'),
+        matlab=str(matlab),
+        jobs=jobs,
+        cache_dir=cache_dir
+    )
+
+
+def test_compile_all_runs_compile_scripts(tmp_path, monkeypatch):
+    monkeypatch.setenv('BUILD_TYPE', 'standard')
+    packages_dir, prepared_dir = tmp_path / 'packages', tmp_path / 'prepared'
+    kdtree = make_package(packages_dir, prepared_dir, 'kdtree', 'compile_kdtree.m')
+    fmm2d = make_package(packages_dir, prepared_dir, 'fmm2d', 'compile_fmm2d.m')
+
+    assert make_compiler(tmp_path).compile_all()
+
+    for dir_path, script in [(kdtree, 'compile_kdtree'), (fmm2d, 'compile_fmm2d')]:
+        assert (dir_path / 'compiled.txt').read_text() == script
+        assert 'compile_duration' in json.loads((dir_path / 'mip.json').read_text())
+        log = tmp_path / 'logs' / f"{dir_path.name}.log"
+        assert f"running {script}" in log.read_text()
+
+
+def test_failed_compile_skips_dependents(tmp_path, monkeypatch):
+    monkeypatch.setenv('BUILD_TYPE', 'standard')
+    packages_dir, prepared_dir = tmp_path / 'packages', tmp_path / 'prepared'
+    make_package(packages_dir, prepared_dir, 'base', 'fail_base.m')
+    dependent = make_package(packages_dir, prepared_dir, 'app', 'compile_app.m', ['base'])
+    other = make_package(packages_dir, prepared_dir, 'other', 'compile_other.m')
+
+    assert not make_compiler(tmp_path).compile_all()
+
+    assert not (dependent / 'compiled.txt').exists()
+    assert (other / 'compiled.txt').exists()
+
+
+def test_compile_cache_restores_outputs(tmp_path, monkeypatch):
+    monkeypatch.setenv('BUILD_TYPE', 'standard')
+    packages_dir, prepared_dir = tmp_path / 'packages', tmp_path / 'prepared'
+    kdtree = make_package(packages_dir, prepared_dir, 'kdtree', 'compile_kdtree.m')
+    cache_dir = str(tmp_path / 'cache')
+
+    assert make_compiler(tmp_path, cache_dir=cache_dir).compile_all()
+
+    # A fresh prepare of the same sources: restored without running MATLAB
+    (kdtree / 'compiled.txt').unlink()
+    compiler = make_compiler(tmp_path, cache_dir=cache_dir)
+    compiler.matlab = str(tmp_path / 'missing-matlab')
+    assert compiler.compile_all()
+    assert (kdtree / 'compiled.txt').read_text() == 'compile_kdtree'
+
+    # Changed sources miss the cache
+    (kdtree / 'compiled.txt').unlink()
+    (kdtree / 'compile_kdtree.m').write_text("disp('changed')\n")
+    assert not compiler.compile_all()
+
+
+def test_compile_cache_reproduces_deleted_and_rewritten_files(tmp_path, monkeypatch):
+    monkeypatch.setenv('BUILD_TYPE', 'standard')
+    packages_dir, prepared_dir = tmp_path / 'packages', tmp_path / 'prepared'
+    kdtree = make_package(packages_dir, prepared_dir, 'kdtree', 'compile_kdtree.m')
+    cache_dir = str(tmp_path / 'cache')
+
+    def fresh_prepare():
+        (kdtree / 'stale.o').write_bytes(b'old object')
+        (kdtree / 'config.h').write_text('#define X 1\n')
+        os.utime(kdtree / 'config.h', ns=(10**18, 10**18))
+
+    fresh_prepare()
+    assert make_compiler(tmp_path, cache_dir=cache_dir).compile_all()
+    compiled = {p.name: p.read_bytes() for p in kdtree.iterdir() if p.name != 'mip.json'}
+    assert 'stale.o' not in compiled and compiled['config.h'] == b'#define X 2\n'
+
+    (kdtree / 'compiled.txt').unlink()
+    fresh_prepare()
+    compiler = make_compiler(tmp_path, cache_dir=cache_dir)
+    compiler.matlab = str(tmp_path / 'missing-matlab')
+    assert compiler.compile_all()
+    assert {p.name: p.read_bytes() for p in kdtree.iterdir() if p.name != 'mip.json'} == compiled
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'scripts'))
+
+from package_graph import PackageGraph, DependencyCycleError, completed_future
+
+
+# chebfun <- surfacefun -> fmm2d;  kdtree standalone;  app -> surfacefun
+DEPENDENCIES = {
+    'chebfun': [],
+    'fmm2d': [],
+    'surfacefun': ['chebfun', 'fmm2d'],
+    'app': ['surfacefun'],
+    'kdtree': ['not-a-package'],
+}
+
+
+def test_select_with_deps_and_dependents():
+    graph = PackageGraph(DEPENDENCIES)
+
+    assert graph.select(['surfacefun']) == {'surfacefun'}
+    assert graph.select(['surfacefun'], with_deps=True) == {'surfacefun', 'chebfun', 'fmm2d'}
+    assert graph.select(['chebfun'], with_dependents=True) == {'chebfun', 'surfacefun', 'app'}
+    assert graph.select(['surfacefun'], with_deps=True, with_dependents=True) == \
+        {'surfacefun', 'chebfun', 'fmm2d', 'app'}
+    with pytest.raises(KeyError):
+        graph.select(['missing'])
+
+
+def test_topological_order_is_deterministic():
+    graph = PackageGraph(DEPENDENCIES)
+
+    assert graph.topological_order() == ['chebfun', 'fmm2d', 'kdtree', 'surfacefun', 'app']
+    assert graph.topological_order(['app', 'chebfun', 'kdtree']) == ['app', 'chebfun', 'kdtree']
+
+
+def test_cycles_are_detected():
+    graph = PackageGraph({'a': ['b'], 'b': ['c'], 'c': ['a'], 'd': ['d']})
+
+    assert graph.find_cycle() == ['a', 'b', 'c', 'a']
+    with pytest.raises(DependencyCycleError, match='a -> b -> c -> a'):
+        graph.topological_order()
+    # Self-dependencies are ignored
+    assert PackageGraph({'d': ['d']}).find_cycle() is None
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_schedule_skips_dependents_of_failures(jobs):
+    graph = PackageGraph(DEPENDENCIES)
+    started, finished = [], []
+
+    def work(name):
+        # Every dependency has finished before a package starts
+        assert all(dep in finished for dep in graph.dependencies[name])
+        return name != 'fmm2d'
+
+    def on_complete(name, future):
+        finished.append(name)
+        return future.result()
+
+    def submit(name):
+        started.append(name)
+        if jobs == 1:
+            return completed_future(work, name)
+        return executor.submit(work, name)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = graph.schedule(DEPENDENCIES, submit, on_complete)
+
+    assert results == {
+        'chebfun': True, 'fmm2d': False, 'kdtree': True,
+        'surfacefun': None, 'app': None,
+    }
+    assert sorted(started) == ['chebfun', 'fmm2d', 'kdtree']
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import shutil
+import hashlib
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import requests
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'scripts'))
+
+import prepare_packages
+from prepare_packages import (
+    PackagePreparer, PackageTreeIndex, stream_download, clone_git_repository, _sparse_paths_for,
+    create_load_and_unload_scripts
+)
+from package_graph import load_package_specs
+
+
+PAYLOAD = bytes(range(256)) * 1024
+ETAG = '"v1"'
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """
+    Serves PAYLOAD, dropping the first connection halfway through.
+
+    server.honor_range decides whether Range requests get a 206 or the
+    whole file again. With server.short_range, the first 206 response
+    only covers 1 KiB of the requested range, with a Content-Length that
+    matches what is sent.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        first = len(self.server.requests) == 1
+        start = 0
+        range_header = self.headers.get('Range')
+        end = len(PAYLOAD)
+        if range_header and self.server.honor_range and self.headers.get('If-Range') == ETAG:
+            start = int(range_header[len('bytes='):].rstrip('-'))
+            if self.server.short_range and len(self.server.requests) == 2:
+                end = start + 1024
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{len(PAYLOAD)}')
+        else:
+            self.send_response(200)
+        body = PAYLOAD[start:end]
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', ETAG)
+        self.end_headers()
+        if first:
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(prepare_packages.time, 'sleep', lambda seconds: None)
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+    httpd.requests = []
+    httpd.honor_range = True
+    httpd.short_range = False
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url_of(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/file.zip"
+
+
+def test_stream_download_resumes_with_range(server, tmp_path):
+    path = tmp_path / 'file.zip'
+    sha256 = hashlib.sha256(PAYLOAD).hexdigest()
+
+    info = stream_download(url_of(server), str(path), expected_sha256=sha256)
+
+    assert path.read_bytes() == PAYLOAD
+    assert info['sha256'] == sha256 and info['size'] == len(PAYLOAD)
+    assert info['etag'] == ETAG
+    assert len(server.requests) == 2
+    resumed = server.requests[1]
+    assert resumed['Range'] == f'bytes={len(PAYLOAD) // 2}-'
+    assert resumed['If-Range'] == ETAG
+
+
+def test_stream_download_restarts_when_range_is_ignored(server, tmp_path):
+    server.honor_range = False
+    path = tmp_path / 'file.zip'
+
+    info = stream_download(url_of(server), str(path))
+
+    assert path.read_bytes() == PAYLOAD
+    assert info['sha256'] == hashlib.sha256(PAYLOAD).hexdigest()
+    assert len(server.requests) == 2
+
+
+def test_stream_download_resumes_after_a_short_response(server, tmp_path):
+    server.short_range = True
+    path = tmp_path / 'file.zip'
+
+    info = stream_download(url_of(server), str(path))
+
+    assert path.read_bytes() == PAYLOAD
+    assert info['size'] == len(PAYLOAD)
+    assert [r.get('Range') for r in server.requests] == [
+        None, f'bytes={len(PAYLOAD) // 2}-', f'bytes={len(PAYLOAD) // 2 + 1024}-'
+    ]
+
+
+def test_stream_download_rejects_wrong_sha256(server, tmp_path):
+    with pytest.raises(ValueError):
+        stream_download(url_of(server), str(tmp_path / 'file.zip'), expected_sha256='0' * 64)
+
+
+def git(repo, *args):
+    return subprocess.run(
+        ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args],
+        cwd=repo, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+@pytest.fixture
+def upstream_repo(tmp_path):
+    """A repository with a tagged first commit and a second commit."""
+    repo = tmp_path / 'upstream'
+    (repo / 'src').mkdir(parents=True)
+    (repo / 'docs').mkdir()
+    git(repo, 'init', '-q')
+    (repo / 'src' / 'solve.m').write_text('v1')
+    (repo / 'docs' / 'guide.txt').write_text('guide')
+    (repo / 'README').write_text('readme')
+    git(repo, 'add', '.')
+    git(repo, 'commit', '-q', '-m', 'first')
+    git(repo, 'tag', 'v1')
+    (repo / 'src' / 'solve.m').write_text('v2')
+    git(repo, 'commit', '-q', '-am', 'second')
+    git(repo, 'config', 'uploadpack.allowFilter', 'true')
+    return repo
+
+
+def test_clone_git_checks_out_ref_and_removes_git_dir(upstream_repo, tmp_path):
+    first = git(upstream_repo, 'rev-parse', 'v1')
+    for ref in ['v1', first]:
+        destination = tmp_path / f'clone-{ref}'
+        commit = clone_git_repository(f'file://{upstream_repo}', str(destination), ref=ref)
+        assert commit == first
+        assert (destination / 'src' / 'solve.m').read_text() == 'v1'
+        assert not (destination / '.git').exists()
+
+    destination = tmp_path / 'clone-default'
+    assert clone_git_repository(str(upstream_repo), str(destination)) == \
+        git(upstream_repo, 'rev-parse', 'HEAD')
+    assert (destination / 'src' / 'solve.m').read_text() == 'v2'
+
+
+def test_clone_git_shallow_and_sparse(upstream_repo, tmp_path, capsys):
+    destination = tmp_path / 'clone'
+    commit = clone_git_repository(
+        f'file://{upstream_repo}', str(destination), shallow=True, sparse_paths=['src']
+    )
+
+    assert commit == git(upstream_repo, 'rev-parse', 'HEAD')
+    assert (destination / 'src' / 'solve.m').read_text() == 'v2'
+    assert (destination / 'README').exists()  # cone mode keeps top-level files
+    assert not (destination / 'docs').exists()
+    assert 'Sparse checkout: src' in capsys.readouterr().out
+
+
+def test_sparse_paths_follow_addpaths():
+    addpaths = ['lib/src', {'path': 'lib/tools', 'recursive': True}, 'other/x']
+    assert _sparse_paths_for({'destination': 'lib'}, addpaths) is None
+    assert _sparse_paths_for({'destination': 'lib', 'sparse': True}, addpaths) == ['src', 'tools']
+    assert _sparse_paths_for({'destination': 'lib', 'sparse': ['a']}, addpaths) == ['a']
+    # The clone root itself is on the path: nothing can be left out
+    assert _sparse_paths_for({'destination': 'lib', 'sparse': True}, ['lib']) is None
+
+
+# The os.walk/os.listdir implementations that PackageTreeIndex replaced
+
+def walk_recursive_paths(base_path, exclude_dirs):
+    paths = []
+    for root, dirs, files in os.walk(base_path):
+        dirs[:] = [d for d in dirs if d not in exclude_dirs]
+        if any(f.endswith('.m') for f in files):
+            paths.append(os.path.relpath(root, os.path.dirname(base_path)))
+    return sorted(paths)
+
+
+def listdir_exposed_symbols(base_dir, extensions):
+    symbols = []
+    for item in sorted(os.listdir(base_dir)):
+        item_path = os.path.join(base_dir, item)
+        if os.path.isfile(item_path):
+            for ext in extensions:
+                if item.endswith(ext):
+                    symbols.append(item[:-len(ext)])
+                    break
+        elif item.startswith('+') or item.startswith('@'):
+            symbols.append(item[1:])
+    return symbols
+
+
+def walk_mex_files(root_dir, extensions):
+    return sorted(
+        os.path.relpath(os.path.join(root, f), root_dir)
+        for root, dirs, files in os.walk(root_dir)
+        for f in files if any(f.endswith(ext) for ext in extensions)
+    )
+
+
+def test_package_tree_index_matches_walk(tmp_path):
+    files = [
+        'pkg/startup.m', 'pkg/helper.c', 'pkg/readme.txt',
+        'pkg/src/solve.m', 'pkg/src/solve.mexa64', 'pkg/src/@Solver/Solver.m',
+        'pkg/src/+util/norm2.m', 'pkg/tests/test_solve.m',
+        'pkg/tests/deep/more.m', 'pkg/docs/guide.txt', 'pkg/bin/old.mexw64',
+    ]
+    for rel_path in files:
+        (tmp_path / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / rel_path).write_text('%')
+    (tmp_path / 'pkg' / 'empty').mkdir()
+
+    tree = PackageTreeIndex(str(tmp_path))
+
+    for exclude in [[], ['tests'], ['tests', 'src']]:
+        assert tree.recursive_paths('pkg', exclude) == \
+            walk_recursive_paths(str(tmp_path / 'pkg'), exclude)
+    for path in ['pkg', 'pkg/src', 'pkg/src/+util', 'pkg/empty']:
+        for extensions in [['.m'], ['.m', '.c']]:
+            symbols = tree.exposed_symbols(path, extensions)
+            assert [s['name'] for s in symbols] == \
+                listdir_exposed_symbols(str(tmp_path / path), extensions)
+    mex_extensions = ['.mexa64', '.mexw64']
+    assert tree.find_files(mex_extensions) == walk_mex_files(str(tmp_path), mex_extensions)
+
+    tree.remove_file(os.path.join('pkg', 'src', 'solve.mexa64'))
+    assert tree.find_files(mex_extensions) == walk_mex_files(str(tmp_path), mex_extensions)
+    assert tree.recursive_paths('missing', []) == []
+
+
+def make_package(packages_dir, name, dependencies=(), prepare=None):
+    package_dir = packages_dir / name
+    package_dir.mkdir(parents=True)
+    (package_dir / 'prepare.yaml').write_text(yaml.safe_dump({
+        'name': name,
+        'description': f'{name} package',
+        'version': '1.0',
+        'build_number': 1,
+        'dependencies': list(dependencies),
+        'prepare': prepare or {},
+        'builds': [{'build_type': 'standard', 'matlab_tag': 'any',
+                    'abi_tag': 'none', 'platform_tag': 'any'}],
+    }))
+    return package_dir
+
+
+@pytest.fixture
+def offline(monkeypatch, tmp_path):
+    """Packages come from tmp_path/packages and nothing is published."""
+    packages_dir = tmp_path / 'packages'
+    packages_dir.mkdir()
+    monkeypatch.setenv('BUILD_TYPE', 'standard')
+    monkeypatch.setattr(
+        prepare_packages, 'load_package_specs', lambda _: load_package_specs(str(packages_dir))
+    )
+    monkeypatch.setattr(PackagePreparer, '_load_remote_index', lambda self: {})
+    monkeypatch.setattr(PackagePreparer, '_check_existing_package', lambda self, *args: False)
+    return packages_dir
+
+
+def test_parallel_prepare_follows_dependencies_and_skips_dependents_of_failures(offline, tmp_path, capsys):
+    make_package(offline, 'base')
+    make_package(offline, 'app', dependencies=['base'])
+    make_package(offline, 'broken', prepare={'clone_git': {
+        'url': str(tmp_path / 'no-such-repo'), 'destination': 'broken'
+    }})
+    make_package(offline, 'needs_broken', dependencies=['broken'])
+    make_package(offline, 'other')
+    output_dir = tmp_path / 'prepared'
+
+    assert not PackagePreparer(output_dir=str(output_dir), jobs=2).prepare_all_packages()
+
+    prepared = sorted(p.name for p in output_dir.iterdir())
+    assert prepared == [f'{n}-1.0-any-none-any.dir' for n in ['app', 'base', 'other']]
+    output = capsys.readouterr().out
+    assert 'Preparation failed for 1 package(s): broken' in output
+    assert 'Skipped 1 package(s) whose dependencies failed: needs_broken' in output
+    # Each package's log is one block, and a package starts after its dependencies
+    assert output.index('Processing package: base') < output.index('Processing package: app')
+    base_log = output[output.index('Processing package: base'):]
+    assert base_log.index('Successfully prepared') < base_log.index('Processing package:', 1)
+
+
+class FakeSession:
+    """Answers GET requests from a dict of url -> (status, JSON body)."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requested = []
+
+    def get(self, url, timeout=None):
+        self.requested.append(url)
+        status, body = self.responses.get(url, (404, {}))
+        response = requests.Response()
+        response.status_code = status
+        response.url = url
+        response._content = json.dumps(body).encode('utf-8')
+        return response
+
+
+def published(name):
+    """The .mhl filename, index entry and YAML spec of a published build."""
+    filename = f'{name}-1.0-any-none-any.mhl'
+    spec = {
+        'name': name, 'description': f'{name} package', 'version': '1.0',
+        'build_number': 1, 'dependencies': [],
+        'homepage': '', 'repository': '', 'license': '',
+    }
+    return filename, dict(
+        spec,
+        mhl_url=f'https://example.org/{filename}',
+        mip_json_url=f'https://example.org/{filename}.mip.json',
+    ), spec
+
+
+def test_existing_package_is_checked_against_the_index(monkeypatch):
+    preparer = PackagePreparer(dry_run=True)
+    listed, listed_metadata, listed_spec = published('listed')
+    missing, missing_metadata, missing_spec = published('missing')
+    session = FakeSession({
+        preparer.index_url: (200, {'packages': [listed_metadata]}),
+        f'{preparer.base_url}/{missing}.mip.json': (200, missing_metadata),
+    })
+    monkeypatch.setattr(prepare_packages, '_session', session)
+
+    assert preparer._check_existing_package(listed, listed_spec)
+    assert not preparer._check_existing_package(listed, dict(listed_spec, build_number=2))
+    # The index is fetched once, and listed builds need no other request
+    assert session.requested == [preparer.index_url]
+
+    # A build missing from the index falls back to its .mip.json
+    assert preparer._check_existing_package(missing, missing_spec)
+    assert session.requested[-1] == f'{preparer.base_url}/{missing}.mip.json'
+    assert not preparer._check_existing_package('unknown-1.0-any-none-any.mhl', missing_spec)
+
+
+def test_unreachable_index_falls_back_to_mip_json(monkeypatch, capsys):
+    preparer = PackagePreparer(dry_run=True)
+    filename, metadata, spec = published('pkg')
+    session = FakeSession({
+        preparer.index_url: (503, {}),
+        f'{preparer.base_url}/{filename}.mip.json': (200, metadata),
+    })
+    monkeypatch.setattr(prepare_packages, '_session', session)
+
+    assert preparer._load_remote_index() == {}
+    assert preparer._check_existing_package(filename, spec)
+    assert 'Could not fetch package index' in capsys.readouterr().out
+    assert session.requested.count(preparer.index_url) == 1
+
+
+@pytest.fixture
+def fingerprinted(offline, monkeypatch, tmp_path):
+    """
+    A package with a compile script, and a preparer that counts prepares.
+
+    Published builds are recorded in the returned published dict.
+    """
+    package_dir = make_package(offline, 'pkg')
+    spec = yaml.safe_load((package_dir / 'prepare.yaml').read_text())
+    spec['builds'][0]['compile_script'] = 'compile.m'
+    (package_dir / 'prepare.yaml').write_text(yaml.safe_dump(spec))
+    (package_dir / 'compile.m').write_text('mex solve.c')
+
+    published = {}
+    monkeypatch.setattr(
+        PackagePreparer, '_published_metadata', lambda self, filename: published.get(filename)
+    )
+    prepares = []
+    prepare = PackagePreparer._prepare_package
+
+    def counting_prepare(self, *args):
+        prepares.append(args[0])
+        return prepare(self, *args)
+
+    monkeypatch.setattr(PackagePreparer, '_prepare_package', counting_prepare)
+    return package_dir, published, prepares
+
+
+def publish(output_dir, published):
+    for mip_json in output_dir.glob('*.dir/mip.json'):
+        published[mip_json.parent.name[:-len('.dir')] + '.mhl'] = json.loads(mip_json.read_text())
+
+
+def test_matching_fingerprint_skips_only_published_builds(fingerprinted, tmp_path):
+    package_dir, published, prepares = fingerprinted
+    output_dir = tmp_path / 'prepared'
+    preparer = PackagePreparer(output_dir=str(output_dir))
+
+    assert preparer.prepare_package_dir(str(package_dir))
+    # Prepared, but a later stage failed: nothing was published
+    assert preparer.prepare_package_dir(str(package_dir))
+    assert len(prepares) == 2
+
+    publish(output_dir, published)
+    assert preparer.prepare_package_dir(str(package_dir))
+    assert len(prepares) == 2
+
+
+@pytest.mark.parametrize('change', ['yaml', 'upstream', 'compile_script', 'missing_dir', 'force'])
+def test_changed_inputs_rebuild(fingerprinted, tmp_path, monkeypatch, change):
+    package_dir, published, prepares = fingerprinted
+    output_dir = tmp_path / 'prepared'
+    assert PackagePreparer(output_dir=str(output_dir)).prepare_package_dir(str(package_dir))
+    publish(output_dir, published)
+
+    if change == 'yaml':
+        spec = yaml.safe_load((package_dir / 'prepare.yaml').read_text())
+        spec['description'] = 'changed'
+        (package_dir / 'prepare.yaml').write_text(yaml.safe_dump(spec))
+    elif change == 'upstream':
+        monkeypatch.setattr(PackagePreparer, '_resolve_upstream', lambda self, config: 'git:' + 'a' * 40)
+    elif change == 'compile_script':
+        (package_dir / 'compile.m').write_text('mex -O solve.c')
+    elif change == 'missing_dir':
+        shutil.rmtree(next(output_dir.glob('*.dir')))
+    preparer = PackagePreparer(output_dir=str(output_dir), force=change == 'force')
+
+    assert preparer.prepare_package_dir(str(package_dir))
+    assert len(prepares) == 2
+
+
+def test_exposed_symbols_kinds_and_paths(tmp_path):
+    lib = tmp_path / 'lib'
+    (lib / '@Solver').mkdir(parents=True)
+    (lib / '+util').mkdir()
+    (lib / 'private').mkdir()
+    for i in range(2000):
+        (lib / f'f{i:04d}.m').write_text('%')
+    (lib / 'notes.txt').write_text('')
+
+    symbols = PackageTreeIndex(str(tmp_path)).exposed_symbols('lib', ['.m'])
+
+    assert len(symbols) == 2002
+    assert symbols[:2] == [
+        {'name': 'util', 'kind': 'package', 'path': 'lib/+util'},
+        {'name': 'Solver', 'kind': 'class', 'path': 'lib/@Solver'},
+    ]
+    assert symbols[2] == {'name': 'f0000', 'kind': 'function', 'path': 'lib/f0000.m'}
+
+
+def test_load_scripts_change_the_path_with_one_call(tmp_path):
+    create_load_and_unload_scripts(str(tmp_path), ['pkg', 'pkg/sub', "it's"])
+
+    load = (tmp_path / 'load_package.m').read_text()
+    unload = (tmp_path / 'unload_package.m').read_text()
+    assert load.count('addpath(') == 1 and 'rmpath(' not in load
+    assert unload.count('rmpath(') == 1 and 'addpath(' not in unload
+    # Reversed, so that the last path ends up on top, as with one call per path
+    cell = "{ ...\n        'it''s', ...\n        'pkg/sub', ...\n        'pkg' ...\n    }"
+    assert f"rel_paths = {cell};" in load
+    assert f"rel_paths = {cell};" in unload
+    assert "addpath(strjoin(fullfile(pkg_dir, rel_paths), pathsep));" in load
+
+
+def test_load_scripts_without_paths(tmp_path):
+    create_load_and_unload_scripts(str(tmp_path), [])
+
+    load = (tmp_path / 'load_package.m').read_text()
+    assert load.startswith('function load_package()') and load.endswith('end\n')
+    assert 'addpath' not in load
+    assert 'rmpath' not in (tmp_path / 'unload_package.m').read_text()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import os
+import sys
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'scripts'))
+
+from source_cache import SourceCache, entry_lock, evict_lru
+from prepare_packages import clone_git_repository
+
+
+def make_entry(parent, name, size, age):
+    """A cache entry of the given size, last used age seconds ago."""
+    path = parent / name
+    path.write_bytes(b'x' * size)
+    mtime = path.stat().st_mtime - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def make_repo(path):
+    path.mkdir()
+    git = ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+    subprocess.run(git + ['init', '-q'], cwd=path, check=True)
+    (path / 'solve.m').write_text('function solve')
+    subprocess.run(git + ['add', '.'], cwd=path, check=True)
+    subprocess.run(git + ['commit', '-q', '-m', 'first'], cwd=path, check=True)
+    return path
+
+
+def test_evict_lru_removes_oldest_entries_first(tmp_path):
+    old = make_entry(tmp_path, 'old', 100, age=300)
+    used = make_entry(tmp_path, 'used', 100, age=200)
+    new = make_entry(tmp_path, 'new', 100, age=100)
+
+    evict_lru([str(tmp_path)], max_bytes=150, keep=str(used))
+
+    assert not old.exists() and not new.exists()
+    assert used.exists()
+
+
+def test_locked_entries_are_not_evicted(tmp_path):
+    cache = SourceCache(str(tmp_path / 'cache'), max_bytes=0)
+    objects = Path(cache.zip_objects_dir)
+    busy = make_entry(objects, 'busy.zip', 100, age=200)
+    idle = make_entry(objects, 'idle.zip', 100, age=100)
+
+    with cache.lock(str(busy), shared=True):
+        cache.evict()
+        assert busy.exists() and not idle.exists()
+
+    cache.evict()
+    assert not busy.exists()
+
+
+def test_mirror_updates_evict_and_hold_the_mirror_lock(tmp_path, monkeypatch):
+    repo = make_repo(tmp_path / 'repo')
+    cache = SourceCache(str(tmp_path / 'cache'), max_bytes=1)
+    objects = Path(cache.zip_objects_dir)
+
+    stale = make_entry(objects, 'stale.zip', 100, age=100)
+    clone_git_repository(str(repo), str(tmp_path / 'first'), cache=cache)
+    assert not stale.exists()
+    mirror = cache.mirror_path(str(repo))
+    assert os.path.isdir(mirror)
+
+    # Updating the existing mirror also evicts; the mirror itself is kept
+    # because it is in use
+    evictions = []
+    evict = cache.evict
+
+    def checked_evict(keep=None):
+        with entry_lock(cache.lock_dir, mirror, blocking=False) as acquired:
+            evictions.append((keep, acquired))
+        evict(keep)
+
+    monkeypatch.setattr(cache, 'evict', checked_evict)
+    stale = make_entry(objects, 'stale.zip', 100, age=100)
+    clone_git_repository(str(repo), str(tmp_path / 'second'), cache=cache)
+    assert evictions == [(mirror, False)]
+    assert not stale.exists()
+    assert os.path.isdir(mirror)
+    assert (tmp_path / 'second' / 'solve.m').exists()
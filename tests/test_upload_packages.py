@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+import sys
+import json
+import hashlib
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'scripts'))
+
+moto = pytest.importorskip('moto')
+
+from upload_packages import PackageUploader
+
+
+BUCKET = 'mip-packages'
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_ENDPOINT_URL', 'https://s3.amazonaws.com')
+    with moto.mock_aws():
+        yield
+
+
+def make_uploader(bundled_dir, **kwargs):
+    uploader = PackageUploader(input_dir=str(bundled_dir), **kwargs)
+    if not uploader.s3_client.list_buckets()['Buckets']:
+        uploader.s3_client.create_bucket(
+            Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': 'auto'}
+        )
+    return uploader
+
+
+def make_bundle(bundled_dir, name, data, with_mip_json=True):
+    bundled_dir.mkdir(exist_ok=True)
+    mhl_path = bundled_dir / f"{name}-1.0-any-none-any.mhl"
+    mhl_path.write_bytes(data)
+    if with_mip_json:
+        Path(f"{mhl_path}.mip.json").write_text(json.dumps({'name': name}))
+    return mhl_path
+
+
+def object_body(uploader, key):
+    return uploader.s3_client.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+
+
+def test_upload_all_uploads_concurrently_and_summarizes_failures(s3, tmp_path, capsys):
+    bundled_dir = tmp_path / 'bundled'
+    big = bytes(range(256)) * (24 * 1024)  # 6 MiB, two parts of 5 MiB
+    make_bundle(bundled_dir, 'alpha', big)
+    make_bundle(bundled_dir, 'beta', b'beta')
+    make_bundle(bundled_dir, 'gamma', b'gamma', with_mip_json=False)
+
+    uploader = make_uploader(bundled_dir, jobs=3, multipart_chunk_size='5M')
+    assert not uploader.upload_all()
+
+    alpha_key = 'core/packages/alpha-1.0-any-none-any.mhl'
+    assert object_body(uploader, alpha_key) == big
+    head = uploader.s3_client.head_object(Bucket=BUCKET, Key=alpha_key)
+    assert head['ETag'].endswith('-2"')  # uploaded in parts
+    assert head['ContentType'] == 'application/zip'
+    assert object_body(uploader, 'core/packages/beta-1.0-any-none-any.mhl.mip.json')
+
+    output = capsys.readouterr().out
+    assert 'Upload failed for 1 of 3 package(s)' in output
+    assert 'gamma-1.0-any-none-any.mhl' in output.split('Upload failed for')[1]
+
+
+def test_unchanged_files_are_not_uploaded_again(s3, tmp_path, capsys):
+    bundled_dir = tmp_path / 'bundled'
+    make_bundle(bundled_dir, 'alpha', b'alpha v1')
+    beta = make_bundle(bundled_dir, 'beta', b'beta v1')
+
+    assert make_uploader(bundled_dir).upload_all()
+
+    beta.write_bytes(b'beta v2')
+    uploader = make_uploader(bundled_dir)
+    assert uploader.upload_all()
+
+    assert uploader.stats == {
+        'uploaded_files': 1, 'uploaded_bytes': len(b'beta v2'),
+        'skipped_files': 3, 'skipped_bytes': len(b'alpha v1') + len('{"name": "alpha"}') + len('{"name": "beta"}'),
+    }
+    assert object_body(uploader, 'core/packages/beta-1.0-any-none-any.mhl') == b'beta v2'
+    assert 'skipped 3 unchanged file(s)' in capsys.readouterr().out
+
+
+def test_transient_errors_are_retried_and_multipart_uploads_resume(s3, tmp_path, monkeypatch):
+    from botocore.exceptions import ClientError
+
+    monkeypatch.setattr('upload_packages.time.sleep', lambda seconds: None)
+    bundled_dir = tmp_path / 'bundled'
+    big = bytes(range(256)) * (44 * 1024)  # 11 MiB, three parts of 5 MiB
+    make_bundle(bundled_dir, 'alpha', big)
+
+    def unavailable(operation):
+        return ClientError(
+            {'Error': {'Code': 'ServiceUnavailable'}, 'ResponseMetadata': {'HTTPStatusCode': 503}},
+            operation
+        )
+
+    # Part 3 keeps failing: the retries run out and the upload is interrupted
+    uploader = make_uploader(bundled_dir, multipart_chunk_size='5M', retry_budget=2)
+    upload_part = uploader.s3_client.upload_part
+    calls = []
+
+    def flaky_upload_part(**kwargs):
+        calls.append(kwargs['PartNumber'])
+        if kwargs['PartNumber'] == 3:
+            raise unavailable('UploadPart')
+        return upload_part(**kwargs)
+
+    monkeypatch.setattr(uploader.s3_client, 'upload_part', flaky_upload_part)
+    assert not uploader.upload_all()
+    assert calls.count(3) == 3
+    assert uploader.retries == 2
+    assert uploader._load_multipart_record('core/packages/alpha-1.0-any-none-any.mhl')
+
+    # The next run only uploads the missing part
+    uploader = make_uploader(bundled_dir, multipart_chunk_size='5M')
+    upload_part = uploader.s3_client.upload_part
+    calls = []
+
+    def counted_upload_part(**kwargs):
+        calls.append(kwargs['PartNumber'])
+        return upload_part(**kwargs)
+
+    monkeypatch.setattr(uploader.s3_client, 'upload_part', counted_upload_part)
+    assert uploader.upload_all()
+    assert calls == [3]
+    assert object_body(uploader, 'core/packages/alpha-1.0-any-none-any.mhl') == big
+    assert not list((bundled_dir / '.multipart-uploads').iterdir())
+
+
+def test_content_addressed_upload(s3, tmp_path):
+    from assemble_index import IndexAssembler
+
+    bundled_dir = tmp_path / 'bundled'
+    mhl_path = make_bundle(bundled_dir, 'alpha', b'alpha v1')
+    (bundled_dir / f"{mhl_path.name}.zst").write_bytes(b'zstd')
+    Path(f"{mhl_path}.mip.json").write_text(json.dumps({
+        'name': 'alpha',
+        'variants': [{'encoding': 'zstd', 'filename': f"{mhl_path.name}.zst"}],
+    }))
+
+    uploader = make_uploader(bundled_dir, content_addressed=True)
+    assert uploader.upload_all()
+
+    sha256 = hashlib.sha256(b'alpha v1').hexdigest()
+    mhl_key = f"core/blobs/{sha256}/{mhl_path.name}"
+    head = uploader.s3_client.head_object(Bucket=BUCKET, Key=mhl_key)
+    assert head['CacheControl'] == 'public, max-age=31536000, immutable'
+
+    mip_json_key = f"core/packages/{mhl_path.name}.mip.json"
+    head = uploader.s3_client.head_object(Bucket=BUCKET, Key=mip_json_key)
+    assert head['CacheControl'] == 'public, max-age=300'
+
+    metadata = IndexAssembler()._download_mip_json(mip_json_key)
+    assert metadata['mhl_url'] == f"https://mip-packages.neurosift.app/{mhl_key}"
+    zstd_sha256 = hashlib.sha256(b'zstd').hexdigest()
+    assert metadata['variants'][0]['url'] == (
+        f"https://mip-packages.neurosift.app/core/blobs/{zstd_sha256}/{mhl_path.name}.zst"
+    )
+
+
+def test_published_base_is_reused_by_other_builds(s3, tmp_path):
+    # Two builders produce the same base (same files) with different bytes
+    base_filename = 'alpha-1.0.base-0123456789abcdef.zip'
+    for platform, base in [('linux', b'base deflated on linux'), ('macos', b'base deflated on macos')]:
+        bundled_dir = tmp_path / platform
+        mhl_path = make_bundle(bundled_dir, f'alpha-{platform}', b'full ' + platform.encode())
+        (bundled_dir / base_filename).write_bytes(base)
+        (bundled_dir / 'overlay.zip').write_bytes(platform.encode())
+        Path(f"{mhl_path}.mip.json").write_text(json.dumps({'name': 'alpha', 'layers': [
+            {'role': 'base', 'filename': base_filename, 'size': len(base),
+             'sha256': hashlib.sha256(base).hexdigest()},
+            {'role': 'overlay', 'filename': 'overlay.zip'},
+        ]}))
+        assert make_uploader(bundled_dir, force=True).upload_all()
+
+    uploader = make_uploader(tmp_path / 'linux')
+    assert object_body(uploader, f'core/packages/{base_filename}') == b'base deflated on linux'
+    metadata = json.loads(object_body(
+        uploader, 'core/packages/alpha-macos-1.0-any-none-any.mhl.mip.json'
+    ))
+    base = metadata['layers'][0]
+    assert base['sha256'] == hashlib.sha256(b'base deflated on linux').hexdigest()
+    assert base['size'] == len(b'base deflated on linux')
+
+
+def test_index_journal_replaces_bucket_listing(s3, tmp_path, monkeypatch):
+    from assemble_index import IndexAssembler
+
+    bundled_dir = tmp_path / 'bundled'
+    make_bundle(bundled_dir, 'alpha', b'alpha')
+    uploader = make_uploader(bundled_dir)
+    assert uploader.upload_all()
+    assert uploader.journal.load() == (None, None)
+
+    # Without a journal, the assembler lists the bucket and creates it
+    alpha_key = 'core/packages/alpha-1.0-any-none-any.mhl.mip.json'
+    assert IndexAssembler()._list_mip_json_files() == [alpha_key]
+
+    # Later uploads are recorded in the journal
+    make_bundle(bundled_dir, 'beta', b'beta')
+    assert make_uploader(bundled_dir).upload_all()
+    entries, _ = uploader.journal.load()
+    beta_key = 'core/packages/beta-1.0-any-none-any.mhl.mip.json'
+    assert sorted(entries) == [alpha_key, beta_key]
+    head = uploader.s3_client.head_object(Bucket=BUCKET, Key=beta_key)
+    assert entries[beta_key]['etag'] == head['ETag']
+
+    # ... and the assembler reads it instead of listing the bucket
+    assembler = IndexAssembler()
+    monkeypatch.setattr(assembler.s3_client, 'get_paginator', None)
+    assert sorted(assembler._list_mip_json_files()) == [alpha_key, beta_key]
+
+
+def test_full_listing_rebuilds_the_journal_without_losing_uploads(s3, tmp_path):
+    from assemble_index import IndexAssembler
+
+    bundled_dir = tmp_path / 'bundled'
+    make_bundle(bundled_dir, 'alpha', b'alpha')
+    make_bundle(bundled_dir, 'beta', b'beta')
+    uploader = make_uploader(bundled_dir)
+    assert uploader.upload_all()
+    alpha_key = 'core/packages/alpha-1.0-any-none-any.mhl.mip.json'
+    beta_key = 'core/packages/beta-1.0-any-none-any.mhl.mip.json'
+    gamma_key = 'core/packages/gamma-1.0-any-none-any.mhl.mip.json'
+
+    # The journal goes out of sync: beta's .mip.json is deleted
+    assert sorted(IndexAssembler()._list_mip_json_files()) == [alpha_key, beta_key]
+    uploader.s3_client.delete_object(Bucket=BUCKET, Key=beta_key)
+
+    # gamma is uploaded while the bucket is being listed
+    assembler = IndexAssembler(full_listing=True)
+    list_bucket = assembler._list_bucket
+
+    def list_during_upload():
+        entries = list_bucket()
+        make_bundle(bundled_dir, 'gamma', b'gamma')
+        assert make_uploader(bundled_dir).upload_all()
+        assert uploader.journal.load() == (None, None)  # incomplete
+        return entries
+
+    assembler._list_bucket = list_during_upload
+    assert sorted(assembler._list_mip_json_files()) == [alpha_key, gamma_key]
+    entries, _ = uploader.journal.load()
+    assert sorted(entries) == [alpha_key, gamma_key]
+
+    # A .mip.json deleted after it was journaled is dropped when assembling
+    uploader.s3_client.delete_object(Bucket=BUCKET, Key=gamma_key)
+    assembler = IndexAssembler()
+    assert sorted(assembler._list_mip_json_files()) == [alpha_key, gamma_key]
+    assert assembler._download_mip_json(gamma_key) is None
+    assembler._remove_missing_from_journal()
+    entries, _ = uploader.journal.load()
+    assert sorted(entries) == [alpha_key]
+
+
+@pytest.mark.parametrize('content_addressed', [False, True])
+def test_layers_only_builds_upload_no_full_archive(s3, tmp_path, content_addressed):
+    from assemble_index import IndexAssembler
+
+    bundled_dir = tmp_path / 'bundled'
+    mhl_path = make_bundle(bundled_dir, 'alpha', b'full archive')
+    (bundled_dir / 'alpha-1.0.base-0123456789abcdef.zip').write_bytes(b'base')
+    (bundled_dir / 'overlay.zip').write_bytes(b'overlay')
+    Path(f"{mhl_path}.mip.json").write_text(json.dumps({'name': 'alpha', 'layers_only': True, 'layers': [
+        {'role': 'base', 'filename': 'alpha-1.0.base-0123456789abcdef.zip', 'size': 4,
+         'sha256': hashlib.sha256(b'base').hexdigest()},
+        {'role': 'overlay', 'filename': 'overlay.zip'},
+    ]}))
+
+    uploader = make_uploader(bundled_dir, content_addressed=content_addressed)
+    assert uploader.upload_all()
+
+    keys = [obj['Key'] for obj in uploader.s3_client.list_objects_v2(Bucket=BUCKET)['Contents']]
+    assert not any(key.endswith('.mhl') for key in keys)
+    assert any(key.endswith('overlay.zip') for key in keys)
+    metadata = IndexAssembler()._download_mip_json(f"core/packages/{mhl_path.name}.mip.json")
+    assert 'mhl_url' not in metadata and 'mhl_key' not in metadata
+    assert all(layer['url'] for layer in metadata['layers'])